@@ -11,7 +11,8 @@ from skyportal.handlers.api import (
     GroupHandler, GroupUserHandler,
     InstrumentHandler,
     NewsFeedHandler,
-    PhotometryHandler,
+    PhotometryHandler, PhotometryBatchHandler, PhotometryJobHandler,
+    PhotometryStreamHandler,
     SourceHandler, SourcePhotometryHandler, SourceOffsetsHandler,
     SourceFinderHandler,
     SpectrumHandler,
@@ -21,7 +22,8 @@ from skyportal.handlers.api import (
     UserHandler
 )
 from skyportal.handlers.api.internal import (
-    PlotPhotometryHandler, PlotSpectroscopyHandler, SourceViewsHandler,
+    PlotPhotometryHandler, PlotSpectroscopyHandler, PlotModelsHandler,
+    SourceViewsHandler,
     TokenHandler, DBInfoHandler, ProfileHandler, InstrumentObservationParamsHandler
 )
 
@@ -60,6 +62,9 @@ def make_app(cfg, baselayer_handlers, baselayer_settings):
         (r'/api/groups(/.*)?', GroupHandler),
         (r'/api/instrument(/[0-9]+)?', InstrumentHandler),
         (r'/api/newsfeed', NewsFeedHandler),
+        (r'/api/photometry/batch', PhotometryBatchHandler),
+        (r'/api/photometry/jobs/([0-9]+)', PhotometryJobHandler),
+        (r'/api/photometry/stream', PhotometryStreamHandler),
         (r'/api/photometry(/[0-9]+)?', PhotometryHandler),
         (r'/api/sources(/[0-9A-Za-z-]+)/photometry', SourcePhotometryHandler),
         (r'/api/sources(/[0-9A-Za-z-]+)/offsets', SourceOffsetsHandler),
@@ -77,6 +82,7 @@ def make_app(cfg, baselayer_handlers, baselayer_settings):
         (r'/api/internal/source_views(/.*)?', SourceViewsHandler),
         (r'/api/internal/plot/photometry/(.*)', PlotPhotometryHandler),
         (r'/api/internal/plot/spectroscopy/(.*)', PlotSpectroscopyHandler),
+        (r'/api/internal/plot/models/([0-9a-f]+)\.js', PlotModelsHandler),
         (r'/api/internal/instrument_obs_params', InstrumentObservationParamsHandler),
 
         (r'/become_user(/.*)?', BecomeUserHandler),
@@ -94,6 +100,7 @@ def make_app(cfg, baselayer_handlers, baselayer_settings):
 
     app = tornado.web.Application(handlers, **settings)
     models.init_db(**cfg['database'])
+    models.IDENTITY_CACHE.ttl = cfg['misc.identity_cache_ttl']
     model_util.create_tables()
     model_util.setup_permissions()
     app.cfg = cfg
@@ -5,7 +5,9 @@ from .followup_request import FollowupRequestHandler
 from .group import GroupHandler, GroupUserHandler
 from .instrument import InstrumentHandler
 from .news_feed import NewsFeedHandler
-from .photometry import PhotometryHandler, SourcePhotometryHandler
+from .photometry import (PhotometryHandler, PhotometryBatchHandler,
+                         PhotometryJobHandler, PhotometryStreamHandler,
+                         SourcePhotometryHandler)
 from .source import (SourceHandler, SourceOffsetsHandler, SourceFinderHandler)
 from .spectrum import SpectrumHandler
 from .sysinfo import SysInfoHandler
@@ -1,6 +1,16 @@
+import base64
+import binascii
+from collections import OrderedDict
+import json
+import time
+import threading
+
 import arrow
 
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import joinedload
+from sqlalchemy.sql.expression import ClauseElement, Executable
 from marshmallow.exceptions import ValidationError
 
 from baselayer.app.access import auth_or_token, permissions
@@ -14,6 +24,8 @@ from ...models import (
     Instrument,
     Source,
     Filter,
+    user_group_ids,
+    user_filter_ids,
 )
 
 
@@ -48,13 +60,24 @@ class CandidateHandler(BaseHandler):
             schema:
               type: integer
             description: |
-              Number of candidates to return per paginated request. Defaults to 25
+              Number of candidates to return per paginated request. Defaults to 25. Max 1000.
           - in: query
             name: pageNumber
             nullable: true
             schema:
               type: integer
             description: Page number for paginated query results. Defaults to 1
+          - in: query
+            name: cursor
+            nullable: true
+            schema:
+              type: string
+            description: |
+              Opaque token from the `nextCursor` of a previous response, to get the
+              following page. Pass an empty cursor to get the first page. Pages are
+              then found from the (last_detected, id) of the previous page instead
+              of an offset, so deep pages are as fast as the first one, and
+              `pageNumber` and `totalMatches` are ignored.
           - in: query
             name: totalMatches
             nullable: true
@@ -132,6 +155,11 @@ class CandidateHandler(BaseHandler):
                                           type: boolean
                               totalMatches:
                                 type: integer
+                              totalMatchesApproximate:
+                                type: boolean
+                                description: |
+                                  Whether totalMatches is the database's estimate for a
+                                  large number of matches rather than an exact count.
                               pageNumber:
                                 type: integer
                               lastPage:
@@ -140,6 +168,12 @@ class CandidateHandler(BaseHandler):
                                 type: integer
                               numberingEnd:
                                 type: integer
+                              nextCursor:
+                                type: string
+                                nullable: true
+                                description: |
+                                  Cursor of the next page, if `cursor` was given. Null on
+                                  the last page.
             400:
               content:
                 application/json:
@@ -153,6 +187,7 @@ class CandidateHandler(BaseHandler):
 
         page_number = self.get_query_argument("pageNumber", None) or 1
         n_per_page = self.get_query_argument("numPerPage", None) or 25
+        cursor = self.get_query_argument("cursor", None)
         unsaved_only = self.get_query_argument("unsavedOnly", False)
         total_matches = self.get_query_argument("totalMatches", None)
         start_date = self.get_query_argument("startDate", None)
@@ -181,14 +216,18 @@ class CandidateHandler(BaseHandler):
             ]
         else:
             # If 'groupIDs' & 'filterIDs' params not present in request, use all user groups
-            group_ids = [g.id for g in self.current_user.groups]
-            filter_ids = [
-                g.filter.id for g in self.current_user.groups if g.filter is not None
-            ]
+            group_ids = user_group_ids(self.current_user)
+            filter_ids = user_filter_ids(self.current_user)
         try:
             page = int(page_number)
         except ValueError:
             return self.error("Invalid page number value.")
+        try:
+            n_per_page = min(int(n_per_page), 1000)
+        except ValueError:
+            return self.error("Invalid numPerPage value.")
+        if n_per_page < 1:
+            return self.error("numPerPage must be positive.")
         q = (
             Obj.query.options(
                 [
@@ -222,14 +261,35 @@ class CandidateHandler(BaseHandler):
         if end_date is not None and end_date.strip() not in ["", "null", "undefined"]:
             end_date = arrow.get(end_date).datetime
             q = q.filter(Obj.last_detected <= end_date)
-        try:
-            query_results = grab_query_results_page(
-                q, total_matches, page, n_per_page, "candidates"
+        if cursor is not None:
+            try:
+                query_results = grab_query_results_cursor(
+                    q, cursor, n_per_page, "candidates"
+                )
+            except ValueError as e:
+                return self.error(str(e))
+        else:
+            count_key = (
+                "candidates",
+                tuple(sorted(set(group_ids))),
+                tuple(sorted(set(filter_ids))),
+                unsaved_only == "true",
+                str(start_date),
+                str(end_date),
             )
-        except ValueError as e:
-            if "Page number out of range" in str(e):
-                return self.error("Page number out of range.")
-            raise
+            try:
+                query_results = grab_query_results_page(
+                    q, total_matches, page, n_per_page, "candidates",
+                    count_cache=match_count_cache(
+                        self.cfg["misc.match_count_ttl"],
+                        self.cfg["misc.match_count_estimate_threshold"],
+                    ),
+                    count_key=count_key,
+                )
+            except ValueError as e:
+                if "Page number out of range" in str(e):
+                    return self.error("Page number out of range.")
+                raise
         matching_source_ids = (
             DBSession.query(Source.obj_id)
             .filter(Source.obj_id.in_([obj.id for obj in query_results["candidates"]]))
@@ -316,6 +376,7 @@ class CandidateHandler(BaseHandler):
             ]
         )
         DBSession().commit()
+        invalidate_match_counts()
 
         self.push_all(action="skyportal/FETCH_CANDIDATES")
         return self.success(data={"id": obj.id})
@@ -360,6 +421,7 @@ class CandidateHandler(BaseHandler):
                 "Invalid/missing parameters: " f"{e.normalized_messages()}"
             )
         DBSession().commit()
+        invalidate_match_counts()
 
         self.push_all(action="skyportal/FETCH_CANDIDATES")
         return self.success()
@@ -368,13 +430,128 @@ class CandidateHandler(BaseHandler):
     # candidates will automatically be deleted by cron job.
 
 
-def grab_query_results_page(q, total_matches, page, n_items_per_page, items_name):
+class MatchCountCache:
+    """Counts of the matches of the paginated source and candidate queries.
+
+    Counts are cached for `ttl` seconds by a key identifying the query, e.g.
+    the listing, the caller's group IDs and the filter parameters. Writes
+    to sources, candidates and photometry made by this process drop all
+    counts (see `invalidate`), from ingest threads too; writes made by other
+    app processes show up once the counts expire.
+
+    Exact counts repeat the whole query, so when the Postgres planner
+    estimates more than `estimate_threshold` matches, its estimate is used
+    instead and flagged as approximate.
+
+    Parameters
+    ----------
+    ttl : float
+        Time, in seconds, for which counts are reused.
+    estimate_threshold : int
+        Planner estimate above which rows are not counted.
+    max_entries : int, optional
+        Number of counts kept.
+    """
+
+    def __init__(self, ttl, estimate_threshold, max_entries=1024):
+        self.ttl = ttl
+        self.estimate_threshold = estimate_threshold
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def count(self, q, key):
+        """Return `(count, approximate)` for the query `q` identified by
+        `key`."""
+        now = time.monotonic()
+        with self.lock:
+            if key in self.entries:
+                expires, value = self.entries[key]
+                if expires > now:
+                    return value
+                del self.entries[key]
+
+        q = q.enable_eagerloads(False).order_by(None)
+        estimate = estimate_count(q)
+        if estimate > self.estimate_threshold:
+            value = (estimate, True)
+        else:
+            value = (q.count(), False)
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self):
+        """Drop all counts, after sources, candidates or photometry were
+        written."""
+        with self.lock:
+            self.entries.clear()
+
+
+class Explain(Executable, ClauseElement):
+    """`EXPLAIN (FORMAT JSON)` of a statement.
+
+    Compiled along with the statement, so that its bind parameters go
+    through the bind processors of their types (e.g., for Arrow dates).
+    """
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, 'postgresql')
+def compile_explain(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+def estimate_count(q):
+    """Number of rows of `q` estimated by the Postgres planner."""
+    plan = DBSession().connection().execute(Explain(q.statement)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+# match counts of this process, created on first use
+MATCH_COUNT_CACHE = None
+
+
+def match_count_cache(ttl, estimate_threshold):
+    """Return the cache of match counts, creating it if needed."""
+    global MATCH_COUNT_CACHE
+    if MATCH_COUNT_CACHE is None:
+        MATCH_COUNT_CACHE = MatchCountCache(ttl, estimate_threshold)
+    return MATCH_COUNT_CACHE
+
+
+def invalidate_match_counts():
+    """Drop the match counts of this process, if any, after sources,
+    candidates or photometry (which moves `last_detected`) were written."""
+    if MATCH_COUNT_CACHE is not None:
+        MATCH_COUNT_CACHE.invalidate()
+
+
+def grab_query_results_page(q, total_matches, page, n_items_per_page,
+                            items_name, count_cache=None, count_key=None):
+    """Return a page of the results of `q`.
+
+    Unless the client provided `total_matches`, the matches are counted
+    with `count_cache` if given, under `count_key`, and with `q.count()`
+    otherwise. If the count is approximate, `totalMatchesApproximate` is
+    set and the page itself decides whether it is the last one.
+    """
     info = {}
+    approximate = False
     if total_matches:
         info["totalMatches"] = int(total_matches)
+    elif count_cache is not None:
+        info["totalMatches"], approximate = count_cache.count(q, count_key)
     else:
         info["totalMatches"] = q.count()
-    if (
+    info["totalMatchesApproximate"] = approximate
+    if page <= 0 or (not approximate and (
         (
             (
                 info["totalMatches"] < (page - 1) * n_items_per_page
@@ -386,18 +563,74 @@ def grab_query_results_page(q, total_matches, page, n_items_per_page, items_name
             )
             and info["totalMatches"] != 0
         )
-        or page <= 0
         or (info["totalMatches"] == 0 and page != 1)
-    ):
+    )):
         raise ValueError("Page number out of range.")
-    info[items_name] = (
-        q.limit(n_items_per_page).offset((page - 1) * n_items_per_page).all()
-    )
+    if approximate:
+        items = (
+            q.limit(n_items_per_page + 1)
+            .offset((page - 1) * n_items_per_page).all()
+        )
+        info[items_name] = items[:n_items_per_page]
+        info["lastPage"] = len(items) <= n_items_per_page
+    else:
+        info[items_name] = (
+            q.limit(n_items_per_page).offset((page - 1) * n_items_per_page).all()
+        )
+        info["lastPage"] = info["totalMatches"] <= page * n_items_per_page
 
     info["pageNumber"] = page
-    info["lastPage"] = info["totalMatches"] <= page * n_items_per_page
     info["numberingStart"] = (page - 1) * n_items_per_page + 1
     info["numberingEnd"] = min(info["totalMatches"], page * n_items_per_page)
-    if info["totalMatches"] == 0:
+    if approximate:
+        info["numberingEnd"] = (
+            (page - 1) * n_items_per_page + len(info[items_name])
+        )
+    if info["totalMatches"] == 0 or (approximate and not info[items_name]):
         info["numberingStart"] = 0
     return info
+
+
+def encode_cursor(obj):
+    """Opaque pagination cursor pointing just after `obj`, in the
+    (last_detected desc, id) order of the paginated queries."""
+    last_detected = (None if obj.last_detected is None
+                     else obj.last_detected.isoformat())
+    return base64.urlsafe_b64encode(
+        json.dumps([last_detected, obj.id]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        last_detected, obj_id = json.loads(base64.urlsafe_b64decode(cursor))
+        if last_detected is not None:
+            last_detected = arrow.get(last_detected)
+    except (binascii.Error, ValueError, TypeError, arrow.parser.ParserError):
+        raise ValueError("Invalid cursor.")
+    return last_detected, obj_id
+
+
+def grab_query_results_cursor(q, cursor, n_items_per_page, items_name):
+    """Return the page of `q` following `cursor` (from the first item if
+    `cursor` is empty), using the (last_detected, id) key instead of an
+    offset, so that every page costs the same whatever its depth.
+
+    `q` must be ordered by `Obj.last_detected.desc().nullslast(), Obj.id`.
+    """
+    if cursor:
+        last_detected, obj_id = decode_cursor(cursor)
+        if last_detected is None:
+            q = q.filter(Obj.last_detected.is_(None), Obj.id > obj_id)
+        else:
+            q = q.filter(sa.or_(
+                Obj.last_detected < last_detected,
+                sa.and_(Obj.last_detected == last_detected, Obj.id > obj_id),
+                Obj.last_detected.is_(None),
+            ))
+    items = q.limit(n_items_per_page + 1).all()
+    info = {items_name: items[:n_items_per_page]}
+    info["lastPage"] = len(items) <= n_items_per_page
+    info["nextCursor"] = (None if info["lastPage"]
+                          else encode_cursor(items[n_items_per_page - 1]))
+    return info
@@ -5,6 +5,8 @@ from ..base import BaseHandler
 from ...models import (
     DBSession,
     Filter,
+    IDENTITY_CACHE,
+    user_group_ids,
 )
 
 
@@ -49,7 +51,7 @@ class FilterHandler(BaseHandler):
             return self.success(data=f)
         filters = (
             DBSession.query(Filter)
-            .filter(Filter.group_id.in_([g.id for g in self.current_user.groups]))
+            .filter(Filter.group_id.in_(user_group_ids(self.current_user)))
             .all()
         )
         return self.success(data=filters)
@@ -89,6 +91,7 @@ class FilterHandler(BaseHandler):
             )
         DBSession.add(fil)
         DBSession().commit()
+        IDENTITY_CACHE.invalidate()
 
         return self.success(data={"id": fil.id})
 
@@ -126,6 +129,7 @@ class FilterHandler(BaseHandler):
             return self.error('Invalid/missing parameters: '
                               f'{e.normalized_messages()}')
         DBSession().commit()
+        IDENTITY_CACHE.invalidate()
         return self.success()
 
     @permissions(["Manage groups"])
@@ -147,5 +151,6 @@ class FilterHandler(BaseHandler):
         """
         DBSession.delete(Filter.query.get(filter_id))
         DBSession().commit()
+        IDENTITY_CACHE.invalidate()
 
         return self.success()
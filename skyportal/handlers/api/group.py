@@ -3,7 +3,8 @@ from sqlalchemy.orm import joinedload
 from marshmallow.exceptions import ValidationError
 from baselayer.app.access import permissions, auth_or_token
 from ..base import BaseHandler
-from ...models import DBSession, Group, GroupUser, User, Token
+from ...models import (DBSession, Group, GroupUser, User, Token,
+                       IDENTITY_CACHE, user_group_ids, user_acl_ids)
 
 
 class GroupHandler(BaseHandler):
@@ -72,15 +73,15 @@ class GroupHandler(BaseHandler):
                   schema: Error
         """
         if group_id is not None:
-            if 'Manage groups' in [acl.id for acl in self.current_user.acls]:
+            if 'Manage groups' in user_acl_ids(self.current_user):
                 group = Group.query.options(joinedload(Group.users)).options(
                     joinedload(Group.group_users)).get(group_id)
             else:
                 group = Group.query.options([
                     joinedload(Group.users).load_only(User.id, User.username)]
                 ).get(group_id)
-                if group is not None and group.id not in [
-                        g.id for g in self.current_user.groups]:
+                if group is not None and group.id not in user_group_ids(
+                        self.current_user):
                     return self.error('Insufficient permissions.')
             if group is not None:
                 group = group.to_dict()
@@ -147,6 +148,7 @@ class GroupHandler(BaseHandler):
         DBSession().add_all(
             [GroupUser(group=g, user=user, admin=True) for user in group_admins])
         DBSession().commit()
+        IDENTITY_CACHE.invalidate()
 
         self.push_all(action='skyportal/FETCH_GROUPS')
         return self.success(data={"id": g.id})
@@ -185,6 +187,7 @@ class GroupHandler(BaseHandler):
             return self.error('Invalid/missing parameters: '
                               f'{e.normalized_messages()}')
         DBSession().commit()
+        IDENTITY_CACHE.invalidate()
 
         return self.success(action='skyportal/FETCH_GROUPS')
 
@@ -208,6 +211,7 @@ class GroupHandler(BaseHandler):
         g = Group.query.get(group_id)
         DBSession().delete(g)
         DBSession().commit()
+        IDENTITY_CACHE.invalidate()
 
         self.push_all(action='skyportal/REFRESH_GROUP', payload={'group_id': int(group_id)})
         self.push_all(action='skyportal/FETCH_GROUPS')
@@ -275,6 +279,7 @@ class GroupUserHandler(BaseHandler):
         gu.admin = data['admin']
         DBSession().add(gu)
         DBSession().commit()
+        IDENTITY_CACHE.invalidate(user_id)
 
         self.push_all(action='skyportal/REFRESH_GROUP',
                       payload={'group_id': gu.group_id})
@@ -307,6 +312,7 @@ class GroupUserHandler(BaseHandler):
         (GroupUser.query.filter(GroupUser.group_id == group_id)
          .filter(GroupUser.user_id == user_id).delete())
         DBSession().commit()
+        IDENTITY_CACHE.invalidate(user_id)
         self.push_all(action='skyportal/REFRESH_GROUP',
                       payload={'group_id': int(group_id)})
         return self.success()
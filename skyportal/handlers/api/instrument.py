@@ -1,7 +1,8 @@
 from marshmallow.exceptions import ValidationError
 from baselayer.app.access import permissions, auth_or_token
 from ..base import BaseHandler
-from ...models import DBSession, Instrument, Telescope, GroupTelescope
+from ...models import (DBSession, Instrument, Telescope, GroupTelescope,
+                       user_group_ids)
 from ...phot_enum import ALLOWED_BANDPASSES
 
 
@@ -74,7 +75,7 @@ class InstrumentHandler(BaseHandler):
             return self.success(data=instrument)
         query = Instrument.query.filter(Instrument.telescope_id.in_(
             DBSession().query(GroupTelescope.telescope_id).filter(GroupTelescope.group_id.in_(
-                [g.id for g in self.current_user.groups]
+                user_group_ids(self.current_user)
             ))))
         return self.success(data=query.all())
 
@@ -1,4 +1,5 @@
-from .plot import PlotPhotometryHandler, PlotSpectroscopyHandler
+from .plot import (PlotPhotometryHandler, PlotSpectroscopyHandler,
+                   PlotModelsHandler)
 from .token import TokenHandler
 from .dbinfo import DBInfoHandler
 from .profile import ProfileHandler
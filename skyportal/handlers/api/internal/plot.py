@@ -1,32 +1,328 @@
+import os
+import json
+import asyncio
+import hashlib
+import functools
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from tornado.ioloop import IOLoop
+
 from baselayer.app.access import auth_or_token
 from ...base import BaseHandler
 from .... import plot
+from ....models import DBSession, Obj
 
 
-# TODO this should distinguish between "no data to plot" and "plot failed"
-class PlotPhotometryHandler(BaseHandler):
-    @auth_or_token
-    def get(self, obj_id):
-        height = self.get_query_argument("plotHeight", 300)
-        width = self.get_query_argument("plotWidth", 600)
-        docs_json, render_items, custom_model_js = plot.photometry_plot(
-            obj_id, height=int(height), width=int(width),
+# process pool building Bokeh documents, created on first use
+PLOT_EXECUTOR = None
+
+
+def plot_executor(max_workers):
+    """Return the plot process pool, creating it if needed.
+
+    Workers only ever run the functions of `skyportal.plot` that do not
+    touch the database. They are started by a fork server, rather than
+    forked from the app process, so that they do not inherit its threads,
+    locks or database connections; the server imports `skyportal.plot`
+    once, so starting a worker stays cheap.
+    """
+    global PLOT_EXECUTOR
+    if PLOT_EXECUTOR is None:
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['skyportal.plot'])
+        PLOT_EXECUTOR = ProcessPoolExecutor(max_workers=max_workers,
+                                            mp_context=context)
+    return PLOT_EXECUTOR
+
+
+# version of the format of cached plots, part of the on-disk file names so
+# that entries written by older versions of the app are not read; bump it
+# whenever the value returned by the `*_figure` functions changes shape, or
+# their callbacks change behavior
+PLOT_CACHE_VERSION = 3
+
+
+class PlotCache:
+    """LRU cache of rendered plots, with an optional on-disk tier shared by
+    the app processes of a host.
+
+    Every entry is stored with the `Obj.data_revision` it was rendered
+    from, and only returned for that revision. Writes to the photometry or
+    spectra of an object bump its revision, so stale entries are never
+    served and are simply replaced on the next render.
+
+    Parameters
+    ----------
+    max_entries : int
+        Number of plots kept in memory.
+    directory : str, optional
+        Directory of the on-disk tier. If None, only memory is used.
+    """
+
+    def __init__(self, max_entries, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory,
+                            f'{digest}.v{PLOT_CACHE_VERSION}.json')
+
+    def get(self, key, revision):
+        """Return the plot cached for `key` at `revision`, or None."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            entry_revision, value = self.entries[key]
+            if entry_revision == revision:
+                return value
+
+        if self.directory is not None:
+            try:
+                with open(self._path(key)) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            if entry['revision'] == revision:
+                value = tuple(entry['plot'])
+                self._remember(key, revision, value)
+                return value
+
+        return None
+
+    def put(self, key, revision, value):
+        """Cache the plot `value` for `key` at `revision`."""
+        self._remember(key, revision, value)
+        if self.directory is not None:
+            path = self._path(key)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': repr(key), 'revision': revision,
+                           'plot': value}, f)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, revision, value):
+        self.entries[key] = (revision, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# plot cache of this process, created on first use
+PLOT_CACHE = None
+
+
+def plot_cache(max_entries, directory=None):
+    """Return the plot cache, creating it if needed."""
+    global PLOT_CACHE
+    if PLOT_CACHE is None:
+        PLOT_CACHE = PlotCache(max_entries, directory)
+    return PLOT_CACHE
+
+
+# the custom Bokeh model JS, and its content hash, computed on first use
+CUSTOM_MODEL_JS = None
+
+
+# light curve pyramids of this process, created on first use
+PYRAMID_CACHE = None
+
+
+def pyramid_cache(max_entries):
+    """Return the cache of light curve pyramids, creating it if needed.
+
+    Pyramids are kept in memory only, by `Obj.data_revision`, like plots.
+    """
+    global PYRAMID_CACHE
+    if PYRAMID_CACHE is None:
+        PYRAMID_CACHE = PlotCache(max_entries)
+    return PYRAMID_CACHE
+
+
+class PlotHandler(BaseHandler):
+    async def run_in_plot_executor(self, figure_function, *args, **kwargs):
+        """Run `figure_function(*args, **kwargs)` in the plot process pool,
+        without blocking the IOLoop, and return its result.
+
+        Raises `asyncio.TimeoutError` after `misc.plot_timeout` seconds.
+        """
+        executor = plot_executor(self.cfg['misc.plot_processes'])
+        future = IOLoop.current().run_in_executor(
+            executor, functools.partial(figure_function, *args, **kwargs)
         )
+        return await asyncio.wait_for(future, self.cfg['misc.plot_timeout'])
+
+    async def custom_model_js(self):
+        """Return the custom Bokeh model JS of the plots and its content hash.
+
+        The JS is compiled in the plot process pool on first use, and kept
+        for the lifetime of the process.
+        """
+        global CUSTOM_MODEL_JS
+        if CUSTOM_MODEL_JS is None:
+            js = await self.run_in_plot_executor(plot.custom_model_js)
+            CUSTOM_MODEL_JS = (js, hashlib.sha256(js.encode()).hexdigest()[:20])
+        return CUSTOM_MODEL_JS
+
+    async def plot(self, url, key, revision, data_function, figure_function,
+                   **kwargs):
+        """Respond with a plot, tagged with `url`.
+
+        The plot is taken from the plot cache if it holds `key` at
+        `revision`. Otherwise it is built by
+        `figure_function(*data_function(), **kwargs)` in the plot process
+        pool, and cached unless `revision` is None. `data_function` may be
+        a coroutine function.
+
+        The custom Bokeh model JS needed to render the plot is not included,
+        but referenced by a content-hashed URL, so that browsers fetch it
+        only once.
+        """
+        cache = plot_cache(self.cfg['misc.plot_cache_size'],
+                           self.cfg['misc.plot_cache_dir'])
+        result = cache.get(key, revision)
+        if result is None:
+            try:
+                data = data_function()
+                if asyncio.iscoroutine(data):
+                    data = await data
+                result = await self.run_in_plot_executor(
+                    figure_function, *data, **kwargs
+                )
+            except asyncio.TimeoutError:
+                return self.error('Plot timed out.')
+            if revision is not None:
+                cache.put(key, revision, result)
+
+        docs_json, render_items = result
         if docs_json is None:
-            self.success(data={'docs_json': None, 'url': self.request.path})
+            return self.success(data={'docs_json': None,
+                                      'url': self.request.path})
+
+        try:
+            _, digest = await self.custom_model_js()
+        except asyncio.TimeoutError:
+            return self.error('Plot timed out.')
+        self.success(data={'docs_json': docs_json, 'render_items': render_items,
+                           'custom_model_js_url':
+                           f'/api/internal/plot/models/{digest}.js',
+                           'url': url})
+
+
+class PlotModelsHandler(PlotHandler):
+    async def get(self, digest):
+        """Serve the custom Bokeh model JS of the plots.
+
+        The URL holds the hash of the JS, so the response can be cached
+        forever. A stale hash (e.g., from before an upgrade) gets the
+        current JS, but uncached.
+        """
+        try:
+            js, current_digest = await self.custom_model_js()
+        except asyncio.TimeoutError:
+            return self.error('Plot timed out.')
+        self.set_header('Content-Type', 'application/javascript; charset=utf-8')
+        if digest == current_digest:
+            self.set_header('Cache-Control',
+                            'public, max-age=31536000, immutable')
         else:
-            self.success(data={'docs_json': docs_json, 'render_items': render_items,
-                               'custom_model_js': custom_model_js,
-                               'url': self.request.uri})
+            self.set_header('Cache-Control', 'no-cache')
+        self.write(js)
 
 
-class PlotSpectroscopyHandler(BaseHandler):
+# TODO this should distinguish between "no data to plot" and "plot failed"
+class PlotPhotometryHandler(PlotHandler):
     @auth_or_token
-    def get(self, obj_id):
-        docs_json, render_items, custom_model_js = plot.spectroscopy_plot(obj_id)
-        if docs_json is None:
-            self.success(data={'docs_json': None, 'url': self.request.path})
-        else:
-            self.success(data={'docs_json': docs_json, 'render_items': render_items,
-                               'custom_model_js': custom_model_js,
-                               'url': self.request.path})
+    async def get(self, obj_id):
+        """
+        ---
+        description: Plot the photometry of an object
+        parameters:
+          - in: path
+            name: obj_id
+            required: true
+            schema:
+              type: string
+          - in: query
+            name: plotWidth
+            schema:
+              type: integer
+          - in: query
+            name: plotHeight
+            schema:
+              type: integer
+          - in: query
+            name: startMJD
+            schema:
+              type: number
+            description: |
+              Only plot points from this MJD on. Light curves are
+              downsampled to the width of the plot, so zooming in on a
+              window gives a finer resolution.
+          - in: query
+            name: endMJD
+            schema:
+              type: number
+            description: Only plot points up to this MJD.
+          - in: query
+            name: binsize
+            schema:
+              type: number
+            description: |
+              If given, also show the light curves stacked in bins of this
+              many days, computed on the server from all the points.
+        """
+        height = int(self.get_query_argument("plotHeight", 300))
+        width = int(self.get_query_argument("plotWidth", 600))
+        start_mjd = self.get_query_argument("startMJD", None)
+        end_mjd = self.get_query_argument("endMJD", None)
+        try:
+            start_mjd = None if start_mjd is None else float(start_mjd)
+            end_mjd = None if end_mjd is None else float(end_mjd)
+            binsize = float(self.get_query_argument("binsize", 0))
+        except ValueError:
+            return self.error('Invalid startMJD, endMJD or binsize.')
+        if binsize < 0:
+            return self.error('binsize must not be negative.')
+
+        revision = (DBSession().query(Obj.data_revision)
+                    .filter(Obj.id == obj_id).scalar())
+
+        async def data():
+            # only the database read runs here: the pyramid, and the
+            # downsampling and stacking in `photometry_window_figure`, run
+            # in the plot process pool
+            cache = pyramid_cache(self.cfg['misc.plot_cache_size'])
+            pyramid = cache.get(obj_id, revision)
+            if pyramid is None:
+                pyramid = await self.run_in_plot_executor(
+                    plot.photometry_pyramid, plot.photometry_data(obj_id)
+                )
+                if revision is not None:
+                    cache.put(obj_id, revision, pyramid)
+            return (obj_id, pyramid, width, height, start_mjd, end_mjd,
+                    binsize)
+
+        await self.plot(self.request.uri,
+                        ('photometry', obj_id, width, height, start_mjd,
+                         end_mjd, binsize), revision,
+                        data, plot.photometry_window_figure)
+
+
+class PlotSpectroscopyHandler(PlotHandler):
+    @auth_or_token
+    async def get(self, obj_id):
+        # the redshift is part of the key, since the plot shows the lines of
+        # the elements at the redshift of the object
+        revision, redshift = (DBSession()
+                              .query(Obj.data_revision, Obj.redshift)
+                              .filter(Obj.id == obj_id).first()
+                              or (None, None))
+        await self.plot(self.request.path,
+                        ('spectroscopy', obj_id, redshift), revision,
+                        lambda: plot.spectroscopy_data(obj_id),
+                        plot.spectroscopy_figure)
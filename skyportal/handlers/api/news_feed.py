@@ -1,7 +1,7 @@
 from sqlalchemy import desc
 from baselayer.app.access import auth_or_token
 from ..base import BaseHandler
-from ...models import DBSession, Source, Comment
+from ...models import DBSession, Source, Comment, user_group_ids
 
 
 class NewsFeedHandler(BaseHandler):
@@ -44,7 +44,7 @@ class NewsFeedHandler(BaseHandler):
         def fetch_newest(model):
             return model.query.filter(model.obj_id.in_(
                 DBSession.query(Source.obj_id).filter(
-                    Source.group_id.in_([g.id for g in self.current_user.groups])
+                    Source.group_id.in_(user_group_ids(self.current_user))
                 ))).order_by(desc(model.created_at or model.saved_at)).limit(n_items).all()
 
         sources = fetch_newest(Source)
@@ -1,19 +1,34 @@
+import csv
+import json
+import codecs
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 import numpy as np
 import arrow
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as psql
 from astropy.time import Time
-from astropy.table import Table
 import pandas as pd
 from marshmallow.exceptions import ValidationError
+from tornado.ioloop import IOLoop
+from tornado.web import stream_request_body
 from baselayer.app.access import permissions, auth_or_token
 from ..base import BaseHandler
+from .candidate import invalidate_match_counts
 from ...models import (
-    DBSession, Photometry, Instrument, Source, Obj,
-    PHOT_ZP, PHOT_SYS, Thumbnail
+    DBSession, Photometry, DeletedPhotometry, PhotometryIngestJob, Instrument,
+    Source, Obj, Token, PHOT_ZP, PHOT_SYS, Thumbnail, bump_data_revision,
+    user_group_ids
 )
 
 from ...schema import (PhotometryMag, PhotometryFlux)
-from ...phot_enum import ALLOWED_MAGSYSTEMS
-import sncosmo
+from ...phot_enum import ALLOWED_MAGSYSTEMS, ALLOWED_BANDPASSES
+from ...utils.photometry import (
+    mag_to_flux, normalize_flux, magsys_corrections, stack_photometry
+)
 
 def nan_to_none(value):
     """Coerce a value to None if it is nan, else return value."""
@@ -26,67 +41,684 @@ def allscalar(d):
     return all(np.isscalar(v) or v is None for v in d.values())
 
 
-def serialize(phot, outsys, format):
-
-    retval = {
-        'obj_id': phot.obj_id,
-        'ra': phot.ra,
-        'dec': phot.dec,
-        'filter': phot.filter,
-        'mjd': phot.mjd,
-        'instrument_id': phot.instrument_id,
-        'ra_unc': phot.ra_unc,
-        'dec_unc': phot.dec_unc
-    }
-
-    filter = phot.filter
+def convert_photometry(filters, flux, fluxerr, packet_limiting_mag,
+                       packet_magsys, outsys, format):
+    """Convert arrays of photometry from the database to a given magnitude
+    system.
 
-    magsys_db = sncosmo.get_magsystem('ab')
-    outsys = sncosmo.get_magsystem(outsys)
+    Magnitude system corrections come from the `MAGSYS_CORRECTIONS` table, so
+    this is a table lookup plus array arithmetic over the whole light curve.
 
-    relzp_out = 2.5 * np.log10(outsys.zpbandflux(filter))
+    Parameters
+    ----------
+    filters : numpy.ndarray of str
+        Bandpass of each point.
+    flux, fluxerr : numpy.ndarray
+        Fluxes (nan for non-detections) and flux errors in µJy.
+    packet_limiting_mag : numpy.ndarray
+        Limiting magnitude passed in by the user, or nan if none was given.
+    packet_magsys : numpy.ndarray of str
+        Magnitude system of the uploaded packet, used with
+        `packet_limiting_mag`.
+    outsys : str
+        The magnitude or zeropoint system of the output.
+    format : {'mag', 'flux'}
+        Whether to return magnitudes or fluxes.
 
-    # note: these are not the actual zeropoints for magnitudes in the db or
-    # packet, just ones that can be used to derive corrections when
-    # compared to relzp_out
+    Returns
+    -------
+    dict of numpy.ndarray
+        `mag`, `magerr` and `limiting_mag`, or `flux`, `zp` and `fluxerr`.
+    """
+    if format not in ['mag', 'flux']:
+        raise ValueError('Invalid output format specified. Must be one of '
+                         f"['flux', 'mag'], got '{format}'.")
 
-    relzp_db = 2.5 * np.log10(magsys_db.zpbandflux(filter))
-    db_correction = relzp_out - relzp_db
+    # this is the correction from magnitudes in the database to magnitudes in
+    # the output system
+    db_correction = magsys_corrections(outsys, filters)
 
     # this is the zeropoint for fluxes in the database that is tied
     # to the new magnitude system
     corrected_db_zp = PHOT_ZP + db_correction
 
-    if format == 'mag':
-        if phot.original_user_data is not None and 'limiting_mag' in phot.original_user_data:
-            magsys_packet = sncosmo.get_magsystem(phot.original_user_data['magsys'])
-            relzp_packet = 2.5 * np.log10(magsys_packet.zpbandflux(filter))
-            packet_correction = relzp_out - relzp_packet
-            maglimit = phot.original_user_data['limiting_mag']
-            maglimit_out = maglimit + packet_correction
-        else:
-            # calculate the limiting mag
-            fluxerr = phot.fluxerr
-            fivesigma = 5 * fluxerr
-            maglimit_out = -2.5 * np.log10(fivesigma) + corrected_db_zp
-
-        retval.update({
-            'mag': phot.mag + db_correction,
-            'magerr': phot.e_mag,
-            'magsys': 'ab',
-            'limiting_mag': maglimit_out
-        })
-    elif format == 'flux':
-        retval.update({
-            'flux': phot.flux,
+    if format == 'flux':
+        return {'flux': flux, 'zp': corrected_db_zp, 'fluxerr': fluxerr}
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        detected = flux > 0
+        mag = np.where(detected, -2.5 * np.log10(flux) + corrected_db_zp,
+                       np.nan)
+        magerr = np.where(detected & (fluxerr > 0),
+                          (2.5 / np.log(10)) * (fluxerr / flux), np.nan)
+
+        # calculate the limiting mag
+        limiting_mag = -2.5 * np.log10(5 * fluxerr) + corrected_db_zp
+
+    # prefer limiting magnitudes passed in by the user, shifted from the
+    # packet's magnitude system to the output one
+    packet_limits = ~np.isnan(packet_limiting_mag)
+    if packet_limits.any():
+        packet_correction = (
+            db_correction[packet_limits]
+            - magsys_corrections(packet_magsys[packet_limits],
+                                 filters[packet_limits])
+        )
+        limiting_mag[packet_limits] = (packet_limiting_mag[packet_limits]
+                                       + packet_correction)
+
+    return {'mag': mag, 'magerr': magerr, 'limiting_mag': limiting_mag}
+
+
+def nan_to_none_list(array):
+    """Convert an array to a list, with nans (e.g. the magnitude of a
+    non-detection) replaced by None."""
+    return [None if v != v else v for v in np.asarray(array).tolist()]
+
+
+def serialize_photometry(phots, outsys, format):
+    """Serialize a list of photometry points into a given magnitude system.
+
+    Parameters
+    ----------
+    phots : list of Photometry
+        The photometry points to serialize.
+    outsys : str
+        The magnitude or zeropoint system of the output.
+    format : {'mag', 'flux'}
+        Whether to return magnitudes or fluxes.
+
+    Returns
+    -------
+    list of dict
+        One dict per photometry point.
+    """
+    packets = [phot.original_user_data
+               if phot.original_user_data is not None
+               and 'limiting_mag' in phot.original_user_data
+               else {} for phot in phots]
+    columns = convert_photometry(
+        np.array([phot.filter for phot in phots], dtype=str),
+        np.array([phot.flux for phot in phots], dtype=float),
+        np.array([phot.fluxerr for phot in phots], dtype=float),
+        np.array([p.get('limiting_mag') for p in packets], dtype=float),
+        np.array([p.get('magsys', '') for p in packets], dtype=str),
+        outsys, format
+    )
+    columns = {key: nan_to_none_list(value) for key, value in columns.items()}
+
+    retvals = []
+    for i, phot in enumerate(phots):
+        retval = {
+            'id': phot.id,
+            'obj_id': phot.obj_id,
+            'ra': phot.ra,
+            'dec': phot.dec,
+            'filter': phot.filter,
+            'mjd': phot.mjd,
+            'instrument_id': phot.instrument_id,
+            'ra_unc': phot.ra_unc,
+            'dec_unc': phot.dec_unc,
             'magsys': 'ab',
-            'zp': corrected_db_zp,
-            'fluxerr': phot.fluxerr
-        })
+        }
+        retval.update({key: value[i] for key, value in columns.items()})
+        retvals.append(retval)
+    return retvals
+
+
+def _photometry_arrays(criteria, outsys, format, fields):
+    """Run a single query for the photometry matching `criteria`, ordered by
+    object and MJD, and convert it to a given magnitude system.
+
+    Returns one numpy array per entry of `fields`, with the flux columns
+    replaced by the output of `convert_photometry`.
+    """
+    rows = (
+        DBSession().query(
+            *[getattr(Photometry, field) for field in fields],
+            Photometry.original_user_data['limiting_mag'].astext,
+            Photometry.original_user_data['magsys'].astext
+        )
+        .filter(*criteria)
+        .order_by(Photometry.obj_id, Photometry.mjd)
+        .all()
+    )
+    data = list(zip(*rows)) or [()] * (len(fields) + 2)
+    dtypes = {'id': np.int64, 'instrument_id': np.int64, 'filter': str,
+              'obj_id': str}
+    arrays = {field: np.array(values, dtype=dtypes.get(field, float))
+              for field, values in zip(fields, data)}
+    packet_limiting_mag = np.array(data[-2], dtype=float)
+    packet_magsys = np.array([m or '' for m in data[-1]], dtype=str)
+
+    converted = convert_photometry(
+        arrays['filter'], arrays.pop('flux'), arrays.pop('fluxerr'),
+        packet_limiting_mag, packet_magsys, outsys, format
+    )
+    arrays.update(converted)
+    return arrays
+
+
+# fields read by `photometry_arrays`, before conversion of the fluxes
+PHOT_ARRAY_FIELDS = ['id', 'mjd', 'filter', 'instrument_id', 'ra', 'dec',
+                     'ra_unc', 'dec_unc', 'flux', 'fluxerr']
+
+
+def change_cursor():
+    """Return a change cursor: every transaction whose writes are not yet
+    visible has an ID at least this large.
+
+    This is the oldest transaction still running, so a poll for the rows
+    with `txid` at least the cursor returned by the previous poll cannot
+    miss rows committed late by long transactions. It may return rows
+    again, which clients deduplicate by ID.
+    """
+    return DBSession().execute(
+        sa.select([sa.func.txid_snapshot_xmin(sa.func.txid_current_snapshot())])
+    ).scalar()
+
+
+def changed_since(model, since):
+    """Criterion selecting the rows of `model` (`Photometry` or
+    `DeletedPhotometry`) written since `since`: a cursor from
+    `change_cursor`, or a datetime for the first poll of a client."""
+    if isinstance(since, int):
+        return model.txid >= since
+    return model.modified > since
+
+
+def photometry_arrays(obj_id, outsys, format, since=None):
+    """Read the photometry of an object straight from the database into
+    arrays and convert it to a given magnitude system, without building
+    `Photometry` objects.
+
+    Parameters
+    ----------
+    obj_id : str
+        ID of the Obj whose photometry to fetch.
+    outsys : str
+        The magnitude or zeropoint system of the output.
+    format : {'mag', 'flux'}
+        Whether to return magnitudes or fluxes.
+    since : int or datetime.datetime, optional
+        Only return points written since this change cursor or modified
+        after this time (see `changed_since`).
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        One array per field, ordered by MJD. Nulls are nans.
+    """
+    criteria = [Photometry.obj_id == obj_id]
+    fields = PHOT_ARRAY_FIELDS
+    if since is not None:
+        criteria.append(changed_since(Photometry, since))
+    return _photometry_arrays(criteria, outsys, format, fields)
+
+
+def batch_photometry_arrays(obj_ids, outsys, format, filters=None,
+                            start_mjd=None, end_mjd=None):
+    """Fetch the photometry of several objects with one ordered scan.
+
+    Parameters
+    ----------
+    obj_ids : list of str
+        IDs of the Objs whose photometry to fetch.
+    outsys : str
+        The magnitude or zeropoint system of the output.
+    format : {'mag', 'flux'}
+        Whether to return magnitudes or fluxes.
+    filters : list of str, optional
+        Only return photometry in these bandpasses.
+    start_mjd, end_mjd : float, optional
+        Only return photometry within this (inclusive) MJD range.
+
+    Returns
+    -------
+    dict of (str, dict of numpy.ndarray)
+        For each object in `obj_ids`, the arrays `photometry_arrays` would
+        return for it, restricted to the given filters and dates.
+    """
+    criteria = [Photometry.obj_id.in_(obj_ids)]
+    if filters is not None:
+        criteria.append(Photometry.filter.in_(filters))
+    if start_mjd is not None:
+        criteria.append(Photometry.mjd >= start_mjd)
+    if end_mjd is not None:
+        criteria.append(Photometry.mjd <= end_mjd)
+    arrays = _photometry_arrays(criteria, outsys, format,
+                                ['obj_id'] + PHOT_ARRAY_FIELDS)
+
+    # rows are ordered by object, so each object is one contiguous slice
+    row_obj_ids = arrays.pop('obj_id')
+    starts = np.flatnonzero(np.r_[True, row_obj_ids[1:] != row_obj_ids[:-1]])
+    bounds = dict(zip(row_obj_ids[starts[:len(row_obj_ids)]],
+                      zip(starts, np.r_[starts[1:], len(row_obj_ids)])))
+    return {
+        obj_id: {key: value[slice(*bounds.get(obj_id, (0, 0)))]
+                 for key, value in arrays.items()}
+        for obj_id in obj_ids
+    }
+
+
+def photometry_columns(obj_id, outsys, format):
+    """JSON-ready version of `photometry_arrays`: one list per field, with
+    nulls as None."""
+    return json_columns(obj_id, photometry_arrays(obj_id, outsys, format))
+
+
+def json_columns(obj_id, arrays):
+    """Lists (with nulls as None) of the arrays of an object's photometry,
+    together with the object ID and magnitude system."""
+    columns = {'obj_id': obj_id, 'magsys': 'ab'}
+    columns.update({key: nan_to_none_list(value)
+                    for key, value in arrays.items()})
+    return columns
+
+
+def serialize(phot, outsys, format):
+    return serialize_photometry([phot], outsys, format)[0]
+
+
+# columns of the photometry table that are filled in from an uploaded packet
+PHOT_INSERT_COLUMNS = ['obj_id', 'mjd', 'flux', 'fluxerr', 'instrument_id',
+                       'filter', 'ra', 'dec', 'ra_unc', 'dec_unc', 'origin']
+
+# columns of the unique constraint `photometry_natural_key`
+PHOT_NATURAL_KEY = ['obj_id', 'instrument_id', 'filter', 'mjd', 'origin']
+
+
+def load_packet(packet):
+    """Deserialize a single photometry packet, trying `PhotometryFlux` first
+    and then `PhotometryMag`.
+
+    Parameters
+    ----------
+    packet : dict
+        A single photometry point, with nans already coerced to None.
+
+    Returns
+    -------
+    Photometry
+        The (unsaved) Photometry object described by the packet.
+
+    Raises
+    ------
+    ValidationError
+        If the packet validates under neither schema. The message reports
+        the errors from both schemas.
+    """
+    try:
+        return PhotometryFlux.load(packet)
+    except ValidationError as e1:
+        try:
+            return PhotometryMag.load(packet)
+        except ValidationError as e2:
+            raise ValidationError('Invalid input format: Tried to parse '
+                                  f'{packet} as PhotometryFlux, got: '
+                                  f'"{e1.normalized_messages()}." Tried '
+                                  f'to parse {packet} as PhotometryMag, got:'
+                                  f' "{e2.normalized_messages()}."')
+
+
+def _columnar_photometry(df):
+    """Validate a DataFrame of photometry packets column by column and
+    convert it to rows of the photometry table.
+
+    This mirrors the checks done by `PhotometryFlux` and `PhotometryMag`, but
+    does each of them once per column (or once per distinct instrument/object)
+    instead of once per packet.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        One row per photometry packet.
+
+    Returns
+    -------
+    values : pandas.DataFrame
+        The `PHOT_INSERT_COLUMNS` of each row, with fluxes in µJy. Only
+        meaningful for rows that are not flagged in `bad`.
+    bad : numpy.ndarray of bool
+        Rows that failed column-wise validation. These must be run through
+        `load_packet`, which either produces the same error the row-by-row
+        upload would have, or a valid Photometry object.
+    """
+    n = len(df)
+    columns = set(df.columns)
+    strings = ('obj_id', 'filter', 'origin')
+    values = pd.DataFrame({
+        col: pd.Series(None if col in strings else np.nan, index=df.index,
+                       dtype=object if col in strings else float)
+        for col in PHOT_INSERT_COLUMNS
+    })
+
+    if columns <= set(PhotometryFlux.fields):
+        kind, schema = 'flux', PhotometryFlux
+    elif columns <= set(PhotometryMag.fields):
+        kind, schema = 'mag', PhotometryMag
     else:
-        raise ValueError('Invalid output format specified. Must be one of '
-                         f"['flux', 'mag'], got '{format}'.")
-    return retval
+        # unknown fields for both schemas
+        return values, np.ones(n, dtype=bool)
+
+    required = {name for name, f in schema.fields.items() if f.required}
+    if not required <= columns:
+        return values, np.ones(n, dtype=bool)
+
+    bad = np.zeros(n, dtype=bool)
+
+    numeric = {}
+    for name in ['mjd', 'ra', 'dec', 'ra_unc', 'dec_unc', 'instrument_id',
+                 'flux', 'fluxerr', 'zp', 'mag', 'magerr', 'limiting_mag']:
+        if name not in schema.fields:
+            continue
+        if name not in df:
+            numeric[name] = pd.Series(np.nan, index=df.index)
+            continue
+        raw = df[name]
+        num = pd.to_numeric(raw, errors='coerce')
+        missing = raw.isna().values
+        bad |= num.isna().values & ~missing
+        if raw.dtype == object or raw.dtype == bool:
+            bad |= raw.map(lambda v: isinstance(v, (bool, np.bool_))).values
+        if name in required:
+            bad |= missing
+        numeric[name] = num.astype(float)
+
+    instrument_id = numeric['instrument_id']
+    bad |= (instrument_id != np.floor(instrument_id)).values
+    bad |= ~df['obj_id'].map(lambda v: isinstance(v, str)).values
+    bad |= ~df['filter'].isin(ALLOWED_BANDPASSES).values
+    bad |= ~df['magsys'].isin(ALLOWED_MAGSYSTEMS).values
+    if 'origin' in df:
+        bad |= ~(df['origin'].isna()
+                 | df['origin'].map(lambda v: isinstance(v, str))).values
+
+    # one query per table instead of one per packet
+    instrument_ids = instrument_id[~bad].unique().astype(int).tolist()
+    instrument_filters = {
+        i.id: set(i.filters) for i in
+        Instrument.query.filter(Instrument.id.in_(instrument_ids))
+    }
+    obj_ids = df['obj_id'][~bad].unique().tolist()
+    existing_obj_ids = {
+        row[0] for row in
+        DBSession().query(Obj.id).filter(Obj.id.in_(obj_ids))
+    }
+    bad |= ~df['obj_id'].isin(existing_obj_ids).values
+    pairs = pd.DataFrame({'instrument_id': instrument_id,
+                          'filter': df['filter']})[~bad]
+    for (inst_id, filt), idx in pairs.groupby(
+            ['instrument_id', 'filter']).groups.items():
+        if filt not in instrument_filters.get(int(inst_id), ()):
+            bad[df.index.get_indexer(idx)] = True
+
+    if kind == 'flux':
+        flux = numeric['flux'].values
+        fluxerr = numeric['fluxerr'].values
+        zp = numeric['zp'].values
+    else:
+        mag = numeric['mag'].values
+        magerr = numeric['magerr'].values
+        bad |= np.isnan(mag) != np.isnan(magerr)
+        flux, fluxerr = mag_to_flux(mag, magerr,
+                                    numeric['limiting_mag'].values)
+        zp = np.full(n, PHOT_ZP)
+
+    good = ~bad
+    if good.any():
+        # convert flux to microJanskies in a single pass over all packets
+        flux, fluxerr = normalize_flux(flux[good], fluxerr[good], zp[good],
+                                       df['magsys'].values[good],
+                                       df['filter'].values[good])
+        values.loc[good, 'flux'] = flux
+        values.loc[good, 'fluxerr'] = fluxerr
+        values.loc[good, 'obj_id'] = df['obj_id'][good]
+        values.loc[good, 'filter'] = df['filter'][good]
+        if 'origin' in df:
+            values.loc[good, 'origin'] = df['origin'][good]
+        for name in ['mjd', 'instrument_id', 'ra', 'dec', 'ra_unc', 'dec_unc']:
+            values.loc[good, name] = numeric[name][good]
+
+    return values, bad
+
+
+def upsert_photometry_rows(rows):
+    """Insert rows into the photometry table with a single
+    `INSERT ... ON CONFLICT` statement on `photometry_natural_key`.
+
+    Rows that already exist are updated, and only if one of their values
+    changed, so replaying an upload writes nothing.
+
+    Parameters
+    ----------
+    rows : list of dict
+        Rows of the photometry table. Each must have a non-null `origin`,
+        since nulls never conflict.
+
+    Returns
+    -------
+    list of int
+        The ID of the inserted, updated or unchanged point for each row.
+    """
+    table = Photometry.__table__
+
+    def key(row):
+        return tuple(row[col] for col in PHOT_NATURAL_KEY)
+
+    # a statement cannot affect the same row twice, so the last of several
+    # rows with the same key wins
+    unique_rows = list({key(row): row for row in rows}.values())
+    updated = [col for col in unique_rows[0] if col not in PHOT_NATURAL_KEY]
+
+    stmt = psql.insert(table).values(unique_rows)
+    stmt = stmt.on_conflict_do_update(
+        constraint='photometry_natural_key',
+        set_={**{col: stmt.excluded[col] for col in updated},
+              'modified': datetime.now(), 'txid': sa.func.txid_current()},
+        where=sa.or_(*[table.c[col].is_distinct_from(stmt.excluded[col])
+                       for col in updated])
+    ).returning(table.c.id, *[table.c[col] for col in PHOT_NATURAL_KEY])
+    key_ids = {tuple(r[1:]): r[0] for r in DBSession().execute(stmt)}
+
+    # unchanged rows are not returned by the upsert
+    missing = [k for k in map(key, unique_rows) if k not in key_ids]
+    if missing:
+        key_columns = [table.c[col] for col in PHOT_NATURAL_KEY]
+        key_ids.update({
+            tuple(r[1:]): r[0] for r in DBSession().execute(
+                sa.select([table.c.id, *key_columns])
+                .where(sa.tuple_(*key_columns).in_(missing))
+            )
+        })
+
+    return [key_ids[key(row)] for row in rows]
+
+
+def ingest_photometry(df, upsert=False, errors=None):
+    """Validate a DataFrame of photometry packets and insert all of it with a
+    single bulk INSERT statement.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        One row per photometry packet, as built from the JSON passed to
+        `PhotometryHandler.post`.
+    upsert : bool, optional
+        Insert with `upsert_photometry_rows`, so that points that already
+        exist (by `photometry_natural_key`) are updated instead of
+        duplicated. Every packet must then have an `origin`.
+    errors : list, optional
+        If given, every invalid row is validated and its error appended to
+        this list as `{'row': index, 'message': message}` before raising,
+        instead of stopping at the first one.
+
+    Returns
+    -------
+    list of int
+        The IDs of the new (or, when upserting, existing) photometry rows, in
+        the order of `df`.
+
+    Raises
+    ------
+    ValidationError
+        If any row is invalid. The message is the one `load_packet` produces
+        for the first invalid row, and nothing is inserted.
+    """
+    df = df.reset_index(drop=True)
+    # the original packets, with nans coerced to nones
+    packets = df.astype(object).where(df.notna(), None).to_dict('records')
+
+    values, bad = _columnar_photometry(df)
+    for i in np.flatnonzero(bad):
+        try:
+            phot = load_packet(packets[i])
+        except ValidationError as e:
+            if errors is None:
+                raise
+            errors.append({'row': int(i), 'message': str(e)})
+            continue
+        values.loc[i] = [getattr(phot, col) for col in PHOT_INSERT_COLUMNS]
+    if errors:
+        raise ValidationError(f'{len(errors)} of {len(df)} photometry points '
+                              'are invalid.')
+
+    # plain python scalars (and None for nulls) for the database driver
+    values['instrument_id'] = values['instrument_id'].astype(int)
+    rows = values.astype(object).where(values.notna(), None).to_dict('records')
+    for row, packet in zip(rows, packets):
+        row['original_user_data'] = packet
+
+    if upsert and values['origin'].isna().any():
+        raise ValidationError('Upserting photometry requires an `origin` for '
+                              'every point.')
+
+    ids = []
+    if rows and upsert:
+        ids = upsert_photometry_rows(rows)
+    elif rows:
+        # RETURNING does not guarantee the order of VALUES, so the IDs are
+        # drawn from the sequence first and inserted explicitly
+        ids = [r[0] for r in DBSession().execute(
+            sa.select([sa.func.nextval('photometry_id_seq')])
+            .select_from(sa.func.generate_series(1, len(rows)))
+        )]
+        for row, phot_id in zip(rows, ids):
+            row['id'] = phot_id
+        DBSession().execute(sa.insert(Photometry.__table__).values(rows))
+
+    # update last_detected once per object, not once per packet
+    last_mjd = pd.to_numeric(values['mjd']).groupby(values['obj_id']).max()
+    bump_data_revision(last_mjd.index.tolist())
+    last_times = Time(last_mjd.values, format='mjd').iso
+    objs = Obj.query.filter(Obj.id.in_(last_mjd.index.tolist()))
+    obj_times = dict(zip(last_mjd.index, last_times))
+    for obj in objs:
+        obj.last_detected = max(
+            arrow.get(obj_times[obj.id]),
+            obj.last_detected
+            if obj.last_detected is not None
+            else arrow.get("1000-01-01")
+        )
+
+    return ids
+
+
+# thread pool running asynchronous uploads, created on first use
+INGEST_EXECUTOR = None
+
+
+def ingest_executor(max_workers):
+    """Return the ingest thread pool, creating it on first use."""
+    global INGEST_EXECUTOR
+    if INGEST_EXECUTOR is None:
+        INGEST_EXECUTOR = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='photometry-ingest'
+        )
+    return INGEST_EXECUTOR
+
+
+# futures of the asynchronous uploads queued or running, each holding its
+# DataFrame in memory until it finishes
+INGEST_BACKLOG = set()
+INGEST_BACKLOG_LOCK = threading.Lock()
+
+
+def ingest_backlog_full(max_pending):
+    """Whether `max_pending` asynchronous uploads are already queued or
+    running."""
+    with INGEST_BACKLOG_LOCK:
+        return len(INGEST_BACKLOG) >= max_pending
+
+
+def finish_ingest_job(future):
+    with INGEST_BACKLOG_LOCK:
+        INGEST_BACKLOG.discard(future)
+
+
+def submit_ingest_job(job_id, df, upsert, max_workers):
+    """Run `run_ingest_job` on the ingest thread pool, counting it in the
+    backlog until it finishes."""
+    future = ingest_executor(max_workers).submit(run_ingest_job, job_id, df,
+                                                 upsert)
+    with INGEST_BACKLOG_LOCK:
+        INGEST_BACKLOG.add(future)
+    future.add_done_callback(finish_ingest_job)
+    return future
+
+
+def run_in_session(session, function, *args):
+    """Call `function` with `session` as the `DBSession()` of the calling
+    thread, so that successive calls on pool threads continue the same
+    transaction."""
+    DBSession.registry.set(session)
+    try:
+        return function(*args)
+    finally:
+        DBSession.registry.clear()
+
+
+def run_ingest_job(job_id, df, upsert):
+    """Ingest the photometry of a `PhotometryIngestJob`, recording its
+    status, per-row errors and throughput.
+
+    Runs on a worker thread, so it uses (and then removes) the thread's own
+    database session.
+    """
+    session = DBSession()
+    try:
+        job = session.query(PhotometryIngestJob).get(job_id)
+        job.status = 'running'
+        job.started_at = datetime.now()
+        session.commit()
+
+        errors = []
+        start = time.perf_counter()
+        try:
+            ids = ingest_photometry(df, upsert=upsert, errors=errors)
+            session.flush()
+        except (ValidationError, sa.exc.IntegrityError) as e:
+            session.rollback()
+            job.status = 'failed'
+            job.errors = errors or [{'row': None, 'message': str(e)}]
+        else:
+            elapsed = time.perf_counter() - start
+            job.status = 'complete'
+            job.photometry_ids = ids
+            job.rows_per_second = len(ids) / elapsed if elapsed > 0 else None
+        job.finished_at = datetime.now()
+        session.commit()
+        if job.status == 'complete':
+            invalidate_match_counts()
+    except Exception as e:
+        session.rollback()
+        job = session.query(PhotometryIngestJob).get(job_id)
+        job.status = 'failed'
+        job.errors = [{'row': None, 'message': f'Internal error: {e}'}]
+        job.finished_at = datetime.now()
+        session.commit()
+    finally:
+        DBSession.remove()
 
 
 class PhotometryHandler(BaseHandler):
@@ -102,6 +734,30 @@ class PhotometryHandler(BaseHandler):
                 oneOf:
                   - $ref: "#/components/schemas/PhotMagFlexible"
                   - $ref: "#/components/schemas/PhotFluxFlexible"
+        parameters:
+          - in: query
+            name: mode
+            required: false
+            description: >-
+              `insert` (default) adds every point as a new row. `upsert`
+              matches points to existing ones on (obj_id, instrument_id,
+              filter, mjd, origin), updating them instead, so replaying an
+              upload does not create duplicates. Every point must have an
+              `origin` in `upsert` mode.
+            schema:
+              type: string
+              enum:
+                - insert
+                - upsert
+          - in: query
+            name: async
+            required: false
+            description: >-
+              If `true`, validate and ingest the photometry in the
+              background and return a `job_id` right away. Poll
+              `GET /api/photometry/jobs/<job_id>` for the outcome.
+            schema:
+              type: boolean
         responses:
           200:
             content:
@@ -118,9 +774,35 @@ class PhotometryHandler(BaseHandler):
                               type: array
                               items:
                                 type: integer
-                              description: List of new photometry IDs
+                              description: >-
+                                List of new photometry IDs (in `upsert`
+                                mode, the IDs of the points inserted,
+                                updated or already present)
+                            rows:
+                              type: integer
+                              description: Number of photometry points ingested
+                            rows_per_second:
+                              type: number
+                              description: Ingest throughput of this request
+                            job_id:
+                              type: integer
+                              description: >-
+                                ID of the ingest job (only, and instead of
+                                the above, when `async` is `true`)
+          503:
+            description: >-
+              Too many asynchronous uploads are queued or running (only when
+              `async` is `true`)
+            content:
+              application/json:
+                schema: Error
         """
 
+        mode = self.get_query_argument('mode', 'insert')
+        if mode not in ['insert', 'upsert']:
+            return self.error("Invalid mode. Must be one of "
+                              f"['insert', 'upsert'], got '{mode}'.")
+
         data = self.get_json()
 
         if not isinstance(data, dict):
@@ -136,45 +818,42 @@ class PhotometryHandler(BaseHandler):
             return self.error('Unable to coerce passed JSON to a series of packets. '
                               f'Error was: "{e}"')
 
-        # pop out thumbnails and process what's left using schemas
-
-        ids = []
-        for i, row in df.iterrows():
-            packet = row.to_dict()
-
-            # coerce nans to nones
-            for key in packet:
-                packet[key] = nan_to_none(packet[key])
-
-            try:
-                phot = PhotometryFlux.load(packet)
-            except ValidationError as e1:
-                try:
-                    phot = PhotometryMag.load(packet)
-                except ValidationError as e2:
-                    return self.error('Invalid input format: Tried to parse '
-                                      f'{packet} as PhotometryFlux, got: '
-                                      f'"{e1.normalized_messages()}." Tried '
-                                      f'to parse {packet} as PhotometryMag, got:'
-                                      f' "{e2.normalized_messages()}."')
-
-            phot.original_user_data = packet
-            DBSession().add(phot)
-
-            # to set up obj link
-            DBSession().flush()
-
-            time = arrow.get(Time(phot.mjd, format='mjd').iso)
-            phot.obj.last_detected = max(
-                time,
-                phot.obj.last_detected
-                if phot.obj.last_detected is not None
-                else arrow.get("1000-01-01")
+        if self.get_query_argument('async', 'false').lower() == 'true':
+            if ingest_backlog_full(self.cfg['misc.photometry_ingest_max_pending']):
+                return self.error('Too many photometry uploads in progress, '
+                                  'retry later.', status=503)
+            is_token = isinstance(self.current_user, Token)
+            job = PhotometryIngestJob(
+                username_or_token_id=(self.current_user.id if is_token
+                                      else self.current_user.username),
+                is_token=is_token, mode=mode, rows=len(df)
             )
-            ids.append(phot.id)
+            DBSession().add(job)
+            DBSession().commit()
+            submit_ingest_job(job.id, df, mode == 'upsert',
+                              self.cfg['misc.photometry_ingest_workers'])
+            return self.success(data={'job_id': job.id})
 
+        start = time.perf_counter()
+        try:
+            ids = ingest_photometry(df, upsert=mode == 'upsert')
+        except ValidationError as e:
+            DBSession().rollback()
+            return self.error(str(e))
+        except sa.exc.IntegrityError as e:
+            DBSession().rollback()
+            return self.error('Unable to insert photometry (use `mode=upsert` '
+                              'to update existing points). '
+                              f'Error was: "{e.orig}"')
         DBSession().commit()
-        return self.success(data={"ids": ids})
+        invalidate_match_counts()
+        elapsed = time.perf_counter() - start
+
+        return self.success(data={
+            "ids": ids,
+            "rows": len(ids),
+            "rows_per_second": len(ids) / elapsed if elapsed > 0 else None
+        })
 
     @auth_or_token
     def get(self, photometry_id):
@@ -190,6 +869,11 @@ class PhotometryHandler(BaseHandler):
         format = self.get_query_argument('format', 'mag')
         outsys = self.get_query_argument('magsys', 'ab')
         output = serialize(phot, outsys, format)
+        if self.arrow_requested():
+            return self.success_arrow({
+                key: np.array([value], dtype=float if value is None else None)
+                for key, value in output.items()
+            })
         return self.success(data=output)
 
     @permissions(['Manage sources'])
@@ -221,25 +905,19 @@ class PhotometryHandler(BaseHandler):
                 schema: Error
         """
         # Ensure user/token has access to parent source
-        s = Source.get_if_owned_by(Photometry.query.get(photometry_id).obj_id,
-                                   self.current_user)
+        obj_id = Photometry.query.get(photometry_id).obj_id
+        s = Source.get_if_owned_by(obj_id, self.current_user)
         packet = self.get_json()
 
         try:
-            phot = PhotometryFlux.load(packet)
-        except ValidationError as e1:
-            try:
-                phot = PhotometryMag.load(packet)
-            except ValidationError as e2:
-                return self.error('Invalid input format: Tried to parse '
-                                  f'{packet} as PhotometryFlux, got: '
-                                  f'"{e1.normalized_messages()}." Tried '
-                                  f'to parse {packet} as PhotometryMag, got:'
-                                  f' "{e2.normalized_messages()}."')
-            
+            phot = load_packet(packet)
+        except ValidationError as e:
+            return self.error(str(e))
+
         phot.original_user_data = packet
         phot.id = photometry_id
         DBSession().merge(phot)
+        bump_data_revision({obj_id, phot.obj_id})
         DBSession().commit()
         return self.success()
 
@@ -265,22 +943,456 @@ class PhotometryHandler(BaseHandler):
                 schema: Error
         """
         # Ensure user/token has access to parent source
-        s = Source.get_if_owned_by(Photometry.query.get(photometry_id).obj_id,
-                                   self.current_user)
+        obj_id = Photometry.query.get(photometry_id).obj_id
+        s = Source.get_if_owned_by(obj_id, self.current_user)
         DBSession.query(Photometry).filter(Photometry.id == int(photometry_id)).delete()
+        bump_data_revision([obj_id])
         DBSession().commit()
 
         return self.success()
 
 
+# number of streamed rows validated and inserted at once
+STREAM_BATCH_ROWS = 5000
+
+# string columns of streamed CSV uploads, the others being parsed as numbers
+STREAM_CSV_STRINGS = ['obj_id', 'filter', 'magsys', 'origin']
+
+
+@stream_request_body
+class PhotometryStreamHandler(BaseHandler):
+    @permissions(['Upload data'])
+    def prepare(self):
+        super().prepare()
+        self.request.connection.set_max_body_size(
+            self.cfg['misc.photometry_stream_max_body_size']
+        )
+        content_type = self.request.headers.get('Content-Type', '')
+        self.csv = content_type.startswith('text/csv')
+        mode = self.get_query_argument('mode', 'insert')
+        self.upsert = mode == 'upsert'
+        self.csv_header = None
+        # undecoded or unparsed end of the body received so far
+        self.buffer = b''
+        self.text = ''
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        # complete NDJSON lines, or parsed CSV records, not inserted yet
+        self.lines = []
+        self.rows = 0
+        self.stream_error = None
+        # the upload is inserted in one transaction, by batches on the ingest
+        # thread pool
+        self.session = None
+        self.start = time.perf_counter()
+        if mode not in ['insert', 'upsert']:
+            # the body is discarded, and `post` responds with the error
+            self.stream_error = ("Invalid mode. Must be one of "
+                                 f"['insert', 'upsert'], got '{mode}'.")
+
+    def on_finish(self):
+        if self.session is not None:
+            self.session.close()
+        super().on_finish()
+
+    async def data_received(self, chunk):
+        if self.stream_error is not None:
+            return
+        if self.csv:
+            try:
+                self.read_csv_records(self.decoder.decode(chunk))
+            except (csv.Error, UnicodeDecodeError) as e:
+                self.stream_error = f'Invalid CSV: {e}'
+                return
+        else:
+            *lines, self.buffer = (self.buffer + chunk).split(b'\n')
+            self.lines.extend(line for line in lines if line.strip())
+        if len(self.lines) >= STREAM_BATCH_ROWS:
+            # reading the body waits for the batch, so a fast client cannot
+            # queue unbounded batches
+            await self.ingest_lines()
+
+    def read_csv_records(self, text, final=False):
+        """Parse the complete CSV records of the text received so far into
+        `self.lines`, the first one being the header.
+
+        Quoted fields can contain newlines, so a record is only complete once
+        `csv.reader` has read it whole: the incomplete record at the end of
+        the text is kept for the next chunk, unless `final`.
+        """
+        *lines, partial = (self.text + text).split('\n')
+        lines = [line + '\n' for line in lines]
+        if final:
+            lines, partial = lines + [partial], ''
+        reader = csv.reader(lines, strict=True)
+        complete = 0
+        try:
+            for record in reader:
+                complete = reader.line_num
+                if not any(field.strip() for field in record):
+                    continue
+                if self.csv_header is None:
+                    self.csv_header = record
+                else:
+                    self.lines.append(record)
+        except csv.Error:
+            # a quoted field still open at the end of the text raises too
+            if final or reader.line_num < len(lines):
+                raise
+        self.text = ''.join(lines[complete:]) + partial
+
+    def parse_lines(self, lines):
+        """Parse lines of NDJSON, or CSV records, into a DataFrame of
+        packets."""
+        if self.csv:
+            df = pd.DataFrame(lines, columns=self.csv_header).replace('', np.nan)
+            for col in df.columns.difference(STREAM_CSV_STRINGS):
+                df[col] = pd.to_numeric(df[col])
+            return df
+        packets = [json.loads(line) for line in lines]
+        if not all(isinstance(packet, dict) for packet in packets):
+            raise ValueError('Each line must be a JSON object.')
+        return pd.DataFrame(packets)
+
+    def run_in_ingest_executor(self, function, *args):
+        """Run `function` in the upload's session on the ingest thread
+        pool, without blocking the IOLoop."""
+        if self.session is None:
+            self.session = DBSession.session_factory()
+        return IOLoop.current().run_in_executor(
+            ingest_executor(self.cfg['misc.photometry_ingest_workers']),
+            run_in_session, self.session, function, *args
+        )
+
+    def ingest_batch(self, lines):
+        return ingest_photometry(self.parse_lines(lines), upsert=self.upsert)
+
+    async def ingest_lines(self):
+        """Validate and insert the complete lines received so far."""
+        lines, self.lines = self.lines, []
+        try:
+            ids = await self.run_in_ingest_executor(self.ingest_batch, lines)
+        except (ValidationError, ValueError, sa.exc.IntegrityError) as e:
+            self.session.rollback()
+            self.stream_error = (f'Error in rows {self.rows}-'
+                                 f'{self.rows + len(lines) - 1}: {e}')
+            return
+        self.rows += len(ids)
+
+    async def post(self):
+        # The full docstring/API spec is below as an f-string
+
+        if self.csv and self.stream_error is None:
+            try:
+                self.read_csv_records(self.decoder.decode(b'', final=True),
+                                      final=True)
+            except (csv.Error, UnicodeDecodeError) as e:
+                self.stream_error = f'Invalid CSV: {e}'
+        elif self.buffer.strip():
+            self.lines.append(self.buffer)
+        if self.lines and self.stream_error is None:
+            await self.ingest_lines()
+        if self.stream_error is not None:
+            return self.error(self.stream_error)
+
+        if self.session is not None:
+            await self.run_in_ingest_executor(self.session.commit)
+            invalidate_match_counts()
+        elapsed = time.perf_counter() - self.start
+        return self.success(data={
+            'rows': self.rows,
+            'rows_per_second': self.rows / elapsed if elapsed > 0 else None
+        })
+
+
+class PhotometryJobHandler(BaseHandler):
+    @auth_or_token
+    def get(self, job_id):
+        """
+        ---
+        description: >-
+          Retrieve the status of an asynchronous photometry upload. Jobs run
+          in the app process that accepted them: a job still `pending` or
+          `running` when that process restarts is lost and keeps its status,
+          so resubmit it (in `upsert` mode, to skip the points it had
+          already ingested) if its status does not change.
+        parameters:
+          - in: path
+            name: job_id
+            required: true
+            schema:
+              type: integer
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - $ref: '#/components/schemas/Success'
+                    - type: object
+                      properties:
+                        data:
+                          type: object
+                          properties:
+                            id:
+                              type: integer
+                            status:
+                              type: string
+                              enum:
+                                - pending
+                                - running
+                                - complete
+                                - failed
+                            mode:
+                              type: string
+                            rows:
+                              type: integer
+                              description: Number of points submitted
+                            ids:
+                              type: array
+                              items:
+                                type: integer
+                              description: IDs of the ingested points
+                            errors:
+                              type: array
+                              description: >-
+                                Errors of a failed job, one per invalid row
+                                (`row` is the index of the point in the
+                                upload) or a single one with a null `row`.
+                              items:
+                                type: object
+                            rows_per_second:
+                              type: number
+                            created_at:
+                              type: string
+                            started_at:
+                              type: string
+                            finished_at:
+                              type: string
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+        job = PhotometryIngestJob.query.get(job_id)
+        is_token = isinstance(self.current_user, Token)
+        if job is None or (job.is_token, job.username_or_token_id) != (
+                is_token, self.current_user.id if is_token
+                else self.current_user.username):
+            return self.error('Invalid job ID.')
+
+        return self.success(data={
+            'id': job.id,
+            'status': job.status,
+            'mode': job.mode,
+            'rows': job.rows,
+            'ids': job.photometry_ids,
+            'errors': job.errors,
+            'rows_per_second': job.rows_per_second,
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+        })
+
+
 class SourcePhotometryHandler(BaseHandler):
     @auth_or_token
     def get(self, obj_id):
         source = Source.get_if_owned_by(obj_id, self.current_user)
+        if source is None:
+            return self.error('Invalid source ID.')
         format = self.get_query_argument('format', 'mag')
         outsys = self.get_query_argument('magsys', 'ab')
+        layout = self.get_query_argument('layout', 'rows')
+        if layout not in ['rows', 'columns']:
+            return self.error("Invalid layout. Must be one of "
+                              f"['rows', 'columns'], got '{layout}'.")
+        binsize = self.get_query_argument('binsize', None)
+        since = self.get_query_argument('since', None)
+        if binsize is not None:
+            try:
+                binsize = float(binsize)
+            except ValueError:
+                return self.error(f"Invalid binsize '{binsize}'.")
+            if not binsize > 0:
+                return self.error('binsize must be positive.')
+            if since is not None:
+                return self.error('binsize and since cannot be combined.')
+            return self.get_stacked(obj_id, outsys, format, layout, binsize)
+        if since is not None:
+            try:
+                since = (int(since) if since.isdigit()
+                         else arrow.get(since).to('utc').naive)
+            except (arrow.parser.ParserError, ValueError):
+                return self.error(f"Invalid since '{since}'. Must be a "
+                                  "next_since cursor or an ISO 8601 "
+                                  "timestamp.")
+            return self.get_since(obj_id, outsys, format, layout, since)
+
+        if self.arrow_requested():
+            return self.success_arrow(
+                photometry_arrays(obj_id, outsys, format),
+                metadata={'obj_id': obj_id, 'magsys': 'ab'}
+            )
+        if layout == 'columns':
+            return self.success(
+                data=photometry_columns(obj_id, outsys, format)
+            )
         return self.success(
-            data=[serialize(phot, outsys, format) for phot in source.photometry]
+            data=serialize_photometry(source.photometry, outsys, format)
+        )
+
+    def get_stacked(self, obj_id, outsys, format, layout, binsize):
+        """Respond with the photometry of an object stacked in MJD bins of
+        `binsize` days, per instrument and filter."""
+        data = pd.read_sql(
+            DBSession().query(Photometry.mjd, Photometry.flux,
+                              Photometry.fluxerr, Photometry.filter,
+                              Photometry.instrument_id)
+            .filter(Photometry.obj_id == obj_id)
+            .statement, DBSession().bind
+        )
+        stacked = stack_photometry(data, binsize)
+        n = len(stacked)
+        arrays = {
+            'mjd': stacked['mjd'].to_numpy(dtype=float),
+            'filter': stacked['filter'].to_numpy(dtype=str),
+            'instrument_id': stacked['instrument_id'].to_numpy(dtype=np.int64),
+            'nstacked': stacked['nstacked'].to_numpy(dtype=np.int64),
+        }
+        try:
+            arrays.update(convert_photometry(
+                arrays['filter'], stacked['flux'].to_numpy(dtype=float),
+                stacked['fluxerr'].to_numpy(dtype=float),
+                np.full(n, np.nan), np.full(n, '', dtype=str), outsys, format
+            ))
+        except ValueError as e:
+            return self.error(str(e))
+
+        if self.arrow_requested():
+            return self.success_arrow(arrays, metadata={
+                'obj_id': obj_id, 'magsys': 'ab', 'binsize': str(binsize)
+            })
+        columns = json_columns(obj_id, arrays)
+        if layout == 'columns':
+            return self.success(data=columns)
+        return self.success(data=[
+            {'obj_id': obj_id, 'magsys': 'ab',
+             **{key: columns[key][i] for key in arrays}}
+            for i in range(n)
+        ])
+
+    def get_since(self, obj_id, outsys, format, layout, since):
+        """Respond with the photometry of an object written since `since`,
+        the IDs of the points deleted since `since`, and the cursor to pass
+        as `since` on the next poll. Consecutive polls may return the same
+        points or deletions; clients deduplicate them by ID."""
+        # taken before reading the changes, so that writes committed after
+        # the reads are returned by the next poll
+        next_since = change_cursor()
+        deleted_ids = [
+            row[0] for row in
+            DBSession().query(DeletedPhotometry.photometry_id)
+            .filter(DeletedPhotometry.obj_id == obj_id)
+            .filter(changed_since(DeletedPhotometry, since))
+        ]
+
+        if layout == 'columns' or self.arrow_requested():
+            arrays = photometry_arrays(obj_id, outsys, format, since=since)
+            if self.arrow_requested():
+                return self.success_arrow(arrays, metadata={
+                    'obj_id': obj_id, 'magsys': 'ab',
+                    'deleted_ids': ','.join(map(str, deleted_ids)),
+                    'next_since': str(next_since)
+                })
+            photometry = json_columns(obj_id, arrays)
+        else:
+            phots = (Photometry.query
+                     .filter(Photometry.obj_id == obj_id)
+                     .filter(changed_since(Photometry, since))
+                     .order_by(Photometry.mjd)
+                     .all())
+            photometry = serialize_photometry(phots, outsys, format)
+
+        return self.success(data={
+            'photometry': photometry,
+            'deleted_ids': deleted_ids,
+            'next_since': str(next_since)
+        })
+
+
+class PhotometryBatchHandler(BaseHandler):
+    @auth_or_token
+    def post(self):
+        # The full docstring/API spec is below as an f-string
+
+        data = self.get_json()
+        if not isinstance(data, dict):
+            return self.error('Request body must be an object.')
+        obj_ids = data.get('obj_ids')
+        if (not isinstance(obj_ids, list) or not obj_ids
+                or not all(isinstance(obj_id, str) for obj_id in obj_ids)):
+            return self.error('`obj_ids` must be a list of source IDs.')
+        # drop duplicates, but keep the order of the request
+        obj_ids = list(dict.fromkeys(obj_ids))
+
+        filters = data.get('filters')
+        if filters is not None and (
+                not isinstance(filters, list)
+                or not all(isinstance(f, str) for f in filters)):
+            return self.error('`filters` must be a list of bandpass names.')
+        if filters is not None and not set(filters) <= set(ALLOWED_BANDPASSES):
+            return self.error('Invalid filters: '
+                              f'{sorted(set(filters) - set(ALLOWED_BANDPASSES))}')
+        try:
+            start_mjd = data.get('start_mjd')
+            start_mjd = None if start_mjd is None else float(start_mjd)
+            end_mjd = data.get('end_mjd')
+            end_mjd = None if end_mjd is None else float(end_mjd)
+        except (TypeError, ValueError):
+            return self.error('`start_mjd` and `end_mjd` must be numbers.')
+        format = data.get('format', 'mag')
+        outsys = data.get('magsys', 'ab')
+        if outsys not in ALLOWED_MAGSYSTEMS:
+            return self.error(f"Invalid magsys '{outsys}'.")
+
+        # check access to all of the sources with a single query
+        accessible = {
+            row[0] for row in
+            DBSession().query(Source.obj_id)
+            .filter(Source.obj_id.in_(obj_ids))
+            .filter(Source.group_id.in_(user_group_ids(self.current_user)))
+            .distinct()
+        }
+        inaccessible = [obj_id for obj_id in obj_ids
+                        if obj_id not in accessible]
+        if inaccessible:
+            return self.error('Insufficient permissions for sources '
+                              f'{inaccessible}.')
+
+        try:
+            photometry = batch_photometry_arrays(
+                obj_ids, outsys, format, filters=filters,
+                start_mjd=start_mjd, end_mjd=end_mjd
+            )
+        except ValueError as e:
+            return self.error(str(e))
+
+        if self.arrow_requested():
+            lengths = [len(arrays['id']) for arrays in photometry.values()]
+            columns = {'obj_id': np.repeat(np.array(obj_ids, dtype=object),
+                                           lengths)}
+            columns.update({
+                key: np.concatenate([arrays[key]
+                                     for arrays in photometry.values()])
+                for key in photometry[obj_ids[0]]
+            })
+            return self.success_arrow(columns, metadata={'magsys': 'ab'})
+
+        # the arrays of all the objects are read by a single scan, so only
+        # their JSON serialization is streamed
+        return self.success_stream(
+            (obj_id, json_columns(obj_id, arrays))
+            for obj_id, arrays in photometry.items()
         )
 
 
@@ -313,7 +1425,20 @@ PhotometryHandler.get.__doc__ = f"""
             schema:
               type: string
               enum: {list(ALLOWED_MAGSYSTEMS)}
-            
+          - in: query
+            name: encoding
+            required: false
+            description: >-
+              Set to `arrow` (or send `Accept:
+              application/vnd.apache.arrow.stream`) to receive the result
+              as an Apache Arrow IPC stream with one column per field,
+              instead of JSON.
+            schema:
+              type: string
+              enum:
+                - json
+                - arrow
+
         responses:
           200:
             content:
@@ -358,7 +1483,60 @@ SourcePhotometryHandler.get.__doc__ = f"""
             schema:
               type: string
               enum: {list(ALLOWED_MAGSYSTEMS)}
-            
+          - in: query
+            name: layout
+            required: false
+            description: >-
+              `rows` (default) returns one object per photometry point.
+              `columns` returns a single object with one array per field
+              (e.g. `mjd`, `filter`, `mag`), which is much smaller and
+              faster to produce for long light curves.
+            schema:
+              type: string
+              enum:
+                - rows
+                - columns
+          - in: query
+            name: since
+            required: false
+            description: >-
+              ISO 8601 timestamp for the first poll, then the `next_since`
+              cursor returned by the previous poll. If given, only the
+              points added or modified since then are returned, under
+              `photometry`, along with the IDs of the points deleted since
+              then (`deleted_ids`) and the value to pass as `since` on the
+              next poll (`next_since`). Consecutive polls may repeat points
+              or deletions, to be deduplicated by ID. With
+              `encoding=arrow`, `deleted_ids` (comma-separated) and
+              `next_since` are in the schema metadata.
+            schema:
+              type: string
+          - in: query
+            name: binsize
+            required: false
+            description: >-
+              If given, return the light curves of each instrument and
+              filter stacked in MJD bins of this many days instead of the
+              individual points. Points with a flux are combined into their
+              inverse-variance weighted mean flux and MJD; bins of
+              non-detections only give their deepest limit. Each stacked
+              point has the number of points it combines, `nstacked`.
+            schema:
+              type: number
+          - in: query
+            name: encoding
+            required: false
+            description: >-
+              Set to `arrow` (or send `Accept:
+              application/vnd.apache.arrow.stream`) to receive the result
+              as an Apache Arrow IPC stream with one column per field,
+              instead of JSON.
+            schema:
+              type: string
+              enum:
+                - json
+                - arrow
+
         responses:
           200:
             content:
@@ -373,3 +1551,140 @@ SourcePhotometryHandler.get.__doc__ = f"""
                 schema: Error
         """
 
+
+PhotometryBatchHandler.post.__doc__ = f"""
+        ---
+        description: Retrieve the photometry of several sources at once
+        requestBody:
+          content:
+            application/json:
+              schema:
+                type: object
+                properties:
+                  obj_ids:
+                    type: array
+                    items:
+                      type: string
+                    description: IDs of the sources to retrieve photometry for
+                  filters:
+                    type: array
+                    items:
+                      type: string
+                      enum: {list(ALLOWED_BANDPASSES)}
+                    description: Only return photometry in these bandpasses
+                  start_mjd:
+                    type: number
+                    description: Only return photometry at or after this MJD
+                  end_mjd:
+                    type: number
+                    description: Only return photometry at or before this MJD
+                  format:
+                    type: string
+                    enum:
+                      - mag
+                      - flux
+                    description: >-
+                      Return the photometry in flux or magnitude space
+                      (default mag).
+                  magsys:
+                    type: string
+                    enum: {list(ALLOWED_MAGSYSTEMS)}
+                    description: >-
+                      The magnitude or zeropoint system of the output.
+                      (Default AB)
+                required:
+                  - obj_ids
+        parameters:
+          - in: query
+            name: encoding
+            required: false
+            description: >-
+              Set to `arrow` (or send `Accept:
+              application/vnd.apache.arrow.stream`) to receive a single
+              Apache Arrow IPC stream, with an `obj_id` column, instead of
+              JSON.
+            schema:
+              type: string
+              enum:
+                - json
+                - arrow
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - $ref: '#/components/schemas/Success'
+                    - type: object
+                      properties:
+                        data:
+                          type: object
+                          description: >-
+                            For each source, in the order requested, an
+                            object with one array per field (as returned by
+                            `GET /api/sources/<id>/photometry?layout=columns`),
+                            ordered by MJD.
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
+
+
+PhotometryStreamHandler.post.__doc__ = f"""
+        ---
+        description: >-
+          Upload photometry as a stream of NDJSON or CSV. The upload is
+          validated and inserted in batches of {STREAM_BATCH_ROWS} rows as it
+          arrives, so it can be arbitrarily large. It is applied in a single
+          transaction: if any row is invalid, nothing is inserted.
+        parameters:
+          - in: query
+            name: mode
+            required: false
+            description: >-
+              `insert` (default) or `upsert`, as for `POST /api/photometry`.
+            schema:
+              type: string
+              enum:
+                - insert
+                - upsert
+        requestBody:
+          content:
+            application/x-ndjson:
+              schema:
+                description: >-
+                  One photometry point per line, each a JSON object with
+                  the fields of `PhotometryFlux` or `PhotometryMag`.
+                type: string
+            text/csv:
+              schema:
+                description: >-
+                  A UTF-8 header record naming the fields of
+                  `PhotometryFlux` or `PhotometryMag`, then one photometry
+                  point per record. Quoted fields can contain commas and
+                  line breaks.
+                type: string
+        responses:
+          200:
+            content:
+              application/json:
+                schema:
+                  allOf:
+                    - $ref: '#/components/schemas/Success'
+                    - type: object
+                      properties:
+                        data:
+                          type: object
+                          properties:
+                            rows:
+                              type: integer
+                              description: Number of photometry points ingested
+                            rows_per_second:
+                              type: number
+                              description: Ingest throughput of this request
+          400:
+            content:
+              application/json:
+                schema: Error
+        """
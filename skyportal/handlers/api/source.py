@@ -12,14 +12,15 @@ from baselayer.app.access import permissions, auth_or_token
 from ..base import BaseHandler
 from ...models import (
     DBSession, Comment, Instrument, Photometry, Obj, Source, SourceView,
-    Thumbnail, Token, User, Group, FollowupRequest
+    Thumbnail, Token, User, Group, FollowupRequest, user_group_ids
 )
 from .internal.source_views import register_source_view
 from ...utils import (
     get_nearby_offset_stars, facility_parameters, source_image_parameters,
     get_finding_chart
 )
-from .candidate import grab_query_results_page
+from .candidate import (grab_query_results_page, grab_query_results_cursor,
+                        match_count_cache, invalidate_match_counts)
 
 SOURCES_PER_PAGE = 100
 
@@ -54,19 +55,22 @@ class SourceHandler(BaseHandler):
             nullable: true
             schema:
               type: number
-            description: RA for spatial filtering
+            description: RA for spatial filtering, in degrees
           - in: query
             name: dec
             nullable: true
             schema:
               type: number
-            description: Declination for spatial filtering
+            description: Declination for spatial filtering, in degrees
           - in: query
             name: radius
             nullable: true
             schema:
               type: number
-            description: Radius for spatial filtering if ra & dec are provided
+            description: >-
+              Radius for spatial filtering if ra & dec are provided, in
+              degrees. Sources within this great-circle distance of (ra, dec)
+              are returned.
           - in: query
             name: sourceID
             nullable: true
@@ -98,6 +102,17 @@ class SourceHandler(BaseHandler):
             schema:
               type: integer
             description: Page number for paginated query results. Defaults to 1
+          - in: query
+            name: cursor
+            nullable: true
+            schema:
+              type: string
+            description: |
+              Opaque token from the `nextCursor` of a previous response, to get the
+              following page. Pass an empty cursor to get the first page. Pages are
+              then found from the (last_detected, id) of the previous page instead
+              of an offset, so deep pages are as fast as the first one, and
+              `pageNumber` and `totalMatches` are ignored.
           - in: query
             name: totalMatches
             nullable: true
@@ -140,6 +155,11 @@ class SourceHandler(BaseHandler):
                                   $ref: '#/components/schemas/Obj'
                               totalMatches:
                                 type: integer
+                              totalMatchesApproximate:
+                                type: boolean
+                                description: |
+                                  Whether totalMatches is the database's estimate for a
+                                  large number of matches rather than an exact count.
                               pageNumber:
                                 type: integer
                               lastPage:
@@ -148,15 +168,24 @@ class SourceHandler(BaseHandler):
                                 type: integer
                               numberingEnd:
                                 type: integer
+                              nextCursor:
+                                type: string
+                                nullable: true
+                                description: |
+                                  Cursor of the next page, if `cursor` was given. Null on
+                                  the last page.
             400:
               content:
                 application/json:
                   schema: Error
         """
         page_number = self.get_query_argument('pageNumber', None)
+        cursor = self.get_query_argument('cursor', None)
         num_per_page = min(
             int(self.get_query_argument("numPerPage", SOURCES_PER_PAGE)), 1000
         )
+        if num_per_page < 1:
+            return self.error("numPerPage must be positive.")
         ra = self.get_query_argument('ra', None)
         dec = self.get_query_argument('dec', None)
         radius = self.get_query_argument('radius', None)
@@ -175,28 +204,25 @@ class SourceHandler(BaseHandler):
                                      is_token=True)
             s = Source.get_if_owned_by(  # Returns Source.obj
                 obj_id, self.current_user,
-                options=[joinedload(Source.obj)
-                         .joinedload(Obj.comments),
-                         joinedload(Source.obj)
-                         .joinedload(Obj.followup_requests)
+                options=[joinedload(Obj.comments),
+                         joinedload(Obj.followup_requests)
                          .joinedload(FollowupRequest.requester),
-                         joinedload(Source.obj)
-                         .joinedload(Obj.followup_requests)
+                         joinedload(Obj.followup_requests)
                          .joinedload(FollowupRequest.instrument),
-                         joinedload(Source.obj)
-                         .joinedload(Obj.thumbnails)
+                         joinedload(Obj.thumbnails)
                          .joinedload(Thumbnail.photometry)
                          .joinedload(Photometry.instrument)
                          .joinedload(Instrument.telescope)])
             return self.success(data=s)
-        if page_number:
+        if page_number or cursor is not None:
             try:
-                page = int(page_number)
+                page = int(page_number or 1)
             except ValueError:
                 return self.error("Invalid page number value.")
             q = Obj.query.filter(Obj.id.in_(DBSession.query(
                 Source.obj_id).filter(Source.group_id.in_(
-                    [g.id for g in self.current_user.groups]))))
+                    user_group_ids(self.current_user))))).order_by(
+                        Obj.last_detected.desc().nullslast(), Obj.id)
             if sourceID:
                 q = q.filter(Obj.id.contains(sourceID.strip()))
             if any([ra, dec, radius]):
@@ -209,10 +235,9 @@ class SourceHandler(BaseHandler):
                     radius = float(radius)
                 except ValueError:
                     return self.error("Invalid values for ra, dec or radius - could not convert to float")
-                q = q.filter(Obj.ra <= ra + radius)\
-                     .filter(Obj.ra >= ra - radius)\
-                     .filter(Obj.dec <= dec + radius)\
-                     .filter(Obj.dec >= dec - radius)
+                if not radius >= 0:
+                    return self.error("radius must not be negative.")
+                q = q.filter(Obj.within_cone(ra, dec, radius))
             if start_date:
                 start_date = arrow.get(start_date.strip())
                 q = q.filter(Obj.last_detected >= start_date)
@@ -225,9 +250,26 @@ class SourceHandler(BaseHandler):
             if has_tns_name in ['true', True]:
                 q = q.filter(Obj.altdata['tns']['name'].isnot(None))
 
+            if cursor is not None:
+                try:
+                    query_results = grab_query_results_cursor(
+                        q, cursor, num_per_page, "sources"
+                    )
+                except ValueError as e:
+                    return self.error(str(e))
+                return self.success(data=query_results)
+            count_key = ('sources',
+                         tuple(sorted(user_group_ids(self.current_user))),
+                         sourceID, ra, dec, radius, str(start_date),
+                         str(end_date), simbad_class, has_tns_name)
             try:
                 query_results = grab_query_results_page(
-                    q, total_matches, page, num_per_page, "sources"
+                    q, total_matches, page, num_per_page, "sources",
+                    count_cache=match_count_cache(
+                        self.cfg['misc.match_count_ttl'],
+                        self.cfg['misc.match_count_estimate_threshold']
+                    ),
+                    count_key=count_key
                 )
             except ValueError as e:
                 if "Page number out of range" in str(e):
@@ -237,7 +279,7 @@ class SourceHandler(BaseHandler):
 
         sources = Obj.query.filter(Obj.id.in_(
             DBSession.query(Source.obj_id).filter(Source.group_id.in_(
-                [g.id for g in self.current_user.groups]
+                user_group_ids(self.current_user)
             ))
         )).all()
         return self.success(data={"sources": sources})
@@ -280,15 +322,15 @@ class SourceHandler(BaseHandler):
         """
         data = self.get_json()
         schema = Obj.__schema__()
-        user_group_ids = [int(g.id) for g in self.current_user.groups]
-        if not user_group_ids:
+        current_group_ids = user_group_ids(self.current_user)
+        if not current_group_ids:
             return self.error("You must belong to one or more groups before "
                               "you can add sources.")
         try:
             group_ids = [int(id) for id in data.pop('group_ids')
-                         if int(id) in user_group_ids]
+                         if int(id) in current_group_ids]
         except KeyError:
-            group_ids = user_group_ids
+            group_ids = current_group_ids
         if not group_ids:
             return self.error("Invalid group_ids field. Please specify at least "
                               "one valid group ID that you belong to.")
@@ -304,6 +346,7 @@ class SourceHandler(BaseHandler):
         DBSession.add(obj)
         DBSession.add_all([Source(obj=obj, group=group) for group in groups])
         DBSession().commit()
+        invalidate_match_counts()
 
         self.push_all(action="skyportal/FETCH_SOURCES")
         self.push_all(action="skyportal/FETCH_CANDIDATES")
@@ -345,6 +388,7 @@ class SourceHandler(BaseHandler):
             return self.error('Invalid/missing parameters: '
                               f'{e.normalized_messages()}')
         DBSession().commit()
+        invalidate_match_counts()
 
         return self.success(action='skyportal/FETCH_SOURCES')
 
@@ -370,13 +414,14 @@ class SourceHandler(BaseHandler):
               application/json:
                 schema: Success
         """
-        if group_id not in [g.id for g in self.current_user.groups]:
+        if group_id not in user_group_ids(self.current_user):
             return self.error("Inadequate permissions.")
         s = (DBSession.query(Source).filter(Source.obj_id == obj_id)
              .filter(Source.group_id == group_id).first())
         s.active = False
         s.unsaved_by = self.current_user
         DBSession().commit()
+        invalidate_match_counts()
 
         return self.success(action='skyportal/FETCH_SOURCES')
 
@@ -3,7 +3,10 @@ from sqlalchemy.orm import joinedload
 from marshmallow.exceptions import ValidationError
 from baselayer.app.access import permissions, auth_or_token
 from ..base import BaseHandler
-from ...models import DBSession, Spectrum, Comment, Instrument, Obj, Source
+from ...models import (DBSession, Spectrum, Comment, Instrument, Obj, Source,
+                       bump_data_revision)
+from ...utils.spectrum import (NORMALIZATIONS, normalize_spectrum,
+                               resample_spectrum)
 
 
 class SpectrumHandler(BaseHandler):
@@ -48,6 +51,7 @@ class SpectrumHandler(BaseHandler):
                               f'{e.normalized_messages()}')
         spec.instrument = instrument
         DBSession().add(spec)
+        bump_data_revision([spec.obj_id])
         DBSession().commit()
 
         return self.success(data={"id": spec.id})
@@ -63,6 +67,61 @@ class SpectrumHandler(BaseHandler):
             required: true
             schema:
               type: integer
+          - in: query
+            name: encoding
+            required: false
+            description: >-
+              Set to `arrow` (or send `Accept:
+              application/vnd.apache.arrow.stream`) to receive the
+              wavelengths, fluxes and errors as an Apache Arrow IPC stream,
+              with the other spectrum fields in the schema metadata.
+            schema:
+              type: string
+              enum:
+                - json
+                - arrow
+          - in: query
+            name: minWavelength
+            required: false
+            description: Only return the spectrum redward of this wavelength.
+            schema:
+              type: number
+          - in: query
+            name: maxWavelength
+            required: false
+            description: Only return the spectrum blueward of this wavelength.
+            schema:
+              type: number
+          - in: query
+            name: nPoints
+            required: false
+            description: >-
+              Rebin the (windowed) spectrum onto this many bins of equal
+              width, conserving flux. Cannot be combined with `resolution`.
+              At most 100000.
+            schema:
+              type: integer
+          - in: query
+            name: resolution
+            required: false
+            description: >-
+              Rebin the (windowed) spectrum onto bins of this width, in
+              Angstroms, conserving flux. Cannot be combined with `nPoints`.
+              The window can be split into at most 100000 bins.
+            schema:
+              type: number
+          - in: query
+            name: normalize
+            required: false
+            description: >-
+              Normalize the fluxes and errors before windowing. `median`
+              divides them by the absolute median flux around 6400 Angstroms
+              (or of the whole spectrum if it does not cover 6400 Angstroms),
+              as the PTF marshal does.
+            schema:
+              type: string
+              enum:
+                - median
         responses:
           200:
             content:
@@ -73,11 +132,66 @@ class SpectrumHandler(BaseHandler):
               application/json:
                 schema: Error
         """
+        try:
+            min_wavelength = self.get_query_argument('minWavelength', None)
+            min_wavelength = (None if min_wavelength is None
+                              else float(min_wavelength))
+            max_wavelength = self.get_query_argument('maxWavelength', None)
+            max_wavelength = (None if max_wavelength is None
+                              else float(max_wavelength))
+            resolution = self.get_query_argument('resolution', None)
+            resolution = None if resolution is None else float(resolution)
+        except ValueError:
+            return self.error('`minWavelength`, `maxWavelength` and '
+                              '`resolution` must be numbers.')
+        n_points = self.get_query_argument('nPoints', None)
+        if n_points is not None:
+            try:
+                n_points = int(n_points)
+            except ValueError:
+                return self.error(f"Invalid nPoints '{n_points}'.")
+        normalize = self.get_query_argument('normalize', None)
+        if normalize is not None and normalize not in NORMALIZATIONS:
+            return self.error("Invalid normalize. Must be one of "
+                              f"{NORMALIZATIONS}, got '{normalize}'.")
+
         spectrum = Spectrum.query.get(spectrum_id)
 
         if spectrum is not None:
             source = Source.get_if_owned_by(spectrum.obj_id, self.current_user)
-            return self.success(data=spectrum)
+            wavelengths = spectrum.wavelengths
+            fluxes = spectrum.fluxes
+            errors = spectrum.errors
+            try:
+                if normalize is not None:
+                    fluxes, errors = normalize_spectrum(
+                        wavelengths, fluxes, errors, method=normalize
+                    )
+                if not (min_wavelength is None and max_wavelength is None
+                        and n_points is None and resolution is None):
+                    wavelengths, fluxes, errors = resample_spectrum(
+                        wavelengths, fluxes, errors,
+                        min_wavelength=min_wavelength,
+                        max_wavelength=max_wavelength,
+                        n_points=n_points, resolution=resolution
+                    )
+            except ValueError as e:
+                return self.error(str(e))
+
+            if self.arrow_requested():
+                columns = {'wavelengths': wavelengths, 'fluxes': fluxes}
+                if errors is not None:
+                    columns['errors'] = errors
+                return self.success_arrow(columns, metadata={
+                    'id': spectrum.id,
+                    'obj_id': spectrum.obj_id,
+                    'instrument_id': spectrum.instrument_id,
+                    'observed_at': spectrum.observed_at.isoformat(),
+                    'origin': spectrum.origin
+                })
+            data = spectrum.to_dict()
+            data.update(wavelengths=wavelengths, fluxes=fluxes, errors=errors)
+            return self.success(data=data)
         else:
             return self.error(f"Could not load spectrum with ID {spectrum_id}")
 
@@ -107,16 +221,18 @@ class SpectrumHandler(BaseHandler):
                 schema: Error
         """
         spectrum = Spectrum.query.get(spectrum_id)
-        source = Source.get_if_owned_by(spectrum.obj_id, self.current_user)
+        obj_id = spectrum.obj_id
+        source = Source.get_if_owned_by(obj_id, self.current_user)
         data = self.get_json()
         data['id'] = spectrum_id
 
         schema = Spectrum.__schema__()
         try:
-            schema.load(data, partial=True)
+            spectrum = schema.load(data, partial=True)
         except ValidationError as e:
             return self.error('Invalid/missing parameters: '
                               f'{e.normalized_messages()}')
+        bump_data_revision({obj_id, spectrum.obj_id})
         DBSession().commit()
 
         return self.success()
@@ -145,6 +261,7 @@ class SpectrumHandler(BaseHandler):
         spectrum = Spectrum.query.get(spectrum_id)
         source = Source.get_if_owned_by(spectrum.obj_id, self.current_user)
         DBSession().delete(spectrum)
+        bump_data_revision([spectrum.obj_id])
         DBSession().commit()
 
         return self.success()
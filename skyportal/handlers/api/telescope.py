@@ -1,7 +1,7 @@
 from marshmallow.exceptions import ValidationError
 from baselayer.app.access import permissions, auth_or_token
 from ..base import BaseHandler
-from ...models import DBSession, Telescope, Group
+from ...models import DBSession, Telescope, Group, user_group_ids
 
 
 class TelescopeHandler(BaseHandler):
@@ -36,8 +36,10 @@ class TelescopeHandler(BaseHandler):
         """
         data = self.get_json()
         group_ids = data.pop('group_ids')
-        groups = [g for g in Group.query.filter(Group.id.in_(group_ids)).all()
-                  if g in self.current_user.groups]
+        groups = Group.query.filter(
+            Group.id.in_(group_ids),
+            Group.id.in_(user_group_ids(self.current_user))
+        ).all()
         if not groups:
             return self.error('You must specify at least one group of which you '
                               'are a member.')
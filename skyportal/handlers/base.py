@@ -1,12 +1,77 @@
+import json
+
+import numpy as np
+import pyarrow as pa
+
 from baselayer.app.handlers.base import BaseHandler as BaselayerHandler
 from .. import __version__
 
 
+ARROW_STREAM_TYPE = 'application/vnd.apache.arrow.stream'
+
+
 class BaseHandler(BaselayerHandler):
     def success(self, *args, **kwargs):
         super().success(*args, **kwargs,
                         extra={'version': __version__})
 
-    def error(self, *args, **kwargs):
+    def error(self, *args, status=400, **kwargs):
         super().error(*args, **kwargs,
                       extra={'version': __version__})
+        self.set_status(status)
+
+    def success_stream(self, items):
+        """Send a successful JSON response whose `data` is an object built
+        from `(key, value)` pairs.
+
+        Each pair is serialized and flushed to the client on its own, so the
+        serialized response is never assembled in memory. The values are
+        not: whatever `items` has computed before yielding a pair is held
+        until then.
+        """
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write('{"status": "success", '
+                   f'"version": {json.dumps(__version__)}, "data": {{')
+        for i, (key, value) in enumerate(items):
+            self.write(f'{", " if i else ""}{json.dumps(key)}: '
+                       f'{json.dumps(value)}')
+            self.flush()
+        return self.write('}}')
+
+    def arrow_requested(self):
+        """Whether the client asked for an Apache Arrow IPC stream instead of
+        JSON, either with `?encoding=arrow` or through the `Accept` header."""
+        return (self.get_query_argument('encoding', None) == 'arrow'
+                or ARROW_STREAM_TYPE in self.request.headers.get('Accept', ''))
+
+    def success_arrow(self, columns, metadata=None):
+        """Send a table of equal-length columns as an Arrow IPC stream.
+
+        Numeric columns are wrapped from their numpy buffers without
+        copying; nans become Arrow nulls.
+
+        Parameters
+        ----------
+        columns : dict
+            Column name -> 1D array.
+        metadata : dict, optional
+            Scalars describing the table (e.g. the object ID), stored as
+            string values in the schema metadata.
+        """
+        table = pa.Table.from_arrays(
+            [pa.array(np.asarray(value), from_pandas=True)
+             for value in columns.values()],
+            names=list(columns)
+        )
+        metadata = {'version': __version__, **(metadata or {})}
+        table = table.replace_schema_metadata(
+            {key: str(value) for key, value in metadata.items()}
+        )
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        self.set_status(200)
+        self.set_header('Content-Type', ARROW_STREAM_TYPE)
+        return self.write(sink.getvalue().to_pybytes())
@@ -1,3 +1,6 @@
+import time
+import zlib
+from collections import namedtuple
 from datetime import datetime
 import numpy as np
 
@@ -14,6 +17,7 @@ from baselayer.app.custom_exceptions import AccessError
 
 from . import schema
 from .phot_enum import allowed_bandpasses, thumbnail_types
+from .utils.healpix import HEALPIX_ORDER, radec_to_healpix, cone_ranges
 
 
 # In the AB system, a brightness of 23.9 mag corresponds to 1 microJy. Using this
@@ -53,6 +57,69 @@ class NumpyArray(sa.types.TypeDecorator):
         return np.array(value)
 
 
+# item types of `BinaryArray` values, by header code
+BINARY_ARRAY_DTYPES = {b'f': np.dtype('<f4'), b'd': np.dtype('<f8')}
+
+
+class BinaryArray(sa.types.TypeDecorator):
+    """1-d numpy array stored as little-endian bytes in a `bytea` column.
+
+    Values start with an 8-byte header: the item type (`f` for float32, `d`
+    for float64), the compression (`z` for zlib, `-` for none) and padding,
+    so that values written with different options stay readable and the
+    items stay aligned. Uncompressed values are decoded without copying by
+    `np.frombuffer`, and are thus read-only.
+
+    Values of columns still of the `float8[]` type of `NumpyArray` (see
+    `tools/migrate_spectra_arrays.py`) are read as arrays too, but cannot
+    be written until the column is migrated.
+
+    Parameters
+    ----------
+    dtype : {'float64', 'float32'}
+        Item type of the stored values.
+    compress : bool
+        Whether to compress the stored values with zlib.
+    """
+    impl = sa.LargeBinary
+    # arrays are (de)serialized as lists by the generated schemas
+    python_type = list
+    header_size = 8
+
+    def __init__(self, dtype='float64', compress=False):
+        super().__init__()
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        if self.dtype not in BINARY_ARRAY_DTYPES.values():
+            raise ValueError(f'Unsupported BinaryArray dtype {dtype}.')
+        self.compress = compress
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        data = np.ascontiguousarray(value, dtype=self.dtype).ravel().tobytes()
+        code = b'f' if self.dtype.itemsize == 4 else b'd'
+        if self.compress:
+            return code + b'z' + bytes(self.header_size - 2) + zlib.compress(data)
+        return code + b'-' + bytes(self.header_size - 2) + data
+
+    def result_processor(self, dialect, coltype):
+        # skip the processor of `impl`, which copies values into `bytes`
+        # (and fails on the lists of not yet migrated columns)
+        return lambda value: self.process_result_value(value, dialect)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, list):
+            return np.array(value, dtype=float)
+        value = memoryview(value)
+        dtype = BINARY_ARRAY_DTYPES[bytes(value[:1])]
+        if bytes(value[1:2]) == b'z':
+            return np.frombuffer(zlib.decompress(value[self.header_size:]),
+                                 dtype=dtype)
+        return np.frombuffer(value, dtype=dtype, offset=self.header_size)
+
+
 class Group(Base):
     name = sa.Column(sa.String, unique=True, nullable=False)
 
@@ -105,6 +172,11 @@ class Obj(Base):
     ra = sa.Column(sa.Float)
     dec = sa.Column(sa.Float)
 
+    healpix = sa.Column(sa.BigInteger, nullable=True, index=True,
+                        doc=f'NESTED HEALPix index of order {HEALPIX_ORDER} '
+                            'of (ra, dec), kept up to date on insert and '
+                            'update. Used by `Obj.within_cone`.')
+
     ra_dis = sa.Column(sa.Float)
     dec_dis = sa.Column(sa.Float)
 
@@ -130,6 +202,19 @@ class Obj(Base):
 
     origin = sa.Column(sa.String, nullable=True)
 
+    # matches the order of paginated source and candidate listings, so that
+    # their (last_detected, id) cursors are answered from the index
+    __table_args__ = (
+        sa.Index('objs_last_detected_id_index',
+                 last_detected.desc().nullslast(), id),
+    )
+
+    data_revision = sa.Column(sa.Integer, nullable=False, default=0,
+                              server_default='0',
+                              doc='Incremented whenever the photometry or '
+                                  'spectra of the object change. Part of the '
+                                  'key of cached plots.')
+
     comments = relationship('Comment', back_populates='obj',
                             cascade='save-update, merge, refresh-expire, expunge',
                             passive_deletes=True,
@@ -163,6 +248,23 @@ class Obj(Base):
         DBSession().add_all([sdss_thumb, dr8_thumb])
         DBSession().commit()
 
+    @classmethod
+    def within_cone(cls, ra, dec, radius):
+        """Return a filter selecting objects within `radius` degrees of
+        `ra`, `dec`: index ranges of `Obj.healpix` covering the cone, followed
+        by an exact great-circle distance check."""
+        ranges = cone_ranges(ra, dec, radius)
+        ra1, dec1 = sa.func.radians(cls.ra), sa.func.radians(cls.dec)
+        ra2, dec2 = float(np.radians(ra)), float(np.radians(dec))
+        haversine = (sa.func.power(sa.func.sin((dec1 - dec2) / 2), 2)
+                     + sa.func.cos(dec1) * float(np.cos(dec2))
+                     * sa.func.power(sa.func.sin((ra1 - ra2) / 2), 2))
+        return sa.and_(
+            sa.or_(*[cls.healpix.between(start, stop - 1)
+                     for start, stop in ranges]),
+            haversine <= float(np.sin(np.radians(min(radius, 180)) / 2) ** 2)
+        )
+
     @property
     def sdss_url(self):
         """Construct URL for public Sloan Digital Sky Survey (SDSS) cutout."""
@@ -177,6 +279,23 @@ class Obj(Base):
                 f"&dec={self.dec}&size=200&layer=dr8&pixscale=0.262&bands=grz")
 
 
+@sa.event.listens_for(Obj, 'before_insert')
+@sa.event.listens_for(Obj, 'before_update')
+def update_healpix(mapper, connection, target):
+    if target.ra is None or target.dec is None:
+        target.healpix = None
+    else:
+        target.healpix = int(radec_to_healpix(target.ra, target.dec))
+
+
+def bump_data_revision(obj_ids):
+    """Record that the photometry or spectra of objects changed, so that
+    plots cached for an older `Obj.data_revision` are no longer used."""
+    DBSession().query(Obj).filter(Obj.id.in_(list(obj_ids))).update(
+        {Obj.data_revision: Obj.data_revision + 1}, synchronize_session=False
+    )
+
+
 class Filter(Base):
     query_string = sa.Column(sa.String, nullable=False, unique=False)
     group_id = sa.Column(sa.ForeignKey("groups.id"))
@@ -189,26 +308,16 @@ Candidate.passing_alert_id = sa.Column(sa.Integer)
 
 
 def get_candidate_if_owned_by(obj_id, user_or_token, options=[]):
-    if Candidate.query.filter(Candidate.obj_id == obj_id).first() is None:
+    access = resolve_obj_access([obj_id], user_or_token, options).get(obj_id)
+    if access is None or not access.has_candidate:
         return None
-    user_group_ids = [g.id for g in user_or_token.groups]
-    c = (
-        Candidate.query.filter(Candidate.obj_id == obj_id)
-        .filter(
-            Candidate.filter_id.in_(
-                DBSession.query(Filter.id).filter(Filter.group_id.in_(user_group_ids))
-            )
-        )
-        .options(options)
-        .first()
-    )
-    if c is None:
+    if not access.candidate_visible:
         raise AccessError("Insufficient permissions.")
-    return c.obj
+    return access.obj
 
 
 def candidate_is_owned_by(self, user_or_token):
-    return self.filter.group in user_or_token.groups
+    return self.filter.group_id in user_group_ids(user_or_token)
 
 
 Candidate.get_if_owned_by = get_candidate_if_owned_by
@@ -233,18 +342,16 @@ Source.unsaved_by = relationship("User", foreign_keys=[Source.unsaved_by_id])
 def source_is_owned_by(self, user_or_token):
     source_group_ids = [row[0] for row in DBSession.query(
         Source.group_id).filter(Source.obj_id == self.obj_id).all()]
-    return bool(set(source_group_ids) & {g.id for g in user_or_token.groups})
+    return bool(set(source_group_ids) & set(user_group_ids(user_or_token)))
 
 
 def get_source_if_owned_by(obj_id, user_or_token, options=[]):
-    if Source.query.filter(Source.obj_id == obj_id).first() is None:
+    access = resolve_obj_access([obj_id], user_or_token, options).get(obj_id)
+    if access is None or not access.has_source:
         return None
-    user_group_ids = [g.id for g in user_or_token.groups]
-    s = (Source.query.filter(Source.obj_id == obj_id)
-         .filter(Source.group_id.in_(user_group_ids)).options(options).first())
-    if s is None:
+    if not access.source_visible:
         raise AccessError("Insufficient permissions.")
-    return s.obj
+    return access.obj
 
 
 Source.is_owned_by = source_is_owned_by
@@ -252,18 +359,143 @@ Source.get_if_owned_by = get_source_if_owned_by
 
 
 def get_obj_if_owned_by(obj_id, user_or_token, options=[]):
-    try:
-        obj = Source.get_if_owned_by(obj_id, user_or_token, options)
-    except AccessError:  # They may still be able to view the associated Candidate
-        obj = Candidate.get_if_owned_by(obj_id, user_or_token, options)
-        if obj is None:
-            # If user can't view associated Source, and there's no Candidate they can
-            # view, raise AccessError
-            raise
-    if obj is None:  # There is no associated Source, so just return the Obj
-        return Obj.query.options(options).get(obj_id)
-    # If we get here, the user has access to either the associated Source or Candidate
-    return obj
+    access = resolve_obj_access([obj_id], user_or_token, options).get(obj_id)
+    if access is None:
+        return None
+    # objects that are not saved as sources are visible to all; otherwise the
+    # user needs access to one of the sources or candidates
+    if (access.has_source and not access.source_visible
+            and not access.candidate_visible):
+        raise AccessError("Insufficient permissions.")
+    return access.obj
+
+
+class IdentityCache:
+    """Cache, per app process, of the group IDs, filter IDs and ACLs of
+    callers.
+
+    Group and filter IDs are stored by user, and shared by the user's
+    tokens; ACLs are stored by user or token. Entries expire after `ttl`
+    seconds; a `ttl` of 0 disables the cache. Changes to groups and group
+    memberships made by this process drop the affected entries (see
+    `invalidate`); other app processes see them once entries expire.
+    """
+
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self.entries = {}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def put(self, key, value):
+        if self.ttl > 0:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, user_id=None):
+        """Drop the entries of the user `user_id`, or all entries."""
+        if user_id is None:
+            self.entries.clear()
+        else:
+            for key in [key for key in self.entries
+                        if key[1:] == ('user', user_id)]:
+                del self.entries[key]
+
+
+# identity cache of this process; its TTL is set from the app config
+IDENTITY_CACHE = IdentityCache()
+
+
+def _cached_identity(user_or_token, name, compute, by_user=True):
+    """Return `compute()`, memoized on `user_or_token` for the rest of the
+    request and in `IDENTITY_CACHE`.
+
+    `user_or_token` only lives as long as the session of the current
+    request, so the memo never outlives it.
+    """
+    memo = user_or_token.__dict__.setdefault('_identity', {})
+    if name not in memo:
+        if isinstance(user_or_token, Token):
+            key = ((name, 'user', user_or_token.created_by_id) if by_user
+                   else (name, 'token', user_or_token.id))
+        else:
+            key = (name, 'user', user_or_token.id)
+        value = IDENTITY_CACHE.get(key)
+        if value is None:
+            value = compute()
+            IDENTITY_CACHE.put(key, value)
+        memo[name] = value
+    return memo[name]
+
+
+def user_group_ids(user_or_token):
+    """IDs of the groups of a user, or of the user who created a token."""
+    user_id = (user_or_token.created_by_id
+               if isinstance(user_or_token, Token) else user_or_token.id)
+    return _cached_identity(user_or_token, 'group_ids', lambda: [
+        row[0] for row in DBSession().query(GroupUser.group_id)
+        .filter(GroupUser.user_id == user_id)
+    ])
+
+
+def user_filter_ids(user_or_token):
+    """IDs of the filters of the groups of a user, or of the user who
+    created a token."""
+    group_ids = user_group_ids(user_or_token)
+    return _cached_identity(user_or_token, 'filter_ids', lambda: [
+        row[0] for row in DBSession().query(Filter.id)
+        .filter(Filter.group_id.in_(group_ids))
+    ])
+
+
+def user_acl_ids(user_or_token):
+    """IDs of the ACLs of a user or token."""
+    return _cached_identity(user_or_token, 'acl_ids', lambda: [
+        acl.id for acl in user_or_token.acls
+    ], by_user=False)
+
+
+ObjAccess = namedtuple('ObjAccess', ['obj', 'has_source', 'source_visible',
+                                     'has_candidate', 'candidate_visible'])
+ObjAccess.__doc__ = """An object, whether it is saved as a source and/or
+candidate, and whether a user can see any of these sources or candidates."""
+
+
+def resolve_obj_access(obj_ids, user_or_token, options=[]):
+    """Load objects together with the source and candidate access of
+    `user_or_token` to them, in a single query.
+
+    Parameters
+    ----------
+    obj_ids : list of str
+        IDs of the objects.
+    user_or_token : `baselayer.app.models.User` or `baselayer.app.models.Token`
+        The caller.
+    options : list, optional
+        Loader options for `Obj`, e.g. `joinedload(Obj.comments)`.
+
+    Returns
+    -------
+    dict
+        `ObjAccess` by object ID, for the objects that exist.
+    """
+    group_ids = user_group_ids(user_or_token)
+    has_source = sa.exists().where(Source.obj_id == Obj.id)
+    source_visible = sa.exists().where(sa.and_(
+        Source.obj_id == Obj.id, Source.group_id.in_(group_ids)
+    ))
+    has_candidate = sa.exists().where(Candidate.obj_id == Obj.id)
+    candidate_visible = sa.exists().where(sa.and_(
+        Candidate.obj_id == Obj.id, Candidate.filter_id == Filter.id,
+        Filter.group_id.in_(group_ids)
+    ))
+    rows = (DBSession().query(Obj, has_source, source_visible, has_candidate,
+                              candidate_visible)
+            .options(options).filter(Obj.id.in_(list(obj_ids))).all())
+    return {row[0].id: ObjAccess(*row) for row in rows}
 
 
 Obj.get_if_owned_by = get_obj_if_owned_by
@@ -361,6 +593,14 @@ class Comment(Base):
 
 class Photometry(Base):
     __tablename__ = 'photometry'
+    __table_args__ = (
+        # incremental light curve syncs scan the points of an object written
+        # after a change cursor
+        sa.Index('photometry_obj_id_txid_index', 'obj_id', 'txid'),
+        # natural key, used to deduplicate replayed uploads
+        sa.UniqueConstraint('obj_id', 'instrument_id', 'filter', 'mjd',
+                            'origin', name='photometry_natural_key'),
+    )
     mjd = sa.Column(sa.Float, nullable=False, doc='MJD of the observation.')
     flux = sa.Column(sa.Float,
                      doc='Flux of the observation in µJy. '
@@ -379,6 +619,10 @@ class Photometry(Base):
     ra_unc = sa.Column(sa.Float, doc="Uncertainty of ra position [arcsec]")
     dec_unc = sa.Column(sa.Float, doc="Uncertainty of dec position [arcsec]")
 
+    origin = sa.Column(sa.String, nullable=True,
+                       doc='Provenance of the photometry (e.g., the pipeline '
+                           'or data release it comes from).')
+
     original_user_data = sa.Column(JSONB, doc='Original data passed by the user '
                                               'through the PhotometryHandler.POST '
                                               'API or the PhotometryHandler.PUT '
@@ -387,6 +631,11 @@ class Photometry(Base):
                                               'schema.PhotometryFlux or schema.PhotometryMag '
                                               '(depending on how the data was passed).')
     altdata = sa.Column(JSONB)
+    txid = sa.Column(sa.BigInteger, nullable=False,
+                     server_default=sa.text('txid_current()'),
+                     onupdate=sa.func.txid_current(),
+                     doc='ID of the transaction that last wrote the point, '
+                         'the change cursor of incremental syncs.')
 
     obj_id = sa.Column(sa.ForeignKey('objs.id', ondelete='CASCADE'),
                        nullable=False, index=True)
@@ -431,12 +680,72 @@ class Photometry(Base):
         )
 
 
+class DeletedPhotometry(Base):
+    """Tombstone of a deleted photometry point, so that clients syncing a
+    light curve incrementally learn about the deletion. Tombstones are
+    written by the `photometry_tombstone` trigger, whatever deletes the
+    point."""
+    __tablename__ = 'deleted_photometry'
+    __table_args__ = (sa.Index('deleted_photometry_obj_id_txid_index',
+                               'obj_id', 'txid'),)
+    photometry_id = sa.Column(sa.Integer, nullable=False,
+                              doc='ID of the deleted photometry point.')
+    obj_id = sa.Column(sa.ForeignKey('objs.id', ondelete='CASCADE'),
+                       nullable=False)
+    txid = sa.Column(sa.BigInteger, nullable=False,
+                     server_default=sa.text('txid_current()'),
+                     doc='ID of the transaction that deleted the point.')
+
+
+# Records a tombstone for every deleted photometry point, including bulk and
+# cascaded deletes that bypass the ORM. Points deleted along with their
+# object get none, as the object's tombstones go with it.
+PHOTOMETRY_TOMBSTONE_DDL = """
+CREATE OR REPLACE FUNCTION photometry_tombstone() RETURNS trigger AS $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM objs WHERE id = OLD.obj_id) THEN
+        INSERT INTO deleted_photometry (photometry_id, obj_id, created_at,
+                                        modified)
+        VALUES (OLD.id, OLD.obj_id, LOCALTIMESTAMP, LOCALTIMESTAMP);
+    END IF;
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS photometry_tombstone ON photometry;
+CREATE TRIGGER photometry_tombstone AFTER DELETE ON photometry
+    FOR EACH ROW EXECUTE PROCEDURE photometry_tombstone();
+"""
+sa.event.listen(Photometry.__table__, 'after_create',
+                sa.DDL(PHOTOMETRY_TOMBSTONE_DDL))
+
+
+class PhotometryIngestJob(Base):
+    """An upload to `PhotometryHandler.post` processed in the background."""
+    __tablename__ = 'photometry_ingest_jobs'
+    status = sa.Column(sa.Enum('pending', 'running', 'complete', 'failed',
+                               name='photometry_ingest_job_statuses'),
+                       nullable=False, default='pending')
+    username_or_token_id = sa.Column(sa.String, nullable=False,
+                                     doc='Submitter of the job.')
+    is_token = sa.Column(sa.Boolean, nullable=False, default=False)
+    mode = sa.Column(sa.String, nullable=False, default='insert',
+                     doc="Insert mode, 'insert' or 'upsert'.")
+    rows = sa.Column(sa.Integer, nullable=False,
+                     doc='Number of photometry points submitted.')
+    photometry_ids = sa.Column(psql.ARRAY(sa.Integer),
+                               doc='IDs of the ingested photometry points.')
+    errors = sa.Column(JSONB, doc='Errors of a failed job, as a list of '
+                                  '{"row": index, "message": message}.')
+    started_at = sa.Column(sa.DateTime)
+    finished_at = sa.Column(sa.DateTime)
+    rows_per_second = sa.Column(sa.Float)
+
+
 class Spectrum(Base):
     __tablename__ = 'spectra'
-    # TODO better numpy integration
-    wavelengths = sa.Column(NumpyArray, nullable=False)
-    fluxes = sa.Column(NumpyArray, nullable=False)
-    errors = sa.Column(NumpyArray)
+    wavelengths = sa.Column(BinaryArray, nullable=False)
+    fluxes = sa.Column(BinaryArray, nullable=False)
+    errors = sa.Column(BinaryArray)
 
     obj_id = sa.Column(sa.ForeignKey('objs.id', ondelete='CASCADE'),
                        nullable=False, index=True)
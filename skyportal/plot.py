@@ -1,3 +1,6 @@
+import json
+import functools
+
 import numpy as np
 import pandas as pd
 
@@ -16,15 +19,19 @@ from matplotlib import cm
 from matplotlib.colors import rgb2hex
 
 import os
-from skyportal.models import (DBSession, Obj, Photometry,
+from skyportal.models import (DBSession, Obj, Photometry, Spectrum,
                               Instrument, Telescope, PHOT_ZP)
+from skyportal.utils.photometry import DETECT_THRESH, stack_photometry
 
 import sncosmo
 from sncosmo.photdata import PhotometricData
 from astropy.table import Table
 
 
-DETECT_THRESH = 5  # sigma
+# light curve pyramid: level k keeps the extremes of PYRAMID_BASE_BUCKETS * 2**k
+# MJD buckets, and level PYRAMID_LEVELS is the full light curve
+PYRAMID_BASE_BUCKETS = 64
+PYRAMID_LEVELS = 10
 
 SPEC_LINES = {
     'H': ([3970, 4102, 4341, 4861, 6563], '#ff0000'),
@@ -141,9 +148,18 @@ def _plot_to_json(plot):
 
     docs_json = serialize_json(docs_json)
     render_items = serialize_json(render_items)
-    custom_model_js = bundle_all_models()
 
-    return docs_json, render_items, custom_model_js
+    return docs_json, render_items
+
+
+@functools.lru_cache(maxsize=None)
+def custom_model_js():
+    """Return the compiled JS of the custom Bokeh models used by the plots.
+
+    The models are the same for every plot, so they are compiled once per
+    process and served separately from the plots themselves.
+    """
+    return bundle_all_models()
 
 
 tooltip_format = [('mjd', '@mjd{0.000000}'),
@@ -158,21 +174,177 @@ tooltip_format = [('mjd', '@mjd{0.000000}'),
 cmap = cm.get_cmap('jet_r')
 
 
+# plot color of each bandpass, filled in by `get_color` as bandpasses are
+# plotted, since computing it requires loading the bandpass
+BANDPASS_COLORS = {'ztfg': 'green', 'ztfi': 'orange', 'ztfr': 'red'}
+
+
 def get_color(bandpass_name, cmap_limits=(3000., 10000.)):
-    if bandpass_name.startswith('ztf'):
-        return {'ztfg': 'green', 'ztfi': 'orange', 'ztfr': 'red'}[bandpass_name]
-    else:
+    if bandpass_name not in BANDPASS_COLORS:
         bandpass = sncosmo.get_bandpass(bandpass_name)
         wave = bandpass.wave_eff
         rgb = cmap((cmap_limits[1] - wave) /
                    (cmap_limits[1] - cmap_limits[0])
                    )[:3]
-        bandcolor = rgb2hex(rgb)
+        BANDPASS_COLORS[bandpass_name] = rgb2hex(rgb)
+
+    return BANDPASS_COLORS[bandpass_name]
+
+
+def error_bars(x, y, err):
+    """Return the columns of vertical error bars for `segment` glyphs.
+
+    Parameters
+    ----------
+    x, y, err : array_like
+        Positions of the points and their errors.
+
+    Returns
+    -------
+    dict of numpy.ndarray
+        `x`, and the ends of the bars `y0 = y - err` and `y1 = y + err`.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    err = np.asarray(err, dtype=float)
+    return {'x': x, 'y0': y - err, 'y1': y + err}
+
+
+# columns of plotted data holding numbers, sent as base64-encoded float64
+# arrays rather than JSON lists (see `column_data`)
+FLOAT_COLUMNS = {'mjd', 'flux', 'fluxerr', 'mag', 'magerr', 'lim_mag', 'zp',
+                 'alpha', 'wavelength', 'x', 'y0', 'y1'}
+
+
+def column_data(df, columns):
+    """Return the data of a `ColumnDataSource` holding only `columns` of `df`.
+
+    The columns in `FLOAT_COLUMNS` are contiguous float64 arrays (with nans
+    for missing values), which Bokeh serializes as base64-encoded binary
+    instead of JSON lists of numbers; the others are lists.
+    """
+    return {column: (np.ascontiguousarray(df[column], dtype=float)
+                     if column in FLOAT_COLUMNS else list(df[column]))
+            for column in columns}
+
+
+def photometry_data(obj_id):
+    """Read the photometry of an object, with telescope and instrument names,
+    into a DataFrame for `photometry_figure`."""
+    return pd.read_sql(DBSession()
+                       .query(Photometry, Telescope.nickname.label('telescope'),
+                              Instrument.name.label('instrument'))
+                       .join(Instrument).join(Telescope)
+                       .filter(Photometry.obj_id == obj_id)
+                       .statement, DBSession().bind)
+
+
+def _first_per_bucket(bucket, values):
+    """Return the position of the smallest of `values` in each bucket, ties
+    going to the first position."""
+    order = np.lexsort((values, bucket))
+    sorted_bucket = bucket[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_bucket[1:] != sorted_bucket[:-1]
+    return order[first]
+
+
+def pyramid_levels(mjd, flux, fluxerr, start, end,
+                   levels=PYRAMID_LEVELS, base_buckets=PYRAMID_BASE_BUCKETS):
+    """Return the coarsest pyramid level of each point of a light curve.
+
+    At level `k`, `[start, end]` is split into `base_buckets * 2**k` equal
+    MJD buckets, and each bucket keeps its brightest and faintest detections
+    and its deepest upper limit (non-detection with the smallest
+    `fluxerr`). The buckets of a level are split in two at the next, so
+    every point kept at a level is also kept at all finer ones, and a level
+    is the points whose level is at most `k`. Points kept at no level get
+    `levels`, i.e. only appear in the full light curve. The first and last
+    points are always at level 0.
+
+    Parameters
+    ----------
+    mjd, flux, fluxerr : array_like
+        The light curve of one instrument and filter, sorted by MJD. `flux`
+        is NaN for non-detections.
+    start, end : float
+        MJD range of the buckets, shared by the light curves of an object
+        so that their levels cover the same time resolution.
+
+    Returns
+    -------
+    numpy.ndarray
+        The level of each point.
+    """
+    mjd = np.asarray(mjd, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    fluxerr = np.asarray(fluxerr, dtype=float)
+    result = np.full(len(mjd), levels)
+    if len(mjd) == 0:
+        return result
+
+    detected = np.flatnonzero(np.isfinite(flux))
+    limits = np.flatnonzero(~np.isfinite(flux))
+    span = max(end - start, np.finfo(float).eps)
+    for k in range(levels - 1, -1, -1):
+        n_buckets = base_buckets * 2 ** k
+        bucket = np.clip(((mjd - start) / span * n_buckets).astype(int),
+                         0, n_buckets - 1)
+        for index, values in ((detected, flux[detected]),
+                              (detected, -flux[detected]),
+                              (limits, fluxerr[limits])):
+            if len(index) > 0:
+                result[index[_first_per_bucket(bucket[index], values)]] = k
+    result[[0, -1]] = 0
+    return result
+
+
+def photometry_pyramid(data):
+    """Add the pyramid `level` of each point, per instrument and filter, to
+    photometry read by `photometry_data`, sorted by MJD."""
+    data = data.sort_values('mjd', kind='mergesort').reset_index(drop=True)
+    data['level'] = PYRAMID_LEVELS
+    start, end = data['mjd'].min(), data['mjd'].max()
+    for _, group in data.groupby(['instrument_id', 'filter'], sort=False):
+        data.loc[group.index, 'level'] = pyramid_levels(
+            group['mjd'], group['flux'], group['fluxerr'], start, end
+        )
+    return data
 
-        return bandcolor
+
+def pyramid_resolution(pyramid, width, start_mjd=None, end_mjd=None):
+    """Return the coarsest pyramid level with at least one bucket every two
+    pixels of `[start_mjd, end_mjd]` plotted `width` pixels wide.
+
+    Both ends of the window default to the ends of the light curve.
+    """
+    if pyramid.empty:
+        return PYRAMID_LEVELS
+    first, last = pyramid['mjd'].min(), pyramid['mjd'].max()
+    start_mjd = first if start_mjd is None else max(start_mjd, first)
+    end_mjd = last if end_mjd is None else min(end_mjd, last)
+    window = max(end_mjd - start_mjd, np.finfo(float).eps)
+
+    n_buckets = width / 2 * (last - first) / window
+    level = int(np.ceil(np.log2(max(n_buckets / PYRAMID_BASE_BUCKETS, 1))))
+    return min(level, PYRAMID_LEVELS)
+
+
+def downsample_photometry(pyramid, width, start_mjd=None, end_mjd=None):
+    """Select the points of a `photometry_pyramid` to plot in a window.
+
+    Returns the points in `[start_mjd, end_mjd]` of the level picked by
+    `pyramid_resolution`, in the format returned by `photometry_data`.
+    """
+    level = pyramid_resolution(pyramid, width, start_mjd, end_mjd)
+    keep = pyramid['level'] <= level
+    if start_mjd is not None:
+        keep &= pyramid['mjd'] >= start_mjd
+    if end_mjd is not None:
+        keep &= pyramid['mjd'] <= end_mjd
+    return pyramid[keep].drop(columns='level').reset_index(drop=True)
 
 
-# TODO make async so that thread isn't blocked
 def photometry_plot(obj_id, width=600, height=300):
     """Create scatter plot of photometry for object.
     Parameters
@@ -184,23 +356,121 @@ def photometry_plot(obj_id, width=600, height=300):
     (str, str)
         Returns (docs_json, render_items) json for the desired plot.
     """
+    data = downsample_photometry(photometry_pyramid(photometry_data(obj_id)),
+                                 width)
+    return photometry_figure(obj_id, data, width=width, height=height)
 
-    data = pd.read_sql(DBSession()
-                       .query(Photometry, Telescope.nickname.label('telescope'),
-                              Instrument.name.label('instrument'))
-                       .join(Instrument).join(Telescope)
-                       .filter(Photometry.obj_id == obj_id)
-                       .statement, DBSession().bind)
+
+# columns of the sources of plotted points, used by the glyphs, the hover
+# tool and the callbacks in static/js/plotjs
+POINT_COLUMNS = ['mjd', 'flux', 'fluxerr', 'mag', 'magerr', 'lim_mag',
+                 'filter', 'instrument', 'color', 'alpha', 'stacked']
+
+# columns of the sources of stacked points
+STACKED_COLUMNS = ['mjd', 'flux', 'fluxerr', 'filter', 'color', 'lim_mag',
+                   'mag', 'magerr', 'instrument', 'stacked']
+
+
+def stacked_photometry(data, binsize):
+    """Stack photometry read by `photometry_data` in MJD bins of `binsize`
+    days with `stack_photometry`, per light curve of `photometry_figure`."""
+    return stack_photometry(data, binsize, by=('instrument', 'filter'))
+
+
+def _stacked_columns(stacked):
+    """Add the plotted columns to the output of `stacked_photometry`, and
+    split it by legend label."""
+    stacked = stacked.copy()
+    stacked['label'] = [f'{i} {f}-band' for i, f in zip(stacked['instrument'],
+                                                        stacked['filter'])]
+    stacked['color'] = stacked['filter'].map(
+        {f: get_color(f) for f in stacked['filter'].unique()}
+    )
+    flux = stacked['flux'].to_numpy(dtype=float)
+    fluxerr = stacked['fluxerr'].to_numpy(dtype=float)
+    detected = stacked['detected'].to_numpy(dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stacked['mag'] = np.where(detected, -2.5 * np.log10(flux) + PHOT_ZP,
+                                  np.nan)
+        stacked['magerr'] = np.where(detected,
+                                     2.5 / np.log(10) * fluxerr / flux, np.nan)
+        stacked['lim_mag'] = -2.5 * np.log10(fluxerr * DETECT_THRESH) + PHOT_ZP
+    stacked['zp'] = PHOT_ZP
+    stacked['magsys'] = 'ab'
+    stacked['stacked'] = True
+    return {label: df for label, df in stacked.groupby('label', sort=False)}
+
+
+def _stack_callback_code(filename, obj_id, split, data):
+    """Return the code of a binsize slider callback: `filename`, preceded
+    by the helpers of `stackfetch.js` that fetch the stacked points of the
+    light curves in `split`, as plotted from `data`."""
+    light_curves = [
+        {'filter': df['filter'].iloc[0], 'color': df['color'].iloc[0],
+         'instrument': df['instrument'].iloc[0],
+         'instrument_ids': sorted(int(i) for i in df['instrument_id'].unique())}
+        for _, df in split
+    ]
+    plot_window = [float(data['mjd'].min()), float(data['mjd'].max())]
+    directory = os.path.join(os.path.dirname(__file__), '../static/js/plotjs')
+    code = ''.join(open(os.path.join(directory, name)).read()
+                   for name in ['stackfetch.js', filename])
+    return (code.replace('objname', obj_id)
+            .replace('detect_thresh', str(DETECT_THRESH))
+            .replace('light_curves_json', json.dumps(light_curves))
+            .replace('plot_window_json', json.dumps(plot_window)))
+
+
+def photometry_window_figure(obj_id, pyramid, width=600, height=300,
+                             start_mjd=None, end_mjd=None, binsize=0):
+    """Plot the window `[start_mjd, end_mjd]` of a `photometry_pyramid`
+    with `photometry_figure`, downsampled to `width` by
+    `downsample_photometry`. Stacked points are computed from the full light
+    curve.
+
+    This does not touch the database, so it can run in a worker process.
+    """
+    stacked = None
+    if binsize > 0:
+        stacked = stacked_photometry(pyramid.drop(columns='level'), binsize)
+        if start_mjd is not None:
+            stacked = stacked[stacked['mjd'] >= start_mjd]
+        if end_mjd is not None:
+            stacked = stacked[stacked['mjd'] <= end_mjd]
+    data = downsample_photometry(pyramid, width, start_mjd, end_mjd)
+    return photometry_figure(obj_id, data, width=width, height=height,
+                             binsize=binsize, stacked=stacked)
+
+
+def photometry_figure(obj_id, data, width=600, height=300, binsize=0,
+                      stacked=None):
+    """Create scatter plot of photometry already read by `photometry_data`.
+
+    If `binsize` is positive, the light curves are shown stacked in bins of
+    that many days, as returned by `stacked_photometry` in `stacked` (or
+    computed from `data` if not given).
+
+    This does not touch the database, so it can run in a worker process.
+    """
     if data.empty:
-        return None, None, None
+        return None, None
+
+    if binsize > 0 and stacked is None:
+        stacked = stacked_photometry(data, binsize)
+    stacked_split = _stacked_columns(stacked) if binsize > 0 else {}
+    no_bins = pd.DataFrame(columns=STACKED_COLUMNS + ['detected', 'zp',
+                                                      'magsys'])
 
-    data['color'] = [get_color(f) for f in data['filter']]
+    data['color'] = data['filter'].map(
+        {f: get_color(f) for f in data['filter'].unique()}
+    )
     data['label'] = [f'{i} {f}-band' for i, f in zip(data['instrument'],
                                                      data['filter'])]
 
     data['zp'] = PHOT_ZP
     data['magsys'] = 'ab'
-    data['alpha'] = 1.
+    # raw points are faded when stacked points are shown
+    data['alpha'] = 0.1 if binsize > 0 else 1.
     data['lim_mag'] = -2.5 * np.log10(data['fluxerr'] * DETECT_THRESH) + data['zp']
 
     # Passing a dictionary to a bokeh datasource causes the frontend to die, 
@@ -254,6 +524,8 @@ def photometry_plot(obj_id, width=600, height=300):
 
         # for the flux plot, we only show things that have a flux value
         df = sdf[sdf['hasflux']]
+        bins = stacked_split.get(label, no_bins)
+        bins = bins[np.isfinite(bins['flux'].to_numpy(dtype=float))]
 
         key = f'obs{i}'
         model_dict[key] = plot.scatter(
@@ -262,7 +534,7 @@ def photometry_plot(obj_id, width=600, height=300):
             marker='circle',
             fill_color='color',
             alpha='alpha',
-            source=ColumnDataSource(df),
+            source=ColumnDataSource(column_data(df, POINT_COLUMNS)),
         )
 
         imhover.renderers.append(model_dict[key])
@@ -273,37 +545,27 @@ def photometry_plot(obj_id, width=600, height=300):
             color='color',
             marker='circle',
             fill_color='color',
-            source=ColumnDataSource(data=dict(mjd=[], flux=[], fluxerr=[],
-                                              filter=[], color=[], lim_mag=[],
-                                              mag=[], magerr=[], stacked=[],
-                                              instrument=[]))
+            source=ColumnDataSource(column_data(bins, STACKED_COLUMNS))
         )
 
         imhover.renderers.append(model_dict[key])
 
         key = 'obserr' + str(i)
-        y_err_x = []
-        y_err_y = []
-
-        for d, ro in df.iterrows():
-            px = ro['mjd']
-            py = ro['flux']
-            err = ro['fluxerr']
-
-            y_err_x.append((px, px))
-            y_err_y.append((py - err, py + err))
-
-        model_dict[key] = plot.multi_line(
-            xs='xs', ys='ys', color='color', alpha='alpha',
-            source=ColumnDataSource(data=dict(xs=y_err_x, ys=y_err_y,
-                                              color=df['color'],
-                                              alpha=[1.] * len(df)))
+        model_dict[key] = plot.segment(
+            x0='x', y0='y0', x1='x', y1='y1', color='color', alpha='alpha',
+            source=ColumnDataSource(dict(
+                **error_bars(df['mjd'], df['flux'], df['fluxerr']),
+                **column_data(df, ['color', 'alpha'])
+            ))
         )
 
         key = f'binerr{i}'
-        model_dict[key] = plot.multi_line(
-            xs='xs', ys='ys', color='color',
-            source=ColumnDataSource(data=dict(xs=[], ys=[], color=[]))
+        model_dict[key] = plot.segment(
+            x0='x', y0='y0', x1='x', y1='y1', color='color',
+            source=ColumnDataSource(dict(
+                **error_bars(bins['mjd'], bins['flux'], bins['fluxerr']),
+                **column_data(bins, ['color'])
+            ))
         )
 
     plot.xaxis.axis_label = 'MJD'
@@ -325,18 +587,13 @@ def photometry_plot(obj_id, width=600, height=300):
                                          ).read())
 
     slider = Slider(
-        start=0., end=15., value=0., step=1., title='binsize (days)'
+        start=0., end=max(15., binsize), value=binsize, step=1.,
+        title='binsize (days)'
     )
 
     callback = CustomJS(args={'slider': slider, 'toggle': toggle, **model_dict},
-                        code=open(os.path.join(os.path.dirname(__file__),
-                                               '../static/js/plotjs',
-                                               'stackf.js')).read().replace(
-                                   'default_zp', str(PHOT_ZP)
-                               ).replace(
-                                   'detect_thresh', str(DETECT_THRESH)
-                               )
-                        )
+                        code=_stack_callback_code('stackf.js', obj_id, split,
+                                                  data))
 
     slider.js_on_change('value', callback)
 
@@ -368,6 +625,9 @@ def photometry_plot(obj_id, width=600, height=300):
     model_dict = {}
 
     for i, (label, df) in enumerate(split):
+        bins = stacked_split.get(label, no_bins)
+        detected_bins = bins[bins['detected'].to_numpy(dtype=bool)]
+        undetected_bins = bins[~bins['detected'].to_numpy(dtype=bool)]
 
         key = f'obs{i}'
         model_dict[key] = plot.scatter(
@@ -376,13 +636,17 @@ def photometry_plot(obj_id, width=600, height=300):
             marker='circle',
             fill_color='color',
             alpha='alpha',
-            source=ColumnDataSource(df[df['obs']])
+            source=ColumnDataSource(column_data(df[df['obs']],
+                                                POINT_COLUMNS + ['zp',
+                                                                 'magsys']))
         )
 
         imhover.renderers.append(model_dict[key])
 
         unobs_source = df[~df['obs']].copy()
         unobs_source.loc[:, 'alpha'] = 0.8
+        if binsize > 0:
+            unobs_source.loc[unobs_source['hasflux'], 'alpha'] = 0.1
 
         key = f'unobs{i}'
         model_dict[key] = plot.scatter(
@@ -392,7 +656,9 @@ def photometry_plot(obj_id, width=600, height=300):
             fill_color='white',
             line_color='color',
             alpha='alpha',
-            source=ColumnDataSource(unobs_source)
+            source=ColumnDataSource(column_data(unobs_source,
+                                                POINT_COLUMNS + ['zp',
+                                                                 'magsys']))
         )
 
         imhover.renderers.append(model_dict[key])
@@ -403,37 +669,30 @@ def photometry_plot(obj_id, width=600, height=300):
             color='color',
             marker='circle',
             fill_color='color',
-            source=ColumnDataSource(data=dict(mjd=[], flux=[], fluxerr=[],
-                                              filter=[], color=[], lim_mag=[],
-                                              mag=[], magerr=[], instrument=[],
-                                              stacked=[]))
+            source=ColumnDataSource(column_data(detected_bins,
+                                                STACKED_COLUMNS))
         )
 
         imhover.renderers.append(model_dict[key])
 
         key = 'obserr' + str(i)
-        y_err_x = []
-        y_err_y = []
-
-        for d, ro in df[df['obs']].iterrows():
-            px = ro['mjd']
-            py = ro['mag']
-            err = ro['magerr']
-
-            y_err_x.append((px, px))
-            y_err_y.append((py - err, py + err))
-
-        model_dict[key] = plot.multi_line(
-            xs='xs', ys='ys', color='color', alpha='alpha',
-            source=ColumnDataSource(data=dict(xs=y_err_x, ys=y_err_y,
-                                              color=df[df['obs']]['color'],
-                                              alpha=[1.] * len(df[df['obs']])))
+        obs = df[df['obs']]
+        model_dict[key] = plot.segment(
+            x0='x', y0='y0', x1='x', y1='y1', color='color', alpha='alpha',
+            source=ColumnDataSource(dict(
+                **error_bars(obs['mjd'], obs['mag'], obs['magerr']),
+                **column_data(obs, ['color', 'alpha'])
+            ))
         )
 
         key = f'binerr{i}'
-        model_dict[key] = plot.multi_line(
-            xs='xs', ys='ys', color='color',
-            source=ColumnDataSource(data=dict(xs=[], ys=[], color=[]))
+        model_dict[key] = plot.segment(
+            x0='x', y0='y0', x1='x', y1='y1', color='color',
+            source=ColumnDataSource(dict(
+                **error_bars(detected_bins['mjd'], detected_bins['mag'],
+                             detected_bins['magerr']),
+                **column_data(detected_bins, ['color'])
+            ))
         )
 
         key = f'unobsbin{i}'
@@ -444,20 +703,11 @@ def photometry_plot(obj_id, width=600, height=300):
             fill_color='white',
             line_color='color',
             alpha=0.8,
-            source=ColumnDataSource(data=dict(mjd=[], flux=[], fluxerr=[],
-                                              filter=[], color=[], lim_mag=[],
-                                              mag=[], magerr=[], instrument=[],
-                                              stacked=[]))
+            source=ColumnDataSource(column_data(undetected_bins,
+                                                STACKED_COLUMNS))
         )
         imhover.renderers.append(model_dict[key])
 
-        key = f'all{i}'
-        model_dict[key] = ColumnDataSource(df)
-
-        key = f'bold{i}'
-        model_dict[key] = ColumnDataSource(df[['mjd', 'flux', 'fluxerr','mag',
-                                               'magerr', 'filter', 'zp',
-                                               'magsys', 'lim_mag', 'stacked']])
 
     plot.xaxis.axis_label = 'MJD'
     plot.yaxis.axis_label = 'AB mag'
@@ -478,28 +728,24 @@ def photometry_plot(obj_id, width=600, height=300):
     )
 
     slider = Slider(
-        start=0., end=15., value=0., step=1., title='Binsize (days)'
+        start=0., end=max(15., binsize), value=binsize, step=1.,
+        title='Binsize (days)'
     )
 
     button = Button(label="Export Bold Light Curve to CSV")
     button.callback = CustomJS(
-        args={'slider': slider, 'toggle': toggle, **model_dict},
+        args={'slider': slider},
         code=open(os.path.join(
             os.path.dirname(__file__),
             '../static/js/plotjs',
             "download.js")).read().replace(
             'objname', obj_id
-        ).replace('default_zp', str(PHOT_ZP)))
+        ).replace('detect_thresh', str(DETECT_THRESH)))
 
     toplay = row(slider, button)
     callback = CustomJS(args={'slider': slider, 'toggle': toggle, **model_dict},
-                        code=open(os.path.join(os.path.dirname(__file__),
-                                               '../static/js/plotjs',
-                                               'stackm.js')).read().replace(
-                                   'default_zp', str(PHOT_ZP)
-                               ).replace(
-                                   'detect_thresh', str(DETECT_THRESH)
-                               ))
+                        code=_stack_callback_code('stackm.js', obj_id, split,
+                                                  data))
     slider.js_on_change('value', callback)
 
     layout = row(plot, toggle)
@@ -511,19 +757,102 @@ def photometry_plot(obj_id, width=600, height=300):
     return _plot_to_json(tabs)
 
 
-# TODO make async so that thread isn't blocked
+# spectra are plotted with at most the smallest and largest flux of this many
+# wavelength bins, a few times the width of the plot so that zooming in
+# still shows details
+SPECTRUM_DISPLAY_BINS = 2000
+
+
+def decimate_spectrum(wavelengths, fluxes, n_bins=SPECTRUM_DISPLAY_BINS):
+    """Reduce a spectrum to the pixels with the smallest and largest flux in
+    each of `n_bins` equal wavelength bins.
+
+    Unlike averaging, this keeps the depth of absorption lines and the
+    height of emission lines. Spectra of at most `2 * n_bins` pixels are
+    returned whole.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        The wavelengths and fluxes of the kept pixels, by wavelength.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    fluxes = np.asarray(fluxes, dtype=float)
+    order = np.argsort(wavelengths, kind='mergesort')
+    wavelengths, fluxes = wavelengths[order], fluxes[order]
+    if len(wavelengths) <= 2 * n_bins:
+        return wavelengths, fluxes
+
+    span = max(wavelengths[-1] - wavelengths[0], np.finfo(float).eps)
+    bins = np.clip(((wavelengths - wavelengths[0]) / span * n_bins).astype(int),
+                   0, n_bins - 1)
+    # pixels are sorted, so each bin is a contiguous run of them
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    counts = np.diff(np.r_[starts, len(bins)])
+    keep = np.zeros(len(wavelengths), dtype=bool)
+    for extremum in (np.fmin, np.fmax):
+        extrema = np.repeat(extremum.reduceat(fluxes, starts), counts)
+        # the first pixel of each bin reaching the extremum
+        index = np.flatnonzero(fluxes == extrema)
+        first = np.ones(len(index), dtype=bool)
+        first[1:] = bins[index][1:] != bins[index][:-1]
+        keep[index[first]] = True
+    keep[[0, -1]] = True
+    return wavelengths[keep], fluxes[keep]
+
+
+def spectroscopy_data(obj_id, n_bins=SPECTRUM_DISPLAY_BINS):
+    """Read the spectra of an object for `spectroscopy_figure`, decimated by
+    `decimate_spectrum`.
+
+    A single query reads the redshift and, for each spectrum, only the
+    columns that are plotted.
+
+    Returns
+    -------
+    (float, list of dict)
+        The redshift of the object, and for each spectrum its `id`,
+        `wavelengths`, `fluxes` and `telescope` nickname.
+    """
+    rows = (DBSession()
+            .query(Obj.redshift, Spectrum.id, Spectrum.wavelengths,
+                   Spectrum.fluxes, Telescope.nickname)
+            .select_from(Obj)
+            .outerjoin(Spectrum, Spectrum.obj_id == Obj.id)
+            .outerjoin(Instrument, Instrument.id == Spectrum.instrument_id)
+            .outerjoin(Telescope, Telescope.id == Instrument.telescope_id)
+            .filter(Obj.id == obj_id)
+            .order_by(Spectrum.id)
+            .all())
+    redshift = rows[0][0] if rows else None
+    spectra = []
+    for _, spectrum_id, wavelengths, fluxes, telescope in rows:
+        if spectrum_id is None:  # an object without spectra
+            continue
+        wavelengths, fluxes = decimate_spectrum(wavelengths, fluxes, n_bins)
+        spectra.append({'id': spectrum_id, 'wavelengths': wavelengths,
+                        'fluxes': fluxes, 'telescope': telescope})
+    return redshift, spectra
+
+
 def spectroscopy_plot(obj_id):
     """TODO normalization? should this be handled at data ingestion or plot-time?"""
-    obj = Obj.query.get(obj_id)
-    spectra = Obj.query.get(obj_id).spectra
+    return spectroscopy_figure(*spectroscopy_data(obj_id))
+
+
+def spectroscopy_figure(redshift, spectra):
+    """Create line plot of the spectra read by `spectroscopy_data`.
+
+    This does not touch the database, so it can run in a worker process.
+    """
     if len(spectra) == 0:
-        return None, None, None
+        return None, None
 
-    color_map = dict(zip([s.id for s in spectra], viridis(len(spectra))))
+    color_map = dict(zip([s['id'] for s in spectra], viridis(len(spectra))))
     data = pd.concat(
-        [pd.DataFrame({'wavelength': s.wavelengths,
-                       'flux': s.fluxes, 'id': s.id,
-                       'instrument': s.instrument.telescope.nickname})
+        [pd.DataFrame({'wavelength': s['wavelengths'],
+                       'flux': s['fluxes'], 'id': s['id'],
+                       'instrument': s['telescope']})
          for i, s in enumerate(spectra)]
     )
     split = data.groupby('id')
@@ -537,7 +866,11 @@ def spectroscopy_plot(obj_id):
     for i, (key, df) in enumerate(split):
         model_dict['s' + str(i)] = plot.line(x='wavelength', y='flux',
                                              color=color_map[key],
-                                             source=ColumnDataSource(df))
+                                             source=ColumnDataSource(
+                                                 column_data(df, ['wavelength',
+                                                                  'flux',
+                                                                  'instrument'])
+                                             ))
     plot.xaxis.axis_label = 'Wavelength (Å)'
     plot.yaxis.axis_label = 'Flux'
     plot.toolbar.logo = None
@@ -545,8 +878,7 @@ def spectroscopy_plot(obj_id):
     # TODO how to choose a good default?
     plot.y_range = Range1d(0, 1.03 * data.flux.max())
 
-    toggle = CheckboxWithLegendGroup(labels=[s.instrument.telescope.nickname
-                                             for s in spectra],
+    toggle = CheckboxWithLegendGroup(labels=[s['telescope'] for s in spectra],
                                      active=list(range(len(spectra))),
                                      width=100,
                                      colors=[color_map[k] for k, df in split])
@@ -562,15 +894,18 @@ def spectroscopy_plot(obj_id):
         active=[], width=80,
         colors=[c for w, c in SPEC_LINES.values()]
     )
-    z = TextInput(value=str(obj.redshift), title="z:")
+    z = TextInput(value=str(redshift), title="z:")
     v_exp = TextInput(value='0', title="v_exp:")
     for i, (wavelengths, color) in enumerate(SPEC_LINES.values()):
         el_data = pd.DataFrame({'wavelength': wavelengths})
-        el_data['x'] = el_data['wavelength'] * (1 + obj.redshift)
+        el_data['x'] = el_data['wavelength'] * (1 + redshift)
         model_dict[f'el{i}'] = plot.segment(x0='x', x1='x',
                                             # TODO change limits
                                             y0=0, y1=1e-13, color=color,
-                                            source=ColumnDataSource(el_data))
+                                            source=ColumnDataSource(
+                                                column_data(el_data,
+                                                            ['wavelength', 'x'])
+                                            ))
         model_dict[f'el{i}'].visible = False
 
     # TODO callback policy: don't require submit for text changes?
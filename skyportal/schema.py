@@ -32,7 +32,6 @@ from skyportal.phot_enum import (
     force_render_enum_markdown
 )
 
-from astropy.table import Table
 import operator
 
 import sys
@@ -202,6 +201,16 @@ class PhotBaseFlexible(object):
                                        'given as lists. Null values allowed.',
                       required=False)
 
+    origin = fields.Field(description='Provenance of the photometry (e.g., '
+                                      'the name of the pipeline or survey '
+                                      'data release). Points are unique on '
+                                      '(obj_id, instrument_id, filter, mjd, '
+                                      'origin) when `origin` is not null. '
+                                      'Can be given as a scalar or a 1D list. '
+                                      'If a scalar, will be broadcast to all values '
+                                      'given as lists. Null values allowed.',
+                          required=False)
+
 
 class PhotFluxFlexible(_Schema, PhotBaseFlexible):
     """This is one of two classes used for rendering the
@@ -322,6 +331,9 @@ class PhotBase(object):
     dec_unc = fields.Number(description='Uncertainty on dec [arcsec].',
                            missing=None, default=None)
 
+    origin = fields.String(description='Provenance of the photometry.',
+                           missing=None, default=None)
+
     @post_load
     def enum_to_string(self, data, **kwargs):
         # convert enumified data back to strings
@@ -369,8 +381,8 @@ class PhotometryFlux(_Schema, PhotBase):
             The Photometry object generated from the PhotometryFlux object.
         """
 
-        from skyportal.models import Instrument, Obj, PHOT_SYS, PHOT_ZP, Photometry
-        from sncosmo.photdata import PhotometricData
+        from skyportal.models import Instrument, Obj, Photometry
+        from skyportal.utils.photometry import normalize_flux
 
         # get the instrument
         instrument = Instrument.query.get(data['instrument_id'])
@@ -388,29 +400,25 @@ class PhotometryFlux(_Schema, PhotBase):
                                   f"{data['filter']}.")
 
         # convert flux to microJanskies.
-        table = Table([data])
-        if data['flux'] is None:
-            # this needs to be non-null for the conversion step
-            # will be replaced later with null
-            table['flux'] = 0.
-
-        # conversion happens here
-        photdata = PhotometricData(table).normalized(zp=PHOT_ZP,
-                                                     zpsys=PHOT_SYS)
+        flux, fluxerr = normalize_flux(
+            np.nan if data['flux'] is None else data['flux'],
+            data['fluxerr'], data['zp'], data['magsys'], data['filter']
+        )
 
         # replace with null if needed
-        final_flux = None if data['flux'] is None else photdata.flux[0]
+        final_flux = None if data['flux'] is None else float(flux)
 
         p = Photometry(obj_id=data['obj_id'],
                        mjd=data['mjd'],
                        flux=final_flux,
-                       fluxerr=photdata.fluxerr[0],
+                       fluxerr=float(fluxerr),
                        instrument_id=data['instrument_id'],
                        filter=data['filter'],
                        ra=data['ra'],
                        dec=data['dec'],
                        ra_unc=data['ra_unc'],
-                       dec_unc=data['dec_unc']
+                       dec_unc=data['dec_unc'],
+                       origin=data['origin']
                        )
 
         return p
@@ -451,8 +459,8 @@ class PhotometryMag(_Schema, PhotBase):
             The Photometry object generated from the PhotometryMag dict.
         """
 
-        from skyportal.models import Instrument, Obj, PHOT_SYS, PHOT_ZP, Photometry
-        from sncosmo.photdata import PhotometricData
+        from skyportal.models import Instrument, Obj, PHOT_ZP, Photometry
+        from skyportal.utils.photometry import mag_to_flux, normalize_flux
 
         # check that mag and magerr are both null or both not null, not a mix
         ok = any(
@@ -488,44 +496,31 @@ class PhotometryMag(_Schema, PhotBase):
         # determine if this is a limit or a measurement
         hasmag = data['mag'] is not None
 
-        if hasmag:
-            flux = 10**(-0.4 * (data['mag'] - PHOT_ZP))
-            fluxerr = data['magerr'] / (2.5 / np.log(10)) * flux
-        else:
-            fivesigflux = 10**(-0.4 * (data['limiting_mag'] - PHOT_ZP))
-            flux = None
-            fluxerr = fivesigflux / 5
-
+        # a limit gets a null flux and an error from the limiting magnitude
+        flux, fluxerr = mag_to_flux(
+            data['mag'] if hasmag else np.nan,
+            data['magerr'] if hasmag else np.nan,
+            data['limiting_mag']
+        )
 
         # convert flux to microJanskies.
-        table = Table([{'flux': flux,
-                        'fluxerr': fluxerr,
-                        'magsys': data['magsys'],
-                        'zp': PHOT_ZP,
-                        'filter': data['filter'],
-                        'mjd': data['mjd']}])
-        if flux is None:
-            # this needs to be non-null for the conversion step
-            # will be replaced later with null
-            table['flux'] = 0.
-
-        # conversion happens here
-        photdata = PhotometricData(table).normalized(zp=PHOT_ZP,
-                                                     zpsys=PHOT_SYS)
+        flux, fluxerr = normalize_flux(flux, fluxerr, PHOT_ZP,
+                                       data['magsys'], data['filter'])
 
         # replace with null if needed
-        final_flux = None if flux is None else photdata.flux[0]
+        final_flux = float(flux) if hasmag else None
 
         p = Photometry(obj_id=data['obj_id'],
                        mjd=data['mjd'],
                        flux=final_flux,
-                       fluxerr=photdata.fluxerr[0],
+                       fluxerr=float(fluxerr),
                        instrument_id=data['instrument_id'],
                        filter=data['filter'],
                        ra=data['ra'],
                        dec=data['dec'],
                        ra_unc=data['ra_unc'],
-                       dec_unc=data['dec_unc'])
+                       dec_unc=data['dec_unc'],
+                       origin=data['origin'])
 
         return p
 
@@ -1,6 +1,8 @@
 import uuid
 import numpy.testing as npt
 from skyportal.tests import api
+from skyportal.tests.fixtures import GroupFactory, FilterFactory, ObjFactory
+from skyportal.models import DBSession, Candidate, Source
 
 
 def test_candidate_list(view_only_token, public_candidate):
@@ -107,3 +109,82 @@ def test_cannot_add_candidate_without_filter_id(upload_data_token):
         token=upload_data_token,
     )
     assert status == 400
+
+
+def test_candidate_list_cursor_pagination(
+    upload_data_token, view_only_token, public_filter
+):
+    candidate_ids = []
+    for day in [1, 1, 2, 3]:
+        candidate_id = str(uuid.uuid4())
+        status, data = api(
+            "POST",
+            "candidates",
+            data={
+                "id": candidate_id,
+                "ra": 234.22,
+                "dec": -22.33,
+                "last_detected": f"2001-01-0{day}T00:00:00",
+                "filter_ids": [public_filter.id],
+            },
+            token=upload_data_token,
+        )
+        assert status == 200
+        candidate_ids.append(candidate_id)
+
+    status, data = api(
+        "GET",
+        f"candidates?filterIDs={public_filter.id}&numPerPage=2"
+        "&endDate=2001-01-04&cursor=",
+        token=view_only_token,
+    )
+    assert status == 200
+    pages = [data["data"]]
+    while pages[-1]["nextCursor"] is not None:
+        status, data = api(
+            "GET",
+            f"candidates?filterIDs={public_filter.id}&numPerPage=2"
+            f"&endDate=2001-01-04&cursor={pages[-1]['nextCursor']}",
+            token=view_only_token,
+        )
+        assert status == 200
+        pages.append(data["data"])
+    assert [page["lastPage"] for page in pages] == [False, True]
+    ids = [c["id"] for page in pages for c in page["candidates"]]
+    assert ids == (candidate_ids[3:1:-1] + sorted(candidate_ids[:2]))
+
+    status, data = api(
+        "GET", "candidates?cursor=notacursor", token=view_only_token
+    )
+    assert status == 400
+
+    for n_per_page in [0, -1]:
+        status, data = api(
+            "GET", f"candidates?cursor=&numPerPage={n_per_page}",
+            token=view_only_token
+        )
+        assert status == 400
+
+
+def test_candidate_access_other_group(view_only_token, public_candidate):
+    other_filter = FilterFactory(group=GroupFactory())
+    obj = ObjFactory()
+    DBSession.add(Candidate(obj=obj, filter=other_filter))
+    DBSession.commit()
+
+    status, data = api("GET", f"candidates/{obj.id}", token=view_only_token)
+    assert status == 400
+
+    # saved by another group, but passing one of the user's filters
+    DBSession.add(Source(obj_id=public_candidate.id,
+                         group_id=other_filter.group_id))
+    DBSession.commit()
+    status, data = api(
+        "GET", f"sources/{public_candidate.id}", token=view_only_token
+    )
+    assert status == 400
+    status, data = api(
+        "GET", f"candidates/{public_candidate.id}", token=view_only_token
+    )
+    assert status == 200
+    assert data["data"]["id"] == public_candidate.id
@@ -1,6 +1,8 @@
 import uuid
 from skyportal.tests import api
+from skyportal.tests.fixtures import ObjFactory
 from skyportal.model_util import create_token
+from skyportal.models import DBSession, Source
 
 
 def test_token_user_create_new_group(manage_groups_token, super_admin_user):
@@ -91,3 +93,31 @@ def test_manage_groups_token_get_unowned_group(manage_groups_token, user,
                        token=token_id)
     assert data['status'] == 'success'
     assert data['data']['name'] == group_name
+
+
+def test_group_user_changes_source_access(manage_groups_token, view_only_token,
+                                          user, super_admin_user):
+    status, data = api('POST', 'groups',
+                       data={'name': str(uuid.uuid4()),
+                             'group_admins': [super_admin_user.username]},
+                       token=manage_groups_token)
+    assert status == 200
+    group_id = data['data']['id']
+    obj = ObjFactory()
+    DBSession.add(Source(obj_id=obj.id, group_id=group_id))
+    DBSession.commit()
+
+    status, data = api('GET', f'sources/{obj.id}', token=view_only_token)
+    assert status == 400
+
+    status, data = api('POST', f'groups/{group_id}/users/{user.username}',
+                       data={'admin': False}, token=manage_groups_token)
+    assert status == 200
+    status, data = api('GET', f'sources/{obj.id}', token=view_only_token)
+    assert status == 200
+
+    status, data = api('DELETE', f'groups/{group_id}/users/{user.username}',
+                       token=manage_groups_token)
+    assert status == 200
+    status, data = api('GET', f'sources/{obj.id}', token=view_only_token)
+    assert status == 400
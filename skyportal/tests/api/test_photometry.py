@@ -1,10 +1,14 @@
 import os
+import time
 import datetime
 import base64
-from skyportal.tests import api
+import json
+import requests
+from skyportal.tests import api, cfg
 from skyportal.models import Thumbnail, DBSession, Photometry
 
 import numpy as np
+import pyarrow as pa
 import sncosmo
 
 
@@ -423,6 +427,58 @@ def test_token_user_post_photometry_data_series(upload_data_token, public_source
     assert data['status'] == 'error'
 
 
+def test_token_user_post_bulk_photometry(upload_data_token, public_source,
+                                         ztf_camera):
+    n = 5000
+    mjd = 58000. + np.arange(n) / 10
+    flux = 10 + np.random.random(n)
+    status, data = api('POST', 'photometry',
+                       data={'obj_id': str(public_source.id),
+                             'mjd': list(mjd),
+                             'instrument_id': ztf_camera.id,
+                             'flux': list(flux),
+                             'fluxerr': 0.1,
+                             'zp': 25.,
+                             'magsys': 'ab',
+                             'filter': ['ztfg', 'ztfr'] * (n // 2)
+                             },
+                       token=upload_data_token)
+    assert status == 200
+    assert data['status'] == 'success'
+    assert len(data['data']['ids']) == n
+    assert data['data']['rows'] == n
+    assert data['data']['rows_per_second'] > 0
+
+    photometry_id = data['data']['ids'][-1]
+    status, data = api(
+        'GET',
+        f'photometry/{photometry_id}?format=flux',
+        token=upload_data_token)
+    assert status == 200
+    np.testing.assert_allclose(data['data']['mjd'], mjd[-1])
+    np.testing.assert_allclose(data['data']['flux'],
+                               flux[-1] * 10**(-0.4 * (25. - 23.9)))
+    assert data['data']['filter'] == 'ztfr'
+
+    # one bad row rejects the whole upload with the row-level error
+    filters = ['ztfg'] * n
+    filters[1234] = 'bessellv'
+    status, data = api('POST', 'photometry',
+                       data={'obj_id': str(public_source.id),
+                             'mjd': list(mjd),
+                             'instrument_id': ztf_camera.id,
+                             'flux': list(flux),
+                             'fluxerr': 0.1,
+                             'zp': 25.,
+                             'magsys': 'ab',
+                             'filter': filters
+                             },
+                       token=upload_data_token)
+    assert status == 400
+    assert data['status'] == 'error'
+    assert 'has no filter bessellv' in data['message']
+
+
 def test_post_photometry_no_access_token(view_only_token, public_source,
                                          ztf_camera):
     status, data = api('POST', 'photometry',
@@ -582,3 +638,432 @@ def test_token_user_retrieving_source_photometry_and_convert(view_only_token, pu
 
     assert np.allclose(maglast_ab, maglast_vega + vega_to_ab[data['data'][-1]['filter']])
     assert np.allclose(magerrlast_ab, magerrlast_vega)
+
+
+def test_token_user_retrieving_source_photometry_columns(view_only_token,
+                                                         public_source):
+    for format in ['mag', 'flux']:
+        status, rows = api(
+            'GET',
+            f'sources/{public_source.id}/photometry?format={format}&magsys=vega',
+            token=view_only_token)
+        assert status == 200
+
+        status, data = api(
+            'GET',
+            f'sources/{public_source.id}/photometry?format={format}&magsys=vega'
+            '&layout=columns',
+            token=view_only_token)
+        assert status == 200
+        assert data['status'] == 'success'
+        columns = data['data']
+        assert columns['obj_id'] == public_source.id
+        assert len(columns['mjd']) == len(rows['data'])
+
+        for i, row in enumerate(rows['data']):
+            for key in ['mjd', 'filter', 'instrument_id']:
+                assert columns[key][i] == row[key]
+            fields = ['mag', 'magerr', 'limiting_mag'] if format == 'mag' \
+                else ['flux', 'fluxerr', 'zp']
+            for key in fields:
+                if row[key] is None:
+                    assert columns[key][i] is None
+                else:
+                    np.testing.assert_allclose(columns[key][i], row[key])
+
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?layout=diagonal',
+        token=view_only_token)
+    assert status == 400
+
+
+
+def test_token_user_retrieving_photometry_of_non_source(view_only_token,
+                                                        public_candidate):
+    for obj_id in [public_candidate.id, 'notanobject']:
+        status, data = api(
+            'GET', f'sources/{obj_id}/photometry?layout=columns',
+            token=view_only_token)
+        assert status == 400
+        assert data['message'] == 'Invalid source ID.'
+
+
+def test_token_user_retrieving_stacked_photometry(view_only_token,
+                                                  public_source):
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?format=flux',
+        token=view_only_token)
+    assert status == 200
+    n_points = len(data['data'])
+
+    status, data = api(
+        'GET',
+        f'sources/{public_source.id}/photometry?format=flux&binsize=1e6',
+        token=view_only_token)
+    assert status == 200
+    stacked = data['data']
+    assert sum(row['nstacked'] for row in stacked) == n_points
+    assert len({(row['instrument_id'], row['filter'])
+                for row in stacked}) == len(stacked)
+
+    status, data = api(
+        'GET',
+        f'sources/{public_source.id}/photometry?binsize=3&layout=columns',
+        token=view_only_token)
+    assert status == 200
+    assert len(data['data']['mag']) == len(data['data']['nstacked'])
+
+    for binsize in ['0', 'weekly']:
+        status, data = api(
+            'GET', f'sources/{public_source.id}/photometry?binsize={binsize}',
+            token=view_only_token)
+        assert status == 400
+
+
+def test_token_user_retrieving_stacked_photometry_of_non_source(
+        view_only_token, public_candidate):
+    status, data = api(
+        'GET', f'sources/{public_candidate.id}/photometry?binsize=3',
+        token=view_only_token)
+    assert status == 400
+    assert data['message'] == 'Invalid source ID.'
+
+
+def test_token_user_retrieving_source_photometry_arrow(view_only_token,
+                                                       public_source):
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?format=flux&layout=columns',
+        token=view_only_token)
+    assert status == 200
+    columns = data['data']
+
+    response = api(
+        'GET', f'sources/{public_source.id}/photometry?format=flux&encoding=arrow',
+        token=view_only_token, raw_response=True)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'application/vnd.apache.arrow.stream'
+
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.schema.metadata[b'obj_id'].decode() == public_source.id
+    arrow_columns = table.to_pydict()
+    assert arrow_columns['id'] == columns['id']
+    assert arrow_columns['filter'] == columns['filter']
+    np.testing.assert_allclose(arrow_columns['flux'], columns['flux'])
+    np.testing.assert_allclose(arrow_columns['fluxerr'], columns['fluxerr'])
+
+
+def test_token_user_retrieving_arrow_photometry_of_non_source(
+        view_only_token, public_candidate):
+    response = api(
+        'GET', f'sources/{public_candidate.id}/photometry?encoding=arrow',
+        token=view_only_token, raw_response=True)
+    assert response.status_code == 400
+
+
+def test_token_user_retrieving_batch_photometry(view_only_token,
+                                                public_source):
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?layout=columns',
+        token=view_only_token)
+    assert status == 200
+    columns = data['data']
+
+    status, data = api('POST', 'photometry/batch',
+                       data={'obj_ids': [public_source.id]},
+                       token=view_only_token)
+    assert status == 200
+    assert data['status'] == 'success'
+    assert data['data'] == {public_source.id: columns}
+
+    # filters and date range
+    filter = columns['filter'][0]
+    start_mjd = columns['mjd'][1]
+    status, data = api('POST', 'photometry/batch',
+                       data={'obj_ids': [public_source.id],
+                             'filters': [filter],
+                             'start_mjd': start_mjd},
+                       token=view_only_token)
+    assert status == 200
+    batch = data['data'][public_source.id]
+    expected = [i for i, (f, mjd) in
+                enumerate(zip(columns['filter'], columns['mjd']))
+                if f == filter and mjd >= start_mjd]
+    assert batch['id'] == [columns['id'][i] for i in expected]
+
+
+def test_token_user_batch_photometry_no_access(view_only_token, public_source,
+                                               private_source):
+    status, data = api('POST', 'photometry/batch',
+                       data={'obj_ids': [public_source.id, private_source.id]},
+                       token=view_only_token)
+    assert status == 400
+    assert 'Insufficient permissions' in data['message']
+    assert private_source.id in data['message']
+
+
+def test_token_user_batch_photometry_invalid_body(view_only_token,
+                                                  public_source):
+    status, data = api('POST', 'photometry/batch', data=[public_source.id],
+                       token=view_only_token)
+    assert status == 400
+    assert data['message'] == 'Request body must be an object.'
+
+    status, data = api('POST', 'photometry/batch',
+                       data={'obj_ids': [public_source.id], 'filters': 'ztfg'},
+                       token=view_only_token)
+    assert status == 400
+    assert '`filters` must be a list' in data['message']
+
+
+def test_token_user_incremental_photometry_sync(upload_data_token,
+                                                manage_sources_token,
+                                                public_source, ztf_camera):
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?since=2000-01-01',
+        token=upload_data_token)
+    assert status == 200
+    n_points = len(data['data']['photometry'])
+    assert n_points > 0
+    assert data['data']['deleted_ids'] == []
+    since = data['data']['next_since']
+
+    # polls may repeat points, but nothing was deleted
+    for layout in ['rows', 'columns']:
+        status, data = api(
+            'GET',
+            f'sources/{public_source.id}/photometry?since={since}'
+            f'&layout={layout}',
+            token=upload_data_token)
+        assert status == 200
+        assert int(data['data']['next_since']) >= int(since)
+        assert data['data']['deleted_ids'] == []
+
+    status, data = api('POST', 'photometry',
+                       data={'obj_id': str(public_source.id),
+                             'mjd': 58000.,
+                             'instrument_id': ztf_camera.id,
+                             'flux': 12.24,
+                             'fluxerr': 0.031,
+                             'zp': 25.,
+                             'magsys': 'ab',
+                             'filter': 'ztfi'
+                             },
+                       token=upload_data_token)
+    assert status == 200
+    photometry_id = data['data']['ids'][0]
+
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?since={since}',
+        token=upload_data_token)
+    assert status == 200
+    assert photometry_id in [p['id'] for p in data['data']['photometry']]
+    since = data['data']['next_since']
+
+    status, data = api('DELETE', f'photometry/{photometry_id}',
+                       token=manage_sources_token)
+    assert status == 200
+
+    status, data = api(
+        'GET',
+        f'sources/{public_source.id}/photometry?since={since}&layout=columns',
+        token=upload_data_token)
+    assert status == 200
+    assert photometry_id not in data['data']['photometry']['id']
+    assert photometry_id in data['data']['deleted_ids']
+
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?since=yesterday-ish',
+        token=upload_data_token)
+    assert status == 400
+
+
+def test_token_user_incremental_photometry_sync_of_non_source(
+        view_only_token, public_candidate):
+    status, data = api(
+        'GET', f'sources/{public_candidate.id}/photometry?since=2000-01-01',
+        token=view_only_token)
+    assert status == 400
+    assert data['message'] == 'Invalid source ID.'
+
+
+def test_token_user_upsert_photometry(upload_data_token, public_source,
+                                      ztf_camera):
+    packet = {'obj_id': str(public_source.id),
+              'mjd': [58000., 58001.],
+              'instrument_id': ztf_camera.id,
+              'flux': [12.24, 15.24],
+              'fluxerr': [0.031, 0.029],
+              'zp': 25.,
+              'magsys': 'ab',
+              'filter': 'ztfg',
+              'origin': 'test_upsert'}
+    status, data = api('POST', 'photometry?mode=upsert', data=packet,
+                       token=upload_data_token)
+    assert status == 200
+    ids = data['data']['ids']
+    assert len(ids) == 2
+
+    # replaying the upload does not create new points
+    status, data = api('POST', 'photometry?mode=upsert', data=packet,
+                       token=upload_data_token)
+    assert status == 200
+    assert data['data']['ids'] == ids
+
+    # a plain insert of the same points violates the natural key
+    status, data = api('POST', 'photometry', data=packet,
+                       token=upload_data_token)
+    assert status == 400
+
+    # changed values are updated in place
+    packet['flux'] = [13.24, 15.24]
+    status, data = api('POST', 'photometry?mode=upsert', data=packet,
+                       token=upload_data_token)
+    assert status == 200
+    assert data['data']['ids'] == ids
+
+    status, data = api('GET', f'photometry/{ids[0]}?format=flux',
+                       token=upload_data_token)
+    assert status == 200
+    np.testing.assert_allclose(data['data']['flux'],
+                               13.24 * 10 ** (-0.4 * (25 - 23.9)))
+
+    del packet['origin']
+    status, data = api('POST', 'photometry?mode=upsert', data=packet,
+                       token=upload_data_token)
+    assert status == 400
+    assert 'origin' in data['message']
+
+
+def wait_for_ingest_job(job_id, token, timeout=60):
+    start = time.time()
+    while time.time() - start < timeout:
+        status, data = api('GET', f'photometry/jobs/{job_id}', token=token)
+        assert status == 200
+        if data['data']['status'] in ['complete', 'failed']:
+            return data['data']
+        time.sleep(0.5)
+    raise TimeoutError(f'Photometry ingest job {job_id} did not finish')
+
+
+def test_token_user_post_photometry_async(upload_data_token, view_only_token,
+                                          public_source, ztf_camera):
+    n = 1000
+    packet = {'obj_id': str(public_source.id),
+              'mjd': list(58000. + np.arange(n) / 10),
+              'instrument_id': ztf_camera.id,
+              'flux': list(10 + np.random.random(n)),
+              'fluxerr': 0.1,
+              'zp': 25.,
+              'magsys': 'ab',
+              'filter': ['ztfg', 'ztfr'] * (n // 2)}
+    status, data = api('POST', 'photometry?async=true', data=packet,
+                       token=upload_data_token)
+    assert status == 200
+    job_id = data['data']['job_id']
+
+    job = wait_for_ingest_job(job_id, upload_data_token)
+    assert job['status'] == 'complete'
+    assert job['rows'] == n
+    assert len(job['ids']) == n
+    assert job['rows_per_second'] > 0
+    assert job['errors'] is None
+
+    status, data = api('GET', f'photometry/{job["ids"][-1]}?format=flux',
+                       token=upload_data_token)
+    assert status == 200
+    assert data['data']['filter'] == 'ztfr'
+
+    # jobs are only visible to their submitter
+    status, data = api('GET', f'photometry/jobs/{job_id}',
+                       token=view_only_token)
+    assert status == 400
+
+    # invalid rows are all reported, and nothing is ingested
+    packet['filter'] = ['ztfg'] * n
+    packet['filter'][12] = packet['filter'][34] = 'bessellv'
+    status, data = api('POST', 'photometry?async=true', data=packet,
+                       token=upload_data_token)
+    assert status == 200
+    job = wait_for_ingest_job(data['data']['job_id'], upload_data_token)
+    assert job['status'] == 'failed'
+    assert job['ids'] is None
+    assert [e['row'] for e in job['errors']] == [12, 34]
+    assert 'has no filter bessellv' in job['errors'][0]['message']
+
+
+def stream_photometry(body, content_type, token, mode='insert'):
+    return requests.post(
+        f'http://localhost:{cfg["ports.app"]}/api/photometry/stream',
+        params={'mode': mode},
+        data=body, headers={'Authorization': f'token {token}',
+                            'Content-Type': content_type})
+
+
+def test_token_user_stream_photometry(upload_data_token, public_source,
+                                      ztf_camera):
+    n = 12000
+    mjd = 58000. + np.arange(n) / 10
+    packets = ({'obj_id': public_source.id, 'mjd': m,
+                'instrument_id': ztf_camera.id, 'flux': 10., 'fluxerr': 0.1,
+                'zp': 25., 'magsys': 'ab', 'filter': 'ztfg'} for m in mjd)
+    body = (json.dumps(packet).encode() + b'\n' for packet in packets)
+    response = stream_photometry(body, 'application/x-ndjson',
+                                 upload_data_token)
+    assert response.status_code == 200
+    assert response.json()['data']['rows'] == n
+
+    status, data = api(
+        'GET', f'sources/{public_source.id}/photometry?layout=columns',
+        token=upload_data_token)
+    assert status == 200
+    assert len(data['data']['mjd']) >= n
+
+    header = 'obj_id,mjd,instrument_id,mag,magerr,limiting_mag,magsys,filter'
+    rows = [f'{public_source.id},59000.5,{ztf_camera.id},19.2,0.05,21,ab,ztfr',
+            f'{public_source.id},59001.5,{ztf_camera.id},,,21.5,ab,ztfr']
+    response = stream_photometry('\n'.join([header] + rows),
+                                 'text/csv', upload_data_token)
+    assert response.status_code == 200
+    assert response.json()['data']['rows'] == 2
+
+    rows[1] = rows[1].replace('ztfr', 'bessellv')
+    response = stream_photometry('\n'.join([header] + rows),
+                                 'text/csv', upload_data_token)
+    assert response.status_code == 400
+    assert 'has no filter bessellv' in response.json()['message']
+
+    response = stream_photometry('\n'.join([header] + rows[:1]),
+                                 'text/csv', upload_data_token,
+                                 mode='replace')
+    assert response.status_code == 400
+    assert 'Invalid mode' in response.json()['message']
+
+
+def test_token_user_stream_photometry_csv_records(upload_data_token,
+                                                  public_source, ztf_camera):
+    header = 'obj_id,mjd,instrument_id,mag,magerr,limiting_mag,magsys,filter,origin'
+    rows = [f'{public_source.id},59010.5,{ztf_camera.id},19.2,0.05,21,ab,ztfr,'
+            '"night 1,\r\nfield 2"',
+            f'{public_source.id},59011.5,{ztf_camera.id},,,21.5,ab,ztfr,x']
+    body = '\r\n'.join([header] + rows).encode()
+    # quoted fields and line endings span the chunks of the upload
+    chunks = (body[i:i + 7] for i in range(0, len(body), 7))
+    response = stream_photometry(chunks, 'text/csv', upload_data_token)
+    assert response.status_code == 200
+    assert response.json()['data']['rows'] == 2
+
+    response = stream_photometry('\r\n'.join([header, rows[0][:-1]]),
+                                 'text/csv', upload_data_token)
+    assert response.status_code == 400
+    assert 'Invalid CSV' in response.json()['message']
+
+
+def test_stream_photometry_no_access_token(view_only_token, public_source,
+                                           ztf_camera):
+    packet = {'obj_id': public_source.id, 'mjd': 58000.,
+              'instrument_id': ztf_camera.id, 'flux': 10., 'fluxerr': 0.1,
+              'zp': 25., 'magsys': 'ab', 'filter': 'ztfg'}
+    response = stream_photometry(json.dumps(packet), 'application/x-ndjson',
+                                 view_only_token)
+    assert response.status_code == 400
+    assert response.json()['status'] == 'error'
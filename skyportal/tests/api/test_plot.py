@@ -0,0 +1,120 @@
+import json
+
+from skyportal.tests import api
+
+
+def test_plot_photometry(view_only_token, public_source):
+    status, data = api(
+        'GET',
+        f'internal/plot/photometry/{public_source.id}?plotWidth=500&plotHeight=200',
+        token=view_only_token)
+    assert status == 200
+    assert data['status'] == 'success'
+    assert data['data']['url'].endswith('plotHeight=200')
+    docs_json = json.loads(data['data']['docs_json'])
+    assert len(docs_json) == 1
+    assert len(json.loads(data['data']['render_items'])) == 1
+    assert 'custom_model_js' not in data['data']
+
+    # only the plotted columns are sent, with numbers as binary arrays
+    assert '__ndarray__' in data['data']['docs_json']
+    for column in ['original_user_data', 'altdata', 'obj_id', 'created_at']:
+        assert f'"{column}"' not in data['data']['docs_json']
+    assert data['data']['custom_model_js_url'].endswith('.js')
+
+
+def test_plot_photometry_window(view_only_token, public_source):
+    status, data = api(
+        'GET',
+        f'internal/plot/photometry/{public_source.id}?startMJD=0&endMJD=1e6',
+        token=view_only_token)
+    assert status == 200
+    assert data['data']['docs_json'] is not None
+
+    status, data = api(
+        'GET',
+        f'internal/plot/photometry/{public_source.id}?startMJD=yesterday',
+        token=view_only_token)
+    assert status == 400
+
+
+def test_plot_photometry_stacked(view_only_token, public_source):
+    status, data = api(
+        'GET', f'internal/plot/photometry/{public_source.id}?binsize=5',
+        token=view_only_token)
+    assert status == 200
+    assert data['data']['docs_json'] is not None
+    assert '"stacked":[true' in data['data']['docs_json'].replace(' ', '')
+
+    status, data = api(
+        'GET', f'internal/plot/photometry/{public_source.id}?binsize=-1',
+        token=view_only_token)
+    assert status == 400
+
+
+def test_plot_spectroscopy(view_only_token, public_source):
+    status, data = api('GET',
+                       f'internal/plot/spectroscopy/{public_source.id}',
+                       token=view_only_token)
+    assert status == 200
+    assert data['status'] == 'success'
+    assert data['data']['docs_json'] is not None
+
+
+def test_plot_photometry_no_data(view_only_token):
+    status, data = api('GET', 'internal/plot/photometry/not_an_obj',
+                       token=view_only_token)
+    assert status == 200
+    assert data['data']['docs_json'] is None
+
+
+def test_plot_photometry_cache(upload_data_token, public_source, ztf_camera):
+    endpoint = f'internal/plot/photometry/{public_source.id}'
+    status, data = api('GET', endpoint, token=upload_data_token)
+    assert status == 200
+    docs_json = data['data']['docs_json']
+
+    # served from the cache
+    status, data = api('GET', endpoint, token=upload_data_token)
+    assert status == 200
+    assert data['data']['docs_json'] == docs_json
+
+    status, data = api('POST', 'photometry',
+                       data={'obj_id': str(public_source.id),
+                             'mjd': 58000.,
+                             'instrument_id': ztf_camera.id,
+                             'flux': 12.24,
+                             'fluxerr': 0.031,
+                             'zp': 25.,
+                             'magsys': 'ab',
+                             'filter': 'ztfi'},
+                       token=upload_data_token)
+    assert status == 200
+
+    # new photometry invalidates the cached plot
+    status, data = api('GET', endpoint, token=upload_data_token)
+    assert status == 200
+    assert data['data']['docs_json'] != docs_json
+
+
+def test_plot_custom_model_js(view_only_token, public_source):
+    status, data = api('GET', f'internal/plot/photometry/{public_source.id}',
+                       token=view_only_token)
+    assert status == 200
+    url = data['data']['custom_model_js_url']
+
+    response = api('GET', url, raw_response=True)
+    assert response.status_code == 200
+    assert 'javascript' in response.headers['Content-Type']
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'CheckboxWithLegendGroup' in response.text
+
+    # the same JS is referenced by every plot
+    status, data = api('GET', f'internal/plot/spectroscopy/{public_source.id}',
+                       token=view_only_token)
+    assert data['data']['custom_model_js_url'] == url
+
+    response = api('GET', 'internal/plot/models/0123456789abcdef0123.js',
+                   raw_response=True)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
@@ -10,6 +10,26 @@ def test_source_list(view_only_token):
     assert data['status'] == 'success'
 
 
+def test_source_list_page_count(view_only_token, public_source):
+    status, data = api('GET', 'sources?pageNumber=1&numPerPage=1000',
+                       token=view_only_token)
+    assert status == 200
+    assert data['data']['totalMatchesApproximate'] is False
+    assert data['data']['totalMatches'] == len(data['data']['sources'])
+    assert public_source.id in [s['id'] for s in data['data']['sources']]
+
+
+def test_source_list_page_count_date_filtered(view_only_token, public_source):
+    # the dates are bound as Arrow objects, also in the estimated count
+    status, data = api('GET', 'sources?pageNumber=1&numPerPage=1000'
+                       '&startDate=2000-01-01T00:00:00'
+                       '&endDate=2100-01-01T00:00:00',
+                       token=view_only_token)
+    assert status == 200
+    assert data['data']['totalMatchesApproximate'] is False
+    assert data['data']['totalMatches'] == len(data['data']['sources'])
+
+
 def test_token_user_retrieving_source(view_only_token, public_source):
     status, data = api('GET', f'sources/{public_source.id}',
                        token=view_only_token)
@@ -90,6 +110,29 @@ def test_add_source_without_group_id(upload_data_token, view_only_token,
     npt.assert_almost_equal(data['data']['ra'], 234.22)
 
 
+def test_source_cone_search(upload_data_token, view_only_token, public_group):
+    obj_id = str(uuid.uuid4())
+    status, data = api('POST', 'sources',
+                       data={'id': obj_id,
+                             'ra': 359.999,
+                             'dec': 45.,
+                             'group_ids': [public_group.id]},
+                       token=upload_data_token)
+    assert status == 200
+
+    # the cone wraps around RA = 0
+    status, data = api('GET', 'sources?pageNumber=1&ra=0.001&dec=45'
+                       '&radius=0.01', token=view_only_token)
+    assert status == 200
+    assert obj_id in [s['id'] for s in data['data']['sources']]
+
+    # cones are circles, not boxes
+    status, data = api('GET', 'sources?pageNumber=1&ra=0.01&dec=45.009'
+                       '&radius=0.01', token=view_only_token)
+    assert status == 200
+    assert obj_id not in [s['id'] for s in data['data']['sources']]
+
+
 def test_starlist(manage_sources_token, public_source):
     status, data = api(
         'PUT', f'sources/{public_source.id}',
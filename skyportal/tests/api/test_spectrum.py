@@ -1,5 +1,8 @@
 import datetime
 
+import numpy as np
+import pyarrow as pa
+
 from skyportal.tests import api
 
 
@@ -26,6 +29,58 @@ def test_token_user_post_get_spectrum_data(upload_data_token, public_source):
     assert data['data']['obj_id'] == public_source.id
 
 
+def test_token_user_get_spectrum_arrow(upload_data_token, public_source):
+    status, data = api('POST', 'spectrum',
+                       data={'obj_id': str(public_source.id),
+                             'observed_at': str(datetime.datetime.now()),
+                             'instrument_id': 1,
+                             'wavelengths': [664, 665, 666],
+                             'fluxes': [234.2, 232.1, 235.3]
+                             },
+                       token=upload_data_token)
+    assert status == 200
+    spectrum_id = data['data']['id']
+
+    response = api('GET', f'spectrum/{spectrum_id}?encoding=arrow',
+                   token=upload_data_token, raw_response=True)
+    assert response.status_code == 200
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.schema.metadata[b'obj_id'].decode() == public_source.id
+    assert table.column_names == ['wavelengths', 'fluxes']
+    np.testing.assert_allclose(table.column('fluxes').to_numpy(),
+                               [234.2, 232.1, 235.3])
+
+
+def test_token_user_get_resampled_spectrum(upload_data_token, public_source):
+    wavelengths = np.arange(6000., 7000.)
+    status, data = api('POST', 'spectrum',
+                       data={'obj_id': str(public_source.id),
+                             'observed_at': str(datetime.datetime.now()),
+                             'instrument_id': 1,
+                             'wavelengths': wavelengths.tolist(),
+                             'fluxes': [4.] * len(wavelengths)
+                             },
+                       token=upload_data_token)
+    assert status == 200
+    spectrum_id = data['data']['id']
+
+    status, data = api('GET', f'spectrum/{spectrum_id}?minWavelength=6200'
+                       '&maxWavelength=6300', token=upload_data_token)
+    assert status == 200
+    assert data['data']['wavelengths'] == list(np.arange(6200., 6301.))
+    assert data['data']['obj_id'] == public_source.id
+
+    status, data = api('GET', f'spectrum/{spectrum_id}?nPoints=10'
+                       '&normalize=median', token=upload_data_token)
+    assert status == 200
+    assert len(data['data']['wavelengths']) == 10
+    np.testing.assert_allclose(data['data']['fluxes'], 1.)
+
+    status, data = api('GET', f'spectrum/{spectrum_id}?nPoints=10'
+                       '&resolution=5', token=upload_data_token)
+    assert status == 400
+
+
 def test_token_user_post_spectrum_no_access(view_only_token, public_source):
     status, data = api('POST', 'spectrum',
                        data={'obj_id': str(public_source.id),
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from skyportal.models import BinaryArray
+
+
+@pytest.mark.parametrize('dtype', ['float64', 'float32'])
+@pytest.mark.parametrize('compress', [False, True])
+def test_binary_array_round_trip(dtype, compress):
+    column_type = BinaryArray(dtype=dtype, compress=compress)
+    values = np.random.random(1000)
+    stored = column_type.process_bind_param(values, None)
+    loaded = column_type.result_processor(None, None)(memoryview(stored))
+    assert loaded.dtype == np.dtype(dtype)
+    np.testing.assert_allclose(loaded, values, rtol=1e-6)
+
+    # the options of the writer are in the header, not needed to read
+    loaded = BinaryArray().process_result_value(stored, None)
+    np.testing.assert_allclose(loaded, values, rtol=1e-6)
+
+
+def test_binary_array_legacy_and_null():
+    column_type = BinaryArray()
+    assert column_type.process_bind_param(None, None) is None
+    assert column_type.process_result_value(None, None) is None
+    # values of a column not yet migrated from `float8[]`
+    np.testing.assert_array_equal(
+        column_type.process_result_value([664., 665., 666.], None),
+        [664., 665., 666.]
+    )
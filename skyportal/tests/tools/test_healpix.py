@@ -0,0 +1,63 @@
+import numpy as np
+
+from skyportal.utils.healpix import (radec_to_healpix, healpix_to_radec,
+                                     great_circle_distance, cone_ranges)
+
+
+def random_positions(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ra = 360 * rng.random(n)
+    dec = np.degrees(np.arcsin(2 * rng.random(n) - 1))
+    return ra, dec
+
+
+def test_healpix_round_trip():
+    ra, dec = random_positions(10000)
+    for order in [0, 3, 10, 20]:
+        pix = radec_to_healpix(ra, dec, order)
+        assert pix.min() >= 0
+        assert pix.max() < 12 * 4 ** order
+        # pixel centers are in their pixel, and close to its points
+        centers = healpix_to_radec(pix, order)
+        assert (radec_to_healpix(*centers, order) == pix).all()
+        assert great_circle_distance(ra, dec, *centers).max() < \
+            np.degrees(1.1 / 2 ** order)
+
+    # nested pixels contain their children
+    assert (radec_to_healpix(ra, dec, 20) >> 20 ==
+            radec_to_healpix(ra, dec, 10)).all()
+    # pixels have equal areas
+    counts = np.bincount(radec_to_healpix(ra, dec, 1), minlength=48)
+    assert counts.min() > 0.7 * len(ra) / 48
+
+
+def test_great_circle_distance():
+    assert np.isclose(great_circle_distance(359.5, 0, 0.5, 0), 1)
+    assert np.isclose(great_circle_distance(0, 89.5, 180, 89.5), 1)
+    assert np.isclose(great_circle_distance(10, -90, 200, 90), 180)
+
+
+def test_cone_ranges():
+    ra, dec = random_positions(100000, seed=1)
+    pix = radec_to_healpix(ra, dec)
+    # around RA = 0 and the poles too
+    for center_ra, center_dec, radius in [(0., 0., 2.), (359.9, 10., 3.),
+                                          (10., 89.9, 2.), (200., -89., 3.),
+                                          (50., -30., 30.), (120., 45., 1e-3),
+                                          (0., 0., 180.)]:
+        ranges = cone_ranges(center_ra, center_dec, radius)
+        starts, stops = np.array(ranges).T
+        assert (starts[1:] > stops[:-1]).all()
+        within = great_circle_distance(center_ra, center_dec,
+                                       ra, dec) <= radius
+        in_ranges = np.zeros(len(pix), dtype=bool)
+        for start, stop in ranges:
+            in_ranges |= (pix >= start) & (pix < stop)
+        assert in_ranges[within].all()
+        # the prefilter is tight
+        assert in_ranges.sum() <= 2 * within.sum() + 10
+
+    # the pixel of the center is covered even by the smallest cones
+    for i in range(100):
+        ranges = cone_ranges(ra[i], dec[i], 0)
+        assert any(start <= pix[i] < stop for start, stop in ranges)
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+import sncosmo
+from astropy.table import Table
+from sncosmo.photdata import PhotometricData
+
+from skyportal.models import PHOT_ZP, PHOT_SYS
+from skyportal.utils.photometry import (
+    normalize_flux, mag_to_flux, magsys_corrections, MAGSYS_CORRECTIONS,
+    stack_photometry
+)
+
+
+def test_normalize_flux_matches_sncosmo():
+    n = 100
+    flux = 10 + 10 * np.random.random(n)
+    fluxerr = np.random.random(n)
+    zp = 20 + 5 * np.random.random(n)
+    magsys = np.random.choice(['ab', 'vega'], n)
+    bandpass = np.random.choice(['ztfg', 'ztfr', 'ztfi'], n)
+
+    norm_flux, norm_fluxerr = normalize_flux(flux, fluxerr, zp, magsys,
+                                             bandpass)
+
+    table = Table({'mjd': np.zeros(n), 'filter': bandpass, 'flux': flux,
+                   'fluxerr': fluxerr, 'zp': zp, 'magsys': magsys})
+    photdata = PhotometricData(table).normalized(zp=PHOT_ZP, zpsys=PHOT_SYS)
+    np.testing.assert_allclose(norm_flux, photdata.flux)
+    np.testing.assert_allclose(norm_fluxerr, photdata.fluxerr)
+
+
+def test_normalize_flux_scalar_and_null():
+    flux, fluxerr = normalize_flux(np.nan, 0.031, 25., 'ab', 'ztfg')
+    assert np.isnan(flux)
+    np.testing.assert_allclose(fluxerr, 0.031 * 10**(-0.4 * (25. - 23.9)))
+
+
+def test_mag_to_flux_limits():
+    flux, fluxerr = mag_to_flux([21., np.nan], [0.2, np.nan], 22.3)
+    np.testing.assert_allclose(flux[0], 10**(-0.4 * (21. - 23.9)))
+    np.testing.assert_allclose(fluxerr[0], 0.2 / (2.5 / np.log(10)) * flux[0])
+    assert np.isnan(flux[1])
+    np.testing.assert_allclose(fluxerr[1], 10**(-0.4 * (22.3 - 23.9)) / 5)
+
+
+def test_magsys_corrections_table():
+    filters = ['ztfg', 'ztfr', 'ztfg', 'ztfi']
+    corrections = magsys_corrections('vega', filters)
+
+    ab = sncosmo.get_magsystem('ab')
+    vega = sncosmo.get_magsystem('vega')
+    expected = [2.5 * np.log10(vega.zpbandflux(f) / ab.zpbandflux(f))
+                for f in filters]
+    np.testing.assert_allclose(corrections, expected)
+    assert ('vega', 'ztfr') in MAGSYS_CORRECTIONS
+    np.testing.assert_allclose(magsys_corrections('ab', filters), 0.)
+
+
+def test_stack_photometry():
+    data = pd.DataFrame({
+        'mjd': [0., 0.5, 1.2, 3.1, 3.2, 5.],
+        'flux': [10., 20., np.nan, np.nan, np.nan, 1.],
+        'fluxerr': [1., 2., 3., 2., 1.5, 1.],
+        'filter': 'ztfg',
+        'instrument_id': 1,
+    })
+    stacked = stack_photometry(data, 1.)
+    assert stacked['nstacked'].tolist() == [2, 1, 2, 1]
+
+    # inverse-variance weighted mean of the first two points
+    np.testing.assert_allclose(stacked['flux'][0], (10 + 20 / 4) / 1.25)
+    np.testing.assert_allclose(stacked['fluxerr'][0], 1.25 ** -0.5)
+    np.testing.assert_allclose(stacked['mjd'][0], 0.5 / 4 / 1.25)
+    assert stacked['detected'][0]
+
+    # bins of non-detections give their deepest limit
+    assert np.isnan(stacked['flux'][2])
+    assert stacked['fluxerr'][2] == 1.5
+    assert stacked['mjd'][2] == 3.2
+    assert not stacked['detected'][2]
+
+    # filters are stacked separately
+    data['filter'] = ['ztfg', 'ztfr'] * 3
+    stacked = stack_photometry(data, 10.)
+    assert stacked['filter'].tolist() == ['ztfg', 'ztfr']
+    assert stacked['nstacked'].tolist() == [3, 3]
+
+    assert len(stack_photometry(data.iloc[:0], 1.)) == 0
@@ -0,0 +1,53 @@
+from skyportal.handlers.api.internal import plot
+from skyportal.handlers.api.internal.plot import PlotCache
+
+
+def test_plot_cache_revisions():
+    cache = PlotCache(max_entries=2)
+    key = ('photometry', 'ZTF1', 600, 300)
+    assert cache.get(key, 0) is None
+
+    cache.put(key, 0, ('docs', 'items', 'js'))
+    assert cache.get(key, 0) == ('docs', 'items', 'js')
+    # a write to the object bumps its revision
+    assert cache.get(key, 1) is None
+
+    cache.put(key, 1, ('new docs', 'items', 'js'))
+    assert cache.get(key, 1) == ('new docs', 'items', 'js')
+    assert cache.get(key, 0) is None
+
+
+def test_plot_cache_lru():
+    cache = PlotCache(max_entries=2)
+    for i in range(3):
+        cache.put(('photometry', f'ZTF{i}'), 0, (f'docs{i}', 'items', 'js'))
+    assert cache.get(('photometry', 'ZTF0'), 0) is None
+    assert cache.get(('photometry', 'ZTF1'), 0) is not None
+
+    # ZTF1 was used last, so ZTF2 is evicted next
+    cache.put(('photometry', 'ZTF3'), 0, ('docs3', 'items', 'js'))
+    assert cache.get(('photometry', 'ZTF2'), 0) is None
+    assert cache.get(('photometry', 'ZTF1'), 0) is not None
+
+
+def test_plot_cache_disk(tmp_path):
+    key = ('spectroscopy', 'ZTF1', 0.1)
+    PlotCache(max_entries=1, directory=str(tmp_path)).put(
+        key, 3, ('docs', 'items', 'js'))
+
+    # a new process starts with an empty memory tier
+    cache = PlotCache(max_entries=1, directory=str(tmp_path))
+    assert cache.get(key, 3) == ('docs', 'items', 'js')
+    assert cache.get(key, 4) is None
+
+
+def test_plot_cache_disk_version(tmp_path, monkeypatch):
+    key = ('photometry', 'ZTF1', 600, 300)
+    monkeypatch.setattr(plot, 'PLOT_CACHE_VERSION', 1)
+    PlotCache(max_entries=1, directory=str(tmp_path)).put(
+        key, 3, ('docs', 'items', 'js'))
+
+    # plots cached in an older format are not read back
+    monkeypatch.setattr(plot, 'PLOT_CACHE_VERSION', 2)
+    cache = PlotCache(max_entries=1, directory=str(tmp_path))
+    assert cache.get(key, 3) is None
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+from skyportal.plot import (BANDPASS_COLORS, PYRAMID_LEVELS, error_bars,
+                            column_data, get_color, pyramid_levels,
+                            photometry_pyramid, pyramid_resolution,
+                            downsample_photometry, decimate_spectrum)
+
+
+def test_error_bars():
+    x = np.array([58000., 58001.5])
+    y = np.array([10., 20.])
+    err = np.array([1., 0.5])
+    bars = error_bars(x, y, err)
+    assert bars['x'].tolist() == [58000., 58001.5]
+    assert bars['y0'].tolist() == [9., 19.5]
+    assert bars['y1'].tolist() == [11., 20.5]
+
+    assert all(len(v) == 0 for v in error_bars([], [], []).values())
+
+
+def test_column_data():
+    df = pd.DataFrame({'mjd': [58000., 58001.], 'mag': [18., None],
+                       'filter': ['ztfg', 'ztfr'], 'stacked': [False, True],
+                       'unused': [1, 2]})
+    data = column_data(df[df['mjd'] > 0], ['mjd', 'mag', 'filter', 'stacked'])
+    assert set(data) == {'mjd', 'mag', 'filter', 'stacked'}
+    assert data['mjd'].dtype == np.float64
+    assert data['mag'].dtype == np.float64
+    assert np.isnan(data['mag'][1])
+    assert data['filter'] == ['ztfg', 'ztfr']
+    assert data['stacked'] == [False, True]
+
+
+def test_get_color_table():
+    assert get_color('ztfr') == 'red'
+    color = get_color('sdssg')
+    assert color.startswith('#')
+    assert BANDPASS_COLORS['sdssg'] == color
+
+
+def test_pyramid_levels():
+    rng = np.random.default_rng(0)
+    n = 5000
+    mjd = np.sort(58000 + 1000 * rng.random(n))
+    flux = 10 + rng.normal(size=n)
+    flux[rng.random(n) < 0.2] = np.nan
+    fluxerr = 1 + rng.random(n)
+    levels = pyramid_levels(mjd, flux, fluxerr, mjd[0], mjd[-1])
+
+    assert levels[0] == levels[-1] == 0
+    assert (levels <= PYRAMID_LEVELS).all()
+    sizes = [(levels <= k).sum() for k in range(PYRAMID_LEVELS + 1)]
+    assert sizes == sorted(sizes)
+    assert sizes[-1] == n
+
+    # every level keeps the extreme fluxes and the deepest upper limit
+    limits = np.isnan(flux)
+    for k in range(PYRAMID_LEVELS):
+        kept = levels <= k
+        assert np.nanmax(flux[kept]) == np.nanmax(flux)
+        assert np.nanmin(flux[kept]) == np.nanmin(flux)
+        assert fluxerr[kept & limits].min() == fluxerr[limits].min()
+
+
+def test_downsample_photometry():
+    n = 20000
+    data = pd.DataFrame({
+        'id': np.arange(n),
+        'mjd': 58000 + np.arange(n) / 10,
+        'flux': np.sin(np.arange(n) / 100),
+        'fluxerr': 0.1,
+        'filter': np.where(np.arange(n) % 2, 'ztfg', 'ztfr'),
+        'instrument_id': 1,
+    })
+    pyramid = photometry_pyramid(data)
+    assert len(pyramid) == n
+
+    coarse = downsample_photometry(pyramid, 600)
+    assert 'level' not in coarse
+    assert len(coarse) < n / 4
+
+    # zooming in gives a finer level, restricted to the window
+    assert pyramid_resolution(pyramid, 600, 58000, 58010) > \
+        pyramid_resolution(pyramid, 600)
+    window = downsample_photometry(pyramid, 600, 58000, 58010)
+    assert window['mjd'].between(58000, 58010).all()
+    assert len(window) == 101
+
+
+def test_decimate_spectrum():
+    wavelengths = np.linspace(3000., 10000., 100000)
+    fluxes = np.ones_like(wavelengths)
+    fluxes[20000] = 10.  # emission line
+    fluxes[70000] = -5.  # absorption line
+
+    decimated_wavelengths, decimated_fluxes = decimate_spectrum(
+        wavelengths[::-1], fluxes[::-1], n_bins=1000
+    )
+    assert len(decimated_wavelengths) <= 2002
+    assert np.all(np.diff(decimated_wavelengths) > 0)
+    assert decimated_fluxes.max() == 10.
+    assert decimated_fluxes.min() == -5.
+    assert decimated_wavelengths[decimated_fluxes.argmax()] == wavelengths[20000]
+    assert decimated_wavelengths[0] == 3000.
+    assert decimated_wavelengths[-1] == 10000.
+
+    # short spectra are kept whole
+    w, f = decimate_spectrum(wavelengths[:100], fluxes[:100], n_bins=1000)
+    assert len(w) == 100
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from skyportal.utils.spectrum import (pixel_edges, rebin_spectrum,
+                                      resample_spectrum, normalize_spectrum)
+
+
+def test_pixel_edges():
+    edges = pixel_edges([1., 2., 4.])
+    assert edges.tolist() == [0.5, 1.5, 3., 5.]
+
+    with pytest.raises(ValueError):
+        pixel_edges([1.])
+
+
+def test_rebin_spectrum_conserves_flux():
+    wavelengths = np.linspace(4000., 8000., 4001)
+    fluxes = 1 + np.exp(-((wavelengths - 6563) / 5) ** 2)
+    errors = np.full_like(wavelengths, 0.1)
+    edges = pixel_edges(wavelengths)
+
+    # rebinning onto the pixels themselves is the identity
+    centers, new_fluxes, new_errors = rebin_spectrum(wavelengths, fluxes,
+                                                     edges, errors)
+    np.testing.assert_allclose(centers, wavelengths)
+    np.testing.assert_allclose(new_fluxes, fluxes)
+    np.testing.assert_allclose(new_errors, errors)
+
+    new_edges = np.linspace(3000., 9000., 61)
+    centers, new_fluxes, new_errors = rebin_spectrum(wavelengths, fluxes,
+                                                     new_edges, errors)
+    new_widths = np.diff(np.clip(new_edges, edges[0], edges[-1]))
+    new_widths = new_widths[new_widths > 0]
+    assert len(centers) == 42
+    np.testing.assert_allclose((new_fluxes * new_widths).sum(),
+                               (fluxes * np.diff(edges)).sum())
+    # averaging 100 independent pixels divides the error by 10
+    np.testing.assert_allclose(new_errors[1:-1], 0.01)
+
+
+def test_resample_spectrum():
+    wavelengths = np.arange(4000., 8000.)
+    fluxes = np.ones_like(wavelengths)
+
+    w, f, e = resample_spectrum(wavelengths[::-1], fluxes, None, 5000, 5100)
+    assert w.tolist() == list(np.arange(5000., 5101.))
+    assert e is None
+
+    w, f, e = resample_spectrum(wavelengths, fluxes, fluxes, 5000, 6000,
+                                n_points=10)
+    assert len(w) == 10
+    np.testing.assert_allclose(f, 1.)
+    np.testing.assert_allclose(e, 0.1)
+
+    w, f, e = resample_spectrum(wavelengths, fluxes, None, 5000, 5100,
+                                resolution=30)
+    assert w.tolist() == [5015., 5045., 5075., 5095.]
+
+    with pytest.raises(ValueError):
+        resample_spectrum(wavelengths, fluxes, n_points=10, resolution=1)
+    with pytest.raises(ValueError):
+        resample_spectrum(wavelengths, fluxes, None, 6000, 5000)
+    with pytest.raises(ValueError):
+        resample_spectrum(wavelengths, fluxes, n_points=10 ** 9)
+    with pytest.raises(ValueError):
+        resample_spectrum(wavelengths, fluxes, resolution=1e-300)
+
+
+def test_normalize_spectrum():
+    wavelengths = np.linspace(6000., 7000., 11)
+    fluxes = np.where(np.abs(wavelengths - 6400) < 100, -4., 1.)
+    normalized, errors = normalize_spectrum(wavelengths, fluxes, fluxes)
+    np.testing.assert_allclose(normalized, fluxes / 4)
+    np.testing.assert_allclose(errors, fluxes / 4)
+
+    # spectra not covering 6400A use their median flux
+    normalized, errors = normalize_spectrum([1000., 2000., 3000.],
+                                            [2., 4., 8.])
+    np.testing.assert_allclose(normalized, [0.5, 1., 2.])
+    assert errors is None
+
+    with pytest.raises(ValueError):
+        normalize_spectrum([1000., 2000., 3000.], [0., 0., 1.])
+    with pytest.raises(ValueError):
+        normalize_spectrum([1000., 2000., 3000.], [np.nan, 1., 1.])
@@ -0,0 +1,155 @@
+"""HEALPix indexing of sky positions, for indexed cone searches.
+
+Positions are indexed by their pixel in the NESTED scheme at order
+`HEALPIX_ORDER`. In that scheme, the pixels of order `HEALPIX_ORDER` inside a
+pixel of any coarser order form a contiguous range of indices, so a cone is
+covered by a handful of index ranges (see `cone_ranges`), which a B-tree on
+the index column can answer directly.
+"""
+import numpy as np
+
+
+# pixels of order 20 are ~0.2 arcsec across
+HEALPIX_ORDER = 20
+
+# upper bound of the angular distance, in radians, between the center of a
+# pixel of order k and any point of the pixel, times 2**k (the largest such
+# distance is ~1.06 / 2**k, for the elongated pixels near the poles)
+MAX_PIXEL_RADIUS = 1.2
+
+# row and column of the base pixels, see Gorski et al. (2005)
+_FACE_ROWS = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+_FACE_COLUMNS = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+
+def _interleave(ix, iy, order):
+    pix = np.zeros_like(ix)
+    for bit in range(order):
+        pix |= ((ix >> bit) & 1) << (2 * bit)
+        pix |= ((iy >> bit) & 1) << (2 * bit + 1)
+    return pix
+
+
+def _deinterleave(pix, order):
+    ix = np.zeros_like(pix)
+    iy = np.zeros_like(pix)
+    for bit in range(order):
+        ix |= ((pix >> (2 * bit)) & 1) << bit
+        iy |= ((pix >> (2 * bit + 1)) & 1) << bit
+    return ix, iy
+
+
+def radec_to_healpix(ra, dec, order=HEALPIX_ORDER):
+    """Return the NESTED HEALPix index, of order `order`, of the pixels
+    containing the positions `ra`, `dec` (in degrees).
+    """
+    ra = np.radians(np.asarray(ra, dtype=float))
+    dec = np.radians(np.asarray(dec, dtype=float))
+    nside = 1 << order
+    z = np.sin(dec)
+    za = np.abs(z)
+    tt = np.mod(ra, 2 * np.pi) / (np.pi / 2)  # in [0, 4)
+
+    # equatorial region
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * z * 0.75
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ifp = jp >> order
+    ifm = jm >> order
+    face = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix = jm & (nside - 1)
+    iy = nside - (jp & (nside - 1)) - 1
+
+    # polar caps; 1 - |z| is computed from cos(dec) to keep its precision
+    ntt = np.minimum(tt.astype(np.int64), 3)
+    tp = tt - ntt
+    tmp = nside * np.cos(dec) * np.sqrt(3 / (1 + za))
+    jp_polar = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm_polar = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    polar = za > 2 / 3
+    north = z >= 0
+    face = np.where(polar, np.where(north, ntt, ntt + 8), face)
+    ix = np.where(polar, np.where(north, nside - jm_polar - 1, jp_polar), ix)
+    iy = np.where(polar, np.where(north, nside - jp_polar - 1, jm_polar), iy)
+
+    return (face << (2 * order)) + _interleave(ix, iy, order)
+
+
+def healpix_to_radec(pix, order=HEALPIX_ORDER):
+    """Return the positions (in degrees) of the centers of the NESTED
+    HEALPix pixels `pix` of order `order`.
+    """
+    pix = np.asarray(pix, dtype=np.int64)
+    nside = 1 << order
+    npface = nside * nside
+    face = pix >> (2 * order)
+    ix, iy = _deinterleave(pix & (npface - 1), order)
+
+    jr = _FACE_ROWS[face] * nside - ix - iy - 1
+    nr = np.where(jr < nside, jr, np.where(jr > 3 * nside, 4 * nside - jr,
+                                           nside))
+    z = np.where(jr < nside, 1 - nr * nr / (3 * npface),
+                 np.where(jr > 3 * nside, nr * nr / (3 * npface) - 1,
+                          (2 * nside - jr) * 2 / (3 * nside)))
+    kshift = np.where((jr >= nside) & (jr <= 3 * nside), (jr - nside) & 1, 0)
+    jp = (_FACE_COLUMNS[face] * nr + ix - iy + 1 + kshift) // 2
+    jp = np.where(jp > 4 * nside, jp - 4 * nside, jp)
+    jp = np.where(jp < 1, jp + 4 * nside, jp)
+
+    ra = (jp - (kshift + 1) * 0.5) * (np.pi / 2 / nr)
+    return np.degrees(ra), np.degrees(np.arcsin(z))
+
+
+def great_circle_distance(ra1, dec1, ra2, dec2):
+    """Angular distance, in degrees, between positions given in degrees."""
+    ra1, dec1, ra2, dec2 = (np.radians(np.asarray(x, dtype=float))
+                            for x in (ra1, dec1, ra2, dec2))
+    hav = (np.sin((dec2 - dec1) / 2) ** 2
+           + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2)
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(hav, 0, 1))))
+
+
+def cone_ranges(ra, dec, radius, order=HEALPIX_ORDER):
+    """Cover a cone with ranges of NESTED HEALPix indices of order `order`.
+
+    Pixels are refined from the 12 base pixels down, keeping those that may
+    intersect the cone, until they are small compared to the cone. The
+    cover is conservative: every position within `radius` degrees of `ra`,
+    `dec` has its index in one of the ranges, so the ranges are a prefilter
+    to complete with an exact distance check.
+
+    Returns
+    -------
+    list of (int, int)
+        Sorted, disjoint, half-open `[start, stop)` index ranges.
+    """
+    radius = np.radians(radius)
+    pix = np.arange(12, dtype=np.int64)
+    covered = []
+    for k in range(order + 1):
+        pixel_radius = MAX_PIXEL_RADIUS / (1 << k)
+        centers = healpix_to_radec(pix, k)
+        distance = np.radians(great_circle_distance(ra, dec, *centers))
+        pix = pix[distance <= radius + pixel_radius]
+        distance = distance[distance <= radius + pixel_radius]
+        inside = distance + pixel_radius <= radius
+        shift = 2 * (order - k)
+        if k == order or pixel_radius < radius / 4:
+            covered.append((pix << shift, (pix + 1) << shift))
+            break
+        covered.append((pix[inside] << shift, (pix[inside] + 1) << shift))
+        pix = ((pix[~inside] << 2)[:, None]
+               + np.arange(4, dtype=np.int64)).ravel()
+
+    starts = np.concatenate([start for start, _ in covered])
+    stops = np.concatenate([stop for _, stop in covered])
+    sort = np.argsort(starts)
+    starts, stops = starts[sort], stops[sort]
+    ranges = []
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], stop)
+        else:
+            ranges.append([start, stop])
+    return [tuple(r) for r in ranges]
@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+import sncosmo
+
+from ..models import PHOT_ZP, PHOT_SYS
+
+
+DETECT_THRESH = 5  # sigma
+
+# Zeropoint offsets between each magnitude system and `PHOT_SYS`, keyed by
+# (magsys, bandpass). Filled lazily, since loading every bandpass in
+# `ALLOWED_BANDPASSES` up front would download hundreds of transmission
+# curves that are never used.
+MAGSYS_CORRECTIONS = {}
+
+
+def _group_keys(magsys, bandpass):
+    """Return the distinct (magsys, bandpass) pairs and, for every element,
+    the index of its pair."""
+    magsys, magsys_inv = np.unique(np.asarray(magsys, dtype=str),
+                                   return_inverse=True)
+    bandpass, bandpass_inv = np.unique(np.asarray(bandpass, dtype=str),
+                                       return_inverse=True)
+    codes = magsys_inv.ravel() * len(bandpass) + bandpass_inv.ravel()
+    unique, inverse = np.unique(codes, return_inverse=True)
+    pairs = [(magsys[c // len(bandpass)], bandpass[c % len(bandpass)])
+             for c in unique]
+    return pairs, inverse.ravel()
+
+
+def magsys_correction(magsys, bandpass):
+    """Return `2.5 log10(zpbandflux(magsys) / zpbandflux(PHOT_SYS))` for a
+    bandpass.
+
+    A magnitude in `PHOT_SYS` plus this correction is the same magnitude in
+    `magsys`. The value is computed once per (magsys, bandpass) pair and
+    stored in `MAGSYS_CORRECTIONS`.
+    """
+    key = (magsys, bandpass)
+    if key not in MAGSYS_CORRECTIONS:
+        ratio = (sncosmo.get_magsystem(magsys).zpbandflux(bandpass)
+                 / sncosmo.get_magsystem(PHOT_SYS).zpbandflux(bandpass))
+        MAGSYS_CORRECTIONS[key] = 2.5 * np.log10(ratio)
+    return MAGSYS_CORRECTIONS[key]
+
+
+def magsys_corrections(magsys, bandpass):
+    """Vectorized `magsys_correction`.
+
+    Parameters
+    ----------
+    magsys : str or array_like of str
+        Magnitude system(s).
+    bandpass : str or array_like of str
+        Bandpass(es). Broadcast against `magsys`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Correction for each element.
+    """
+    magsys, bandpass = np.broadcast_arrays(np.asarray(magsys, dtype=str),
+                                           np.asarray(bandpass, dtype=str))
+    pairs, inverse = _group_keys(magsys, bandpass)
+    table = np.array([magsys_correction(ms, band) for ms, band in pairs])
+    return table[inverse].reshape(magsys.shape)
+
+
+def normalization_factors(zp, magsys, bandpass, zp_out=PHOT_ZP,
+                          magsys_out=PHOT_SYS):
+    """Factors that bring fluxes from the given zeropoints and magnitude
+    systems onto `zp_out` in `magsys_out`.
+
+    This is the same conversion done by
+    `sncosmo.photdata.PhotometricData.normalized`, without building a table:
+    the magnitude system offsets come from `MAGSYS_CORRECTIONS` and are
+    broadcast to all elements.
+
+    Parameters
+    ----------
+    zp : array_like
+        Zeropoints of the input fluxes.
+    magsys : array_like of str
+        Magnitude systems to which the input fluxes are tied.
+    bandpass : array_like of str
+        Bandpass of each flux.
+    zp_out : float, optional
+        Zeropoint of the output fluxes. Defaults to `PHOT_ZP`, i.e. µJy.
+    magsys_out : str, optional
+        Magnitude system of the output fluxes. Defaults to `PHOT_SYS`.
+
+    Returns
+    -------
+    numpy.ndarray
+        Multiplicative factor for each flux (and flux error).
+    """
+    zp = np.asarray(zp, dtype=float)
+    magsys = np.broadcast_to(magsys, zp.shape)
+    bandpass = np.broadcast_to(bandpass, zp.shape)
+    correction = (magsys_corrections(magsys, bandpass)
+                  - magsys_corrections(magsys_out, bandpass))
+    return 10 ** (0.4 * (zp_out - zp + correction))
+
+
+def normalize_flux(flux, fluxerr, zp, magsys, bandpass):
+    """Convert fluxes and flux errors to µJy (`PHOT_ZP` in `PHOT_SYS`).
+
+    Parameters
+    ----------
+    flux : array_like
+        Fluxes. Missing fluxes (non-detections) may be nan and stay nan.
+    fluxerr : array_like
+        Gaussian errors on the fluxes.
+    zp : array_like
+        Zeropoints, given by `zp` in `m = -2.5 log10(flux) + zp`.
+    magsys : array_like of str
+        Magnitude systems to which the fluxes and zeropoints are tied.
+    bandpass : array_like of str
+        Bandpass of each flux.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        The converted fluxes and flux errors.
+    """
+    factor = normalization_factors(zp, magsys, bandpass)
+    return (factor * np.asarray(flux, dtype=float),
+            factor * np.asarray(fluxerr, dtype=float))
+
+
+def mag_to_flux(mag, magerr, limiting_mag):
+    """Convert magnitudes to fluxes at zeropoint `PHOT_ZP` (in the magnitude
+    system of the magnitudes).
+
+    Non-detections, where `mag` is nan, get a nan flux and a flux error
+    derived from the 5-sigma limiting magnitude.
+
+    Parameters
+    ----------
+    mag, magerr, limiting_mag : array_like
+        Magnitudes, magnitude errors and limiting magnitudes.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray)
+        Fluxes and flux errors.
+    """
+    mag = np.asarray(mag, dtype=float)
+    magerr = np.asarray(magerr, dtype=float)
+    limiting_mag = np.asarray(limiting_mag, dtype=float)
+
+    flux = 10 ** (-0.4 * (mag - PHOT_ZP))
+    fluxerr = np.where(np.isnan(mag),
+                       10 ** (-0.4 * (limiting_mag - PHOT_ZP)) / 5,
+                       magerr / (2.5 / np.log(10)) * flux)
+    return flux, fluxerr
+
+
+def stack_photometry(data, binsize, start_mjd=None,
+                     by=('instrument_id', 'filter')):
+    """Stack light curves in MJD bins.
+
+    Points with a flux are combined into their inverse-variance weighted
+    mean flux and MJD, with error `sum(fluxerr**-2)**-0.5`. Non-detections
+    have no flux to combine: a bin holding only non-detections gives the
+    deepest of them (smallest `fluxerr`) as its upper limit, and they are
+    ignored in bins that have fluxes.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Photometry in µJy, with columns `mjd`, `flux` (nan for
+        non-detections), `fluxerr` and the columns in `by`.
+    binsize : float
+        Width of the bins, in days.
+    start_mjd : float, optional
+        Start of the first bin. Defaults to the first MJD in `data`.
+    by : sequence of str, optional
+        Columns identifying the light curves stacked separately.
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per non-empty bin of each light curve, ordered by the `by`
+        columns and MJD, with the `by` columns, `mjd`, `flux`, `fluxerr`,
+        `nstacked` (the number of points in the bin) and `detected`
+        (whether `flux / fluxerr >= DETECT_THRESH`).
+    """
+    if not binsize > 0:
+        raise ValueError(f'binsize must be positive, got {binsize}.')
+    by = list(by)
+    columns = by + ['mjd', 'flux', 'fluxerr', 'nstacked', 'detected']
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns)
+
+    mjd = np.asarray(data['mjd'], dtype=float)
+    flux = np.asarray(data['flux'], dtype=float)
+    fluxerr = np.asarray(data['fluxerr'], dtype=float)
+    if start_mjd is None:
+        start_mjd = mjd.min()
+    hasflux = np.isfinite(flux)
+    weight = np.where(hasflux, fluxerr ** -2., 0.)
+
+    frame = data[by].reset_index(drop=True)
+    frame['bin'] = np.floor((mjd - start_mjd) / binsize).astype(np.int64)
+    frame['weight'] = weight
+    frame['weighted_flux'] = np.where(hasflux, weight * flux, 0.)
+    frame['weighted_mjd'] = weight * mjd
+    frame['nstacked'] = 1
+    frame['limit_fluxerr'] = np.where(hasflux, np.inf, fluxerr)
+    frame['limit_mjd'] = mjd
+
+    keys = by + ['bin']
+    grouped = frame.groupby(keys, sort=True)
+    result = grouped[['weight', 'weighted_flux', 'weighted_mjd',
+                      'nstacked']].sum()
+    deepest = frame.loc[grouped['limit_fluxerr'].idxmin().to_numpy()]
+    result = result.join(
+        deepest.set_index(keys)[['limit_fluxerr', 'limit_mjd']]
+    ).reset_index()
+
+    measured = (result['weight'] > 0).to_numpy()
+    weight = result['weight'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['flux'] = np.where(measured,
+                                  result['weighted_flux'] / weight, np.nan)
+        result['fluxerr'] = np.where(measured, weight ** -0.5,
+                                     result['limit_fluxerr'])
+        result['mjd'] = np.where(measured, result['weighted_mjd'] / weight,
+                                 result['limit_mjd'])
+        result['detected'] = (result['flux'] / result['fluxerr']
+                              >= DETECT_THRESH)
+    return result[columns]
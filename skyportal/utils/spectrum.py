@@ -0,0 +1,174 @@
+import numpy as np
+
+
+# reference region of `normalize_spectrum`, in Angstroms
+NORMALIZATION_WAVELENGTH = 6400.
+NORMALIZATION_HALF_WIDTH = 100.
+
+# normalizations accepted by `normalize_spectrum`
+NORMALIZATIONS = ['median']
+
+# largest number of bins `resample_spectrum` rebins a spectrum onto
+MAX_RESAMPLED_POINTS = 100000
+
+
+def pixel_edges(wavelengths):
+    """Return the edges of the pixels of a spectrum sampled at the sorted
+    `wavelengths`: the midpoints between pixels, extrapolated at both ends.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    if len(wavelengths) < 2:
+        raise ValueError('A spectrum needs at least two pixels to be '
+                         'resampled.')
+    midpoints = (wavelengths[1:] + wavelengths[:-1]) / 2
+    return np.concatenate([[2 * wavelengths[0] - midpoints[0]], midpoints,
+                           [2 * wavelengths[-1] - midpoints[-1]]])
+
+
+def rebin_spectrum(wavelengths, fluxes, new_edges, errors=None):
+    """Rebin a spectrum onto new wavelength bins, conserving flux.
+
+    Pixels are taken as constant over their width (see `pixel_edges`), and
+    the flux of each new bin is the integral of the spectrum over the bin
+    divided by its width. Integrals come from interpolating the cumulative
+    integral of the spectrum, so this is a few vectorized passes whatever
+    the number of pixels. Errors are propagated assuming independent
+    pixels, with pixels partially in a bin counted in proportion to their
+    overlap.
+
+    Parameters
+    ----------
+    wavelengths, fluxes : array_like
+        The spectrum, sorted by wavelength.
+    new_edges : array_like
+        Increasing edges of the new bins. Bins are cut to the wavelength
+        range of the spectrum, and dropped if entirely outside of it.
+    errors : array_like, optional
+        Errors on `fluxes`.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray or None)
+        The centers, fluxes and errors (None if `errors` is None) of the
+        new bins.
+    """
+    edges = pixel_edges(wavelengths)
+    widths = np.diff(edges)
+    fluxes = np.asarray(fluxes, dtype=float)
+    new_edges = np.clip(np.asarray(new_edges, dtype=float), edges[0],
+                        edges[-1])
+    new_widths = np.diff(new_edges)
+    valid = new_widths > 0
+    new_widths = new_widths[valid]
+    centers = ((new_edges[1:] + new_edges[:-1]) / 2)[valid]
+
+    def integrate(density):
+        cumulative = np.concatenate([[0.], np.cumsum(density * widths)])
+        return np.diff(np.interp(new_edges, edges, cumulative))[valid]
+
+    new_fluxes = integrate(fluxes) / new_widths
+    new_errors = None
+    if errors is not None:
+        errors = np.asarray(errors, dtype=float)
+        new_errors = np.sqrt(integrate(errors ** 2 * widths)) / new_widths
+    return centers, new_fluxes, new_errors
+
+
+def resample_spectrum(wavelengths, fluxes, errors=None, min_wavelength=None,
+                      max_wavelength=None, n_points=None, resolution=None):
+    """Cut a spectrum to a wavelength window and optionally rebin it with
+    `rebin_spectrum`.
+
+    Parameters
+    ----------
+    wavelengths, fluxes : array_like
+        The spectrum.
+    errors : array_like, optional
+        Errors on `fluxes`.
+    min_wavelength, max_wavelength : float, optional
+        The window. Default to the ends of the spectrum.
+    n_points : int, optional
+        Rebin the window onto this many bins of equal width.
+    resolution : float, optional
+        Rebin the window onto bins of this width, in Angstroms. Cannot be
+        combined with `n_points`. Without either, the pixels in the window
+        are returned as they are. Either way, there can be at most
+        `MAX_RESAMPLED_POINTS` bins.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray, numpy.ndarray or None)
+        The wavelengths, fluxes and errors (None if `errors` is None).
+    """
+    if n_points is not None and resolution is not None:
+        raise ValueError('n_points and resolution cannot be combined.')
+    if n_points is not None and n_points < 1:
+        raise ValueError('n_points must be positive.')
+    if resolution is not None and not resolution > 0:
+        raise ValueError('resolution must be positive.')
+
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    order = np.argsort(wavelengths, kind='mergesort')
+    wavelengths = wavelengths[order]
+    fluxes = np.asarray(fluxes, dtype=float)[order]
+    if errors is not None:
+        errors = np.asarray(errors, dtype=float)[order]
+    if len(wavelengths) == 0:
+        return wavelengths, fluxes, errors
+
+    low = wavelengths[0] if min_wavelength is None else min_wavelength
+    high = wavelengths[-1] if max_wavelength is None else max_wavelength
+    if not np.isfinite([low, high]).all():
+        raise ValueError('The wavelength window must be finite.')
+    if high < low:
+        raise ValueError('The wavelength window is empty.')
+
+    if n_points is None and resolution is None:
+        window = (wavelengths >= low) & (wavelengths <= high)
+        return (wavelengths[window], fluxes[window],
+                None if errors is None else errors[window])
+
+    n_bins = n_points
+    if resolution is not None:
+        n_bins = max(np.ceil((high - low) / resolution), 1)
+    if n_bins > MAX_RESAMPLED_POINTS:
+        raise ValueError('Spectra can be resampled onto at most '
+                         f'{MAX_RESAMPLED_POINTS} points.')
+
+    if n_points is not None:
+        new_edges = np.linspace(low, high, n_points + 1)
+    else:
+        new_edges = np.minimum(
+            low + resolution * np.arange(int(n_bins) + 1), high
+        )
+    return rebin_spectrum(wavelengths, fluxes, new_edges, errors)
+
+
+def normalize_spectrum(wavelengths, fluxes, errors=None, method='median'):
+    """Normalize a spectrum, as the PTF marshal does.
+
+    With `method='median'`, the fluxes (and errors) are divided by the
+    absolute median flux within `NORMALIZATION_HALF_WIDTH` of
+    `NORMALIZATION_WAVELENGTH`, or of the whole spectrum if it has no pixels
+    there. Raises a ValueError if that median is zero or not finite.
+
+    Returns
+    -------
+    (numpy.ndarray, numpy.ndarray or None)
+        The normalized fluxes and errors (None if `errors` is None).
+    """
+    if method not in NORMALIZATIONS:
+        raise ValueError(f"Invalid normalization '{method}'. Must be one of "
+                         f"{NORMALIZATIONS}.")
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    fluxes = np.asarray(fluxes, dtype=float)
+    reference = (np.abs(wavelengths - NORMALIZATION_WAVELENGTH)
+                 < NORMALIZATION_HALF_WIDTH)
+    if not reference.any():
+        reference = np.ones(len(fluxes), dtype=bool)
+    scale = np.abs(np.median(fluxes[reference]))
+    if not (np.isfinite(scale) and scale > 0):
+        raise ValueError('Cannot normalize a spectrum whose median flux is '
+                         f'{scale}.')
+    return (fluxes / scale,
+            None if errors is None else np.asarray(errors, dtype=float) / scale)
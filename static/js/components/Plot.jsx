@@ -16,7 +16,36 @@ import "bokehjs/bokeh-widgets.js";
 import "bokehcss/bokeh-widgets.css";
 
 
-function bokeh_render_plot(node, docs_json, render_items, custom_model_js) {
+// Promises of the custom Bokeh model JS, by URL. The URLs are
+// content-hashed, so each is fetched and evaluated at most once per page.
+const customModels = {};
+
+function loadCustomModels(custom_model_js_url) {
+  if (!(custom_model_js_url in customModels)) {
+    customModels[custom_model_js_url] = fetch(
+      custom_model_js_url, { credentials: "same-origin" }
+    )
+      .then((response) => response.text())
+      .then((custom_model_js) => {
+        // We have to give the Bokeh-generated JS snippet access to Bokeh.
+        // We do that by attaching Bokeh to the (global) Window object, and then
+        // modifying "this" (used by the universal module initializer) to point
+        // to it.
+        //
+        // The next statement may seem strange, since "Bokeh" is not defined; but the import
+        // above and/or webpack handles that for us.
+
+        // eslint-disable-next-line no-undef
+        window.Bokeh = Bokeh;
+        const js = custom_model_js.replace('this', 'root');
+        // eslint-disable-next-line no-eval
+        eval(`const root = { Bokeh: window.Bokeh }; ${js}`);
+      });
+  }
+  return customModels[custom_model_js_url];
+}
+
+function bokeh_render_plot(node, docs_json, render_items, custom_model_js_url) {
   // Create bokeh div element
   const bokeh_div = document.createElement("div");
   const inner_div = document.createElement("div");
@@ -27,25 +56,13 @@ function bokeh_render_plot(node, docs_json, render_items, custom_model_js) {
   while (node.hasChildNodes()) { node.removeChild(node.lastChild); }
   node.appendChild(bokeh_div);
 
-  // We have to give the Bokeh-generated JS snippet access to Bokeh.
-  // We do that by attaching Bokeh to the (global) Window object, and then
-  // modifying "this" (used by the universal module initializer) to point
-  // to it.
-  //
-  // The next statement may seem strange, since "Bokeh" is not defined; but the import
-  // above and/or webpack handles that for us.
-
-  // eslint-disable-next-line no-undef
-  window.Bokeh = Bokeh;
-  custom_model_js = custom_model_js.replace('this', 'root');
-  // eslint-disable-next-line no-eval
-  eval(`const root = { Bokeh: window.Bokeh }; ${custom_model_js}`);
-
   // Generate plot
-  // eslint-disable-next-line no-undef
-  Bokeh.safely(() => {
+  loadCustomModels(custom_model_js_url).then(() => {
     // eslint-disable-next-line no-undef
-    Bokeh.embed.embed_items(docs_json, render_items);
+    Bokeh.safely(() => {
+      // eslint-disable-next-line no-undef
+      Bokeh.embed.embed_items(docs_json, render_items);
+    });
   });
 }
 
@@ -107,7 +124,7 @@ const Plot = (props) => {
     );
   }
 
-  const { docs_json, render_items, custom_model_js } = plotData;
+  const { docs_json, render_items, custom_model_js_url } = plotData;
 
   return (
     <div
@@ -119,7 +136,7 @@ const Plot = (props) => {
               node,
               JSON.parse(docs_json),
               JSON.parse(render_items),
-              custom_model_js
+              custom_model_js_url
             );
           }
         }
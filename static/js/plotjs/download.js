@@ -1,55 +1,54 @@
 /* eslint-disable */
-function table_to_csv(source, write_header) {
-  const columns = ['mjd', 'filter', 'flux', 'fluxerr', 'zp',
-      'magsys', 'lim_mag', 'stacked'];
-  const nrows = source.get_length();
-  const lines = [];
+// The plotted light curves are downsampled, so the exported light curve is
+// fetched in full from the API, stacked there if a binsize is selected.
+const columns = ['mjd', 'filter', 'flux', 'fluxerr', 'zp',
+    'magsys', 'lim_mag', 'stacked'];
+const binsize = slider.value;
 
-  if (write_header) {
-    let now = new Date();
-    lines.push(`# source: "objname" downloaded at: ${now.toISOString()} UTC`);
-    lines.push(columns.join(','));
-  }
+let url = `/api/sources/${encodeURIComponent('objname')}/photometry` +
+    '?format=flux&magsys=ab&layout=columns';
+if (binsize > 0) {
+  url += `&binsize=${binsize}`;
+}
 
-  for (let i = 0; i < nrows; i++) {
-    const row = [];
-    for (let j = 0; j < columns.length; j++) {
-      const column = columns[j];
-      try {
-        row.push(source.data[column][i].toString());
-      } catch (error) {
-        if (column === 'zp') {
-          row.push(default_zp);
-        } else if (column === 'magsys') {
-          row.push('ab');
-        } else {
-          throw error;
-        }
-      }
+fetch(url, { credentials: 'same-origin' })
+  .then((response) => response.json())
+  .then((response) => {
+    if (response.status !== 'success') {
+      throw new Error(response.message);
     }
-    lines.push(row.join(','));
-  }
+    const data = response.data;
+    const now = new Date();
+    const lines = [
+      `# source: "objname" downloaded at: ${now.toISOString()} UTC`,
+      columns.join(',')
+    ];
 
-  return lines.join('\n').concat('\n');
-}
+    for (let i = 0; i < data.mjd.length; i++) {
+      const flux = (data.flux[i] === null) ? NaN : data.flux[i];
+      const lim_mag = -2.5 * Math.log10(detect_thresh * data.fluxerr[i]) +
+          data.zp[i];
+      const row = [data.mjd[i], data.filter[i], flux, data.fluxerr[i],
+                   data.zp[i], data.magsys, lim_mag, binsize > 0];
+      lines.push(row.map((value) => value.toString()).join(','));
+    }
 
+    const filename = 'objname.csv';
+    const blob = new Blob([lines.join('\n').concat('\n')],
+                          { type: 'text/csv;charset=utf-8;' });
 
-const filename = 'objname.csv';
-filetext = '';
-for (let i=0; i < toggle.labels.length; i++) {
-  const write_header = i === 0;
-  filetext += table_to_csv(eval(`bold${i}`), write_header);
-}
-const blob = new Blob([filetext], { type: 'text/csv;charset=utf-8;' });
-
-// addresses IE
-if (navigator.msSaveBlob) {
-  navigator.msSaveBlob(blob, filename);
-} else {
-  const link = document.createElement('a');
-  link.href = URL.createObjectURL(blob);
-  link.download = filename;
-  link.target = '_blank';
-  link.style.visibility = 'hidden';
-  link.dispatchEvent(new MouseEvent('click'));
-}
+    // addresses IE
+    if (navigator.msSaveBlob) {
+      navigator.msSaveBlob(blob, filename);
+    } else {
+      const link = document.createElement('a');
+      link.href = URL.createObjectURL(blob);
+      link.download = filename;
+      link.target = '_blank';
+      link.style.visibility = 'hidden';
+      link.dispatchEvent(new MouseEvent('click'));
+    }
+  })
+  .catch((error) => {
+    alert(`Unable to export the light curve: ${error.message}`);
+  });
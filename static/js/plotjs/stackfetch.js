@@ -0,0 +1,83 @@
+/* eslint-disable */
+// The plotted points are downsampled, so stacking them here would bias the
+// bins: they are fetched from the API instead, stacked from all the points.
+// `light_curves` describes the light curve of each legend label, and
+// `plot_window` the MJD range of the plotted points.
+const light_curves = light_curves_json;
+const plot_window = plot_window_json;
+
+// Call `callback` with the stacked points of each legend label, as lists of
+// {mjd, flux, fluxerr, mag, magerr, lim_mag, detected}, unless the binsize
+// has changed by the time they are fetched.
+function fetchStacked(binsize, callback) {
+  const bins = light_curves.map(() => []);
+  if (binsize === 0) {
+    callback(bins);
+    return;
+  }
+
+  const labels = {};
+  light_curves.forEach((light_curve, i) => {
+    light_curve.instrument_ids.forEach((instrument_id) => {
+      labels[`${instrument_id} ${light_curve.filter}`] = i;
+    });
+  });
+
+  const url = `/api/sources/${encodeURIComponent('objname')}/photometry` +
+      `?format=flux&magsys=ab&layout=columns&binsize=${binsize}`;
+  fetch(url, { credentials: 'same-origin' })
+    .then((response) => response.json())
+    .then((response) => {
+      if (response.status !== 'success' || slider.value !== binsize) {
+        return;
+      }
+      const data = response.data;
+      for (let j = 0; j < data.mjd.length; j++) {
+        const i = labels[`${data.instrument_id[j]} ${data.filter[j]}`];
+        const mjd = data.mjd[j];
+        if (i === undefined || mjd < plot_window[0] || mjd > plot_window[1]) {
+          continue;
+        }
+        const flux = (data.flux[j] === null) ? NaN : data.flux[j];
+        const fluxerr = data.fluxerr[j];
+        const detected = flux / fluxerr >= detect_thresh;
+        bins[i].push({
+          mjd,
+          flux,
+          fluxerr,
+          mag: detected ? -2.5 * Math.log10(flux) + data.zp[j] : NaN,
+          magerr: detected ? 2.5 / Math.log(10) * fluxerr / flux : NaN,
+          lim_mag: -2.5 * Math.log10(fluxerr * detect_thresh) + data.zp[j],
+          detected
+        });
+      }
+      callback(bins);
+    });
+}
+
+// Replace the data of a source of stacked points of legend label `i`.
+function setStacked(source, i, points) {
+  const light_curve = light_curves[i];
+  source.data = {
+    mjd: points.map((point) => point.mjd),
+    flux: points.map((point) => point.flux),
+    fluxerr: points.map((point) => point.fluxerr),
+    mag: points.map((point) => point.mag),
+    magerr: points.map((point) => point.magerr),
+    lim_mag: points.map((point) => point.lim_mag),
+    filter: points.map(() => light_curve.filter),
+    color: points.map(() => light_curve.color),
+    instrument: points.map(() => light_curve.instrument),
+    stacked: points.map(() => true)
+  };
+}
+
+// Replace the data of a source of error bars of legend label `i`.
+function setErrorBars(source, i, points, y, yerr) {
+  source.data = {
+    x: points.map((point) => point.mjd),
+    y0: points.map((point) => point[y] - point[yerr]),
+    y1: points.map((point) => point[y] + point[yerr]),
+    color: points.map(() => light_curves[i].color)
+  };
+}
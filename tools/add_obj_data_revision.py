@@ -0,0 +1,28 @@
+"""Add the `objs.data_revision` column, which keys the plot cache, to an
+existing database.
+
+Every query of objects selects the column, so this must run before the app
+is upgraded. Existing objects start at revision 0, and the script can be
+rerun.
+
+Usage: PYTHONPATH=. python tools/add_obj_data_revision.py
+"""
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status
+from skyportal.models import init_db, DBSession
+
+
+def add_data_revision():
+    # adding the column with a constant default does not rewrite the table
+    DBSession().execute('ALTER TABLE objs ADD COLUMN IF NOT EXISTS '
+                        'data_revision integer NOT NULL DEFAULT 0')
+    DBSession().commit()
+
+
+if __name__ == '__main__':
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+
+    with status('Adding objs.data_revision'):
+        add_data_revision()
@@ -0,0 +1,79 @@
+"""Micro-benchmark of the photometry plot construction.
+
+Times the error bar construction of `skyportal.plot` against the
+row-by-row loop it replaced, and `photometry_figure` as a whole, and
+reports the size of the plot payload, on a synthetic light curve. No
+database is needed.
+
+Usage: PYTHONPATH=. python tools/benchmark_photometry_plot.py [n_points]
+"""
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from skyportal.plot import error_bars, photometry_figure
+
+
+def synthetic_photometry(n):
+    """A light curve of `n` points in the three ZTF bands, in the format
+    returned by `skyportal.plot.photometry_data`."""
+    rng = np.random.default_rng(0)
+    fluxerr = 1 + rng.random(n)
+    flux = 20 + 10 * rng.random(n)
+    # a tenth of the points are non-detections
+    flux[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({
+        'id': np.arange(n),
+        'obj_id': 'ZTFbenchmark',
+        'mjd': np.sort(58000 + 365 * rng.random(n)),
+        'flux': flux,
+        'fluxerr': fluxerr,
+        'filter': rng.choice(['ztfg', 'ztfr', 'ztfi'], n),
+        'instrument_id': 1,
+        'instrument': 'ZTF',
+        'telescope': 'P48',
+        'ra': None, 'dec': None, 'ra_unc': None, 'dec_unc': None,
+        'original_user_data': None,
+        'altdata': None,
+        'origin': None,
+    })
+
+
+def iterrows_error_bars(df):
+    """The loop that `error_bars` replaced."""
+    y_err_x = []
+    y_err_y = []
+    for d, ro in df.iterrows():
+        px = ro['mjd']
+        py = ro['flux']
+        err = ro['fluxerr']
+        y_err_x.append((px, px))
+        y_err_y.append((py - err, py + err))
+    return y_err_x, y_err_y
+
+
+def best_of(function, repeat=5):
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    data = synthetic_photometry(n)
+    detected = data[data['flux'].notna()]
+
+    loop = best_of(lambda: iterrows_error_bars(detected))
+    vectorized = best_of(lambda: error_bars(detected['mjd'], detected['flux'],
+                                            detected['fluxerr']))
+    print(f'error bars, {len(detected)} points:')
+    print(f'  iterrows:   {1e3 * loop:8.2f} ms')
+    print(f'  error_bars: {1e3 * vectorized:8.2f} ms '
+          f'({loop / vectorized:.0f}x faster)')
+
+    figure = best_of(lambda: photometry_figure('ZTFbenchmark', data.copy()),
+                     repeat=3)
+    print(f'photometry_figure, {n} points: {1e3 * figure:8.2f} ms')
+
+    docs_json, render_items = photometry_figure('ZTFbenchmark', data.copy())
+    print(f'plot payload: {len(docs_json) / 1e6:.2f} MB')
@@ -0,0 +1,27 @@
+"""Add the `objs_last_detected_id_index` index used by the cursor pagination
+of sources and candidates to an existing database.
+
+Listings work without the index, but sort all matching objects on every
+page. Writes to objs wait while the index is built, and the script can be
+rerun.
+
+Usage: PYTHONPATH=. python tools/create_objs_last_detected_index.py
+"""
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status
+from skyportal.models import init_db, DBSession
+
+
+def create_index():
+    DBSession().execute('CREATE INDEX IF NOT EXISTS objs_last_detected_id_index '
+                        'ON objs (last_detected DESC NULLS LAST, id)')
+    DBSession().commit()
+
+
+if __name__ == '__main__':
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+
+    with status('Creating index objs_last_detected_id_index'):
+        create_index()
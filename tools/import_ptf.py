@@ -52,17 +52,6 @@ def import_table(ptf_table, skyportal_table, columns=None, column_map={},
         print("Ignored exception:", e)
 
 
-def normalize_spectrum(spectrum):
-    """TODO copied from PTF marshal; would prefer not to do this at plot-time
-    so for now I'm just copying the exact logic here.
-    """
-    inds = np.abs(spectrum.wavelengths - 6400) < 100
-    if inds.any():
-        spectrum.fluxes /= np.abs(np.median(spectrum.fluxes[inds]))
-    else:
-        spectrum.fluxes /= np.abs(np.median(spectrum.fluxes))
-
-
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser()
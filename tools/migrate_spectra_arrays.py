@@ -0,0 +1,82 @@
+"""Convert the wavelengths, fluxes and errors of the spectra table from the
+`float8[]` columns of `NumpyArray` to the `bytea` columns of
+`skyportal.models.BinaryArray`.
+
+`BinaryArray` reads either column type, so the app can be upgraded before
+running this, and spectra stay readable throughout. Spectra cannot be
+written, however, from the upgrade of the app until this script has
+finished: `BinaryArray` always writes `bytea`, which the `float8[]` columns
+reject, and the columns are converted one at a time. Stop uploading
+spectra for the duration. Columns are converted in batches, and the
+migration can be interrupted and rerun.
+
+Usage: PYTHONPATH=. python tools/migrate_spectra_arrays.py [--batch-size N]
+"""
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status
+from skyportal.models import init_db, DBSession, Spectrum
+
+
+ARRAY_COLUMNS = ['wavelengths', 'fluxes', 'errors']
+
+
+def column_type(column):
+    return DBSession().execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'spectra' AND column_name = :column",
+        {'column': column}
+    ).scalar()
+
+
+def migrate_column(column, batch_size):
+    """Fill a new `bytea` copy of a column batch by batch, then swap it in."""
+    if column_type(column) != 'ARRAY':
+        print(f'spectra.{column} is already migrated')
+        return
+
+    encoder = Spectrum.__table__.c[column].type
+    binary_column = f'{column}_binary'
+    DBSession().execute(f'ALTER TABLE spectra ADD COLUMN IF NOT EXISTS '
+                        f'{binary_column} bytea')
+    DBSession().commit()
+
+    while True:
+        rows = DBSession().execute(
+            f'SELECT id, {column} FROM spectra WHERE {column} IS NOT NULL '
+            f'AND {binary_column} IS NULL ORDER BY id LIMIT :limit',
+            {'limit': batch_size}
+        ).fetchall()
+        if not rows:
+            break
+        DBSession().execute(
+            f'UPDATE spectra SET {binary_column} = :value WHERE id = :id',
+            [{'id': spectrum_id,
+              'value': encoder.process_bind_param(values, None)}
+             for spectrum_id, values in rows]
+        )
+        DBSession().commit()
+        print(f'    converted {len(rows)} values of spectra.{column}')
+
+    DBSession().execute(f'ALTER TABLE spectra DROP COLUMN {column}')
+    DBSession().execute(f'ALTER TABLE spectra RENAME COLUMN {binary_column} '
+                        f'TO {column}')
+    if not Spectrum.__table__.c[column].nullable:
+        DBSession().execute(f'ALTER TABLE spectra ALTER COLUMN {column} '
+                            'SET NOT NULL')
+    DBSession().commit()
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='number of spectra converted per transaction')
+    args, _ = parser.parse_known_args()
+
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+
+    for column in ARRAY_COLUMNS:
+        with status(f'Migrating spectra.{column}'):
+            migrate_column(column, args.batch_size)
@@ -0,0 +1,54 @@
+"""Add the indexed `objs.healpix` column used by cone searches to an existing
+database, and fill it in for objects created before it existed.
+
+New and updated objects get their index from the model, so the app can be
+upgraded before running this; until it has run, older objects are missing
+from cone searches. Objects are indexed in batches, and the script can be
+interrupted and rerun.
+
+Usage: PYTHONPATH=. python tools/populate_obj_healpix.py [--batch-size N]
+"""
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status
+from skyportal.models import init_db, DBSession
+from skyportal.utils.healpix import radec_to_healpix
+
+
+def populate_healpix(batch_size):
+    DBSession().execute('ALTER TABLE objs ADD COLUMN IF NOT EXISTS '
+                        'healpix bigint')
+    DBSession().execute('CREATE INDEX IF NOT EXISTS ix_objs_healpix '
+                        'ON objs (healpix)')
+    DBSession().commit()
+
+    while True:
+        rows = DBSession().execute(
+            'SELECT id, ra, dec FROM objs WHERE healpix IS NULL '
+            'AND ra IS NOT NULL AND dec IS NOT NULL LIMIT :limit',
+            {'limit': batch_size}
+        ).fetchall()
+        if not rows:
+            break
+        ids, ra, dec = zip(*rows)
+        DBSession().execute(
+            'UPDATE objs SET healpix = :healpix WHERE id = :id',
+            [{'id': obj_id, 'healpix': int(healpix)}
+             for obj_id, healpix in zip(ids, radec_to_healpix(ra, dec))]
+        )
+        DBSession().commit()
+        print(f'    indexed {len(rows)} objects')
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='number of objects indexed per transaction')
+    args, _ = parser.parse_known_args()
+
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+
+    with status('Indexing objs.healpix'):
+        populate_healpix(args.batch_size)
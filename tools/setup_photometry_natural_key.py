@@ -0,0 +1,64 @@
+"""Add the `photometry.origin` column and the `photometry_natural_key`
+unique constraint used by `POST /api/photometry?mode=upsert` to an existing
+database.
+
+The constraint cannot be created while several points share the same
+object, instrument, filter, MJD and (non-null) origin, so such duplicates
+are merged first: the most recently modified point of each group is kept,
+the thumbnails of the others are moved to it, and the others are deleted.
+Points with a null origin never conflict and are left alone. Run it before
+uploading in upsert mode; the script can be rerun.
+
+Usage: PYTHONPATH=. python tools/setup_photometry_natural_key.py
+"""
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status
+from skyportal.models import init_db, DBSession
+
+
+# for each point sharing its natural key with another, the point kept
+DUPLICATES = """
+SELECT id, first_value(id) OVER (
+    PARTITION BY obj_id, instrument_id, filter, mjd, origin
+    ORDER BY modified DESC, id DESC
+) AS kept_id
+FROM photometry
+WHERE origin IS NOT NULL
+"""
+
+
+def setup_natural_key():
+    DBSession().execute('ALTER TABLE photometry ADD COLUMN IF NOT EXISTS '
+                        'origin varchar')
+    DBSession().execute('LOCK TABLE photometry IN SHARE ROW EXCLUSIVE MODE')
+    exists = DBSession().execute(
+        "SELECT 1 FROM pg_constraint WHERE conname = 'photometry_natural_key'"
+    ).scalar()
+    if not exists:
+        DBSession().execute(
+            'CREATE TEMPORARY TABLE photometry_duplicates ON COMMIT DROP AS '
+            f'SELECT * FROM ({DUPLICATES}) AS d WHERE id != kept_id'
+        )
+        DBSession().execute(
+            'UPDATE thumbnails SET photometry_id = d.kept_id '
+            'FROM photometry_duplicates AS d WHERE thumbnails.photometry_id = d.id'
+        )
+        deleted = DBSession().execute(
+            'DELETE FROM photometry USING photometry_duplicates AS d '
+            'WHERE photometry.id = d.id'
+        ).rowcount
+        print(f'    merged {deleted} duplicate points')
+        DBSession().execute(
+            'ALTER TABLE photometry ADD CONSTRAINT photometry_natural_key '
+            'UNIQUE (obj_id, instrument_id, filter, mjd, origin)'
+        )
+    DBSession().commit()
+
+
+if __name__ == '__main__':
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+
+    with status('Setting up the photometry natural key'):
+        setup_natural_key()
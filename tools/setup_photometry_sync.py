@@ -0,0 +1,35 @@
+"""Add the change cursor columns and the tombstone trigger used by
+incremental light curve syncs (`since` in `GET /api/sources/<id>/photometry`)
+to an existing database.
+
+Existing points and tombstones get a cursor of 0, older than any cursor
+handed to clients, so they are only returned to clients starting from a
+timestamp. The script can be rerun.
+
+Usage: PYTHONPATH=. python tools/setup_photometry_sync.py
+"""
+from baselayer.app.env import load_env
+from baselayer.app.model_util import status
+from skyportal.models import init_db, DBSession, PHOTOMETRY_TOMBSTONE_DDL
+
+
+def setup_photometry_sync():
+    for table in ['photometry', 'deleted_photometry']:
+        # adding the column with a constant default does not rewrite the table
+        DBSession().execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS '
+                            'txid bigint NOT NULL DEFAULT 0')
+        DBSession().execute(f'ALTER TABLE {table} ALTER COLUMN txid '
+                            'SET DEFAULT txid_current()')
+        DBSession().execute(f'CREATE INDEX IF NOT EXISTS {table}_obj_id_txid_index '
+                            f'ON {table} (obj_id, txid)')
+    DBSession().execute(PHOTOMETRY_TOMBSTONE_DDL)
+    DBSession().commit()
+
+
+if __name__ == '__main__':
+    env, cfg = load_env()
+    with status(f"Connecting to database {cfg['database']['database']}"):
+        init_db(**cfg['database'])
+
+    with status('Setting up incremental photometry syncs'):
+        setup_photometry_sync()
@@ -43,7 +43,7 @@ from social_tornado.models import TornadoStorage
 from skyportal.models import (init_db, Base, DBSession, ACL, Comment,
                               Instrument, Group, GroupUser, Photometry, Role,
                               Source, Spectrum, Telescope, Thumbnail, User,
-                              Token)
+                              Token, bump_data_revision)
 
 from avro.datafile import DataFileReader, DataFileWriter
 from avro.io import DatumReader, DatumWriter
@@ -282,6 +282,10 @@ class ZTFAvro():
             s.is_roid = is_roid
             s.transient = self._is_transient(dflc)
 
+            if not skip:
+                # invalidate cached plots of the source
+                bump_data_revision([packet["objectId"]])
+
             DBSession().add(s)
             try:
                 DBSession().commit()